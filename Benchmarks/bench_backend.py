@@ -0,0 +1,98 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Compares the process and thread backends of the parts engine,
+ with and without reading tile files ahead, for tiles stored as they are
+ (-imagery source) and tiles encoded again (-imagery png).  Point -folder
+ at a directory on the disk or network share to measure, the tiles are
+ written there and removed afterwards.
+
+ Usage: python -m Benchmarks.bench_backend [-tiles N] [-folder DIR] [-read_ahead N]
+"""
+from argparse import ArgumentParser
+from io import BytesIO
+from os import makedirs
+from os.path import join
+from random import Random
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from PIL import Image
+
+from scripts.common.telemetry import Telemetry
+from scripts.packaging.tiles2gpkg_parallel import build_lut, file_count, write_worker_dbs
+
+SRS = 4326
+
+
+def make_tiles(folder, tiles, seed=1):
+    """Writes tiles noisy 256x256 JPEG tiles in z/x/y.jpg folders, returns their base folder."""
+    random = Random(seed)
+    base = join(folder, "tiles")
+    zoom = 1
+    while 2 ** (2 * zoom + 1) < tiles:
+        zoom += 1
+    columns = 2 ** (zoom + 1)
+    for index in range(tiles):
+        x, y = index // (columns // 2), index % (columns // 2)
+        if y == 0:
+            makedirs(join(base, str(zoom), str(x)))
+        img = Image.new("RGB", (256, 256), (random.randrange(256), random.randrange(256), random.randrange(256)))
+        img.putdata([(value, value, value) for value in bytearray(random.getrandbits(8) for _ in range(4096))] * 16)
+        buf = BytesIO()
+        img.save(buf, "JPEG", quality=75)
+        with open(join(base, str(zoom), str(x), "{0}.jpg".format(y)), 'wb') as tile_file:
+            tile_file.write(buf.getvalue())
+    return base
+
+
+def time_backend(base, folder, imagery, backend, read_ahead):
+    """Returns the seconds write_worker_dbs takes to write the .gpkg.part files of the tiles in base."""
+    files = file_count(base)
+    parts = mkdtemp(dir=folder)
+    try:
+        extra_args = dict(root_dir=parts, tile_info=build_lut(files, True, SRS), lower_left=True, srs=SRS,
+                          imagery=imagery, jpeg_quality=75, nsg_profile=False, renumber=False, table_name="tiles",
+                          backend=backend, read_ahead=read_ahead)
+        start = time()
+        write_worker_dbs(files, extra_args, True, Telemetry(stream=None))
+        return time() - start
+    finally:
+        rmtree(parts)
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark the parts engine worker backends")
+    PARSER.add_argument("-tiles", type=int, default=4000)
+    PARSER.add_argument("-folder", default=None, help="Directory the tiles are written to, a temporary one by default")
+    PARSER.add_argument("-read_ahead", type=int, default=32)
+    ARGS = PARSER.parse_args()
+    FOLDER = mkdtemp(dir=ARGS.folder)
+    try:
+        BASE = make_tiles(FOLDER, ARGS.tiles)
+        print("{0} JPEG tiles in {1}".format(ARGS.tiles, FOLDER))
+        for IMAGERY in ("source", "png"):
+            for BACKEND in ("process", "thread"):
+                for READ_AHEAD in (0, ARGS.read_ahead):
+                    SECONDS = time_backend(BASE, FOLDER, IMAGERY, BACKEND, READ_AHEAD)
+                    print("-imagery {0:6} {1:7} read ahead {2:3d}: {3:7.2f} s  {4:8.0f} tiles/s".format(
+                        IMAGERY, BACKEND, READ_AHEAD, SECONDS, ARGS.tiles / SECONDS))
+    finally:
+        rmtree(FOLDER)
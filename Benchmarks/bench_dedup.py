@@ -0,0 +1,91 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+
+Description: Measures the -dedup encode cache of tiles2gpkg_parallel on a
+ synthetic pyramid of PNG tiles in which a share of the tiles are solid
+ colour, as ocean and nodata tiles are.  Also reports how much smaller the
+ tile data would be if every unique payload were only stored once.
+
+ Usage: python -m Benchmarks.bench_dedup [-tiles N] [-duplicates 0.6] [-imagery jpeg]
+"""
+from argparse import ArgumentParser
+from hashlib import sha1
+from os import urandom
+from os.path import join
+from random import Random
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from PIL.Image import frombytes, new
+
+from scripts.packaging import tiles2gpkg_parallel
+from scripts.packaging.tiles2gpkg_parallel import build_lut, encode_tile_bytes
+
+COLOURS = [(0, 51, 102), (0, 0, 0), (255, 255, 255), (170, 211, 223)]
+
+
+def make_tiles(folder, count, duplicates, seed=0):
+    """Writes count PNG tiles of zoom 8, a duplicates share of them solid colour."""
+    random = Random(seed)
+    file_list = []
+    for index in range(count):
+        x, y = divmod(index, 256)
+        path = join(folder, "{0}_{1}.png".format(x, y))
+        if random.random() < duplicates:
+            new("RGB", (256, 256), random.choice(COLOURS)).save(path, "PNG")
+        else:
+            # coarse noise, so the tile does not compress to nothing
+            frombytes("RGB", (32, 32), urandom(32 * 32 * 3)).resize((256, 256)).save(path, "PNG")
+        file_list.append(dict(z=8, x=x, y=y, path=path))
+    return file_list
+
+
+def run(file_list, imagery, dedup):
+    """Encodes file_list, returning (seconds, payload hashes and sizes)."""
+    tiles2gpkg_parallel.ENCODE_CACHE = None
+    extra_args = dict(tile_info=build_lut(file_list, True, 3857), imagery=imagery, jpeg_quality=75,
+                      nsg_profile=False, renumber=False, dedup=dedup)
+    start = time()
+    payloads = [encode_tile_bytes(tile, extra_args, None)[3] for tile in file_list]
+    return time() - start, payloads
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark the tiles2gpkg -dedup encode cache")
+    PARSER.add_argument("-tiles", type=int, default=2000)
+    PARSER.add_argument("-duplicates", type=float, default=0.6, help="Share of solid colour tiles")
+    PARSER.add_argument("-imagery", default="jpeg", choices=["jpeg", "png", "mixed"])
+    ARGS = PARSER.parse_args()
+    FOLDER = mkdtemp()
+    try:
+        FILES = make_tiles(FOLDER, ARGS.tiles, ARGS.duplicates)
+        PLAIN, _ = run(FILES, ARGS.imagery, False)
+        DEDUP, PAYLOADS = run(FILES, ARGS.imagery, True)
+    finally:
+        rmtree(FOLDER)
+    TOTAL = sum(len(payload) for payload in PAYLOADS)
+    UNIQUE = sum(len(payload) for payload in dict((sha1(payload).digest(), payload) for payload in PAYLOADS).values())
+    CACHE = tiles2gpkg_parallel.ENCODE_CACHE
+    print("{0} tiles, {1:.0%} solid colour, -imagery {2}".format(len(FILES), ARGS.duplicates, ARGS.imagery))
+    print("encode:       {0:8.2f} s  {1:8.0f} tiles/s".format(PLAIN, len(FILES) / PLAIN))
+    print("encode -dedup:{0:8.2f} s  {1:8.0f} tiles/s  ({2} cache hits)".format(DEDUP, len(FILES) / DEDUP, CACHE.hits))
+    print("tile data:    {0:8.1f} MB stored, {1:.1f} MB if each unique payload were stored once".format(
+        TOTAL / 1048576.0, UNIQUE / 1048576.0))
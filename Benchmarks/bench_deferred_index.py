@@ -0,0 +1,88 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Compares writing tiles that arrive in random order, as they do
+ from the workers of the stream engine, straight into the tiles table with
+ insert_tiles against a bulk load through the index free staging table
+ (Geopackage.begin_bulk_load / finish_bulk_load).
+
+ Usage: python -m Benchmarks.bench_deferred_index [-tiles N] [-duplicates F] [-cache_size N]
+"""
+from argparse import ArgumentParser
+from os import urandom
+from os.path import join
+from random import Random
+from shutil import rmtree
+from sqlite3 import Binary
+from tempfile import mkdtemp
+from time import time
+
+from scripts.geopackage.geopackage import Geopackage
+from scripts.geopackage.utility.write_profile import BULK_LOAD, WRITE_PROFILES
+
+TABLE_NAME = "tiles"
+SRS = 3857
+
+
+def make_tiles(count, tile_bytes, duplicates, seed):
+    """Returns count (z, x, y, data) tuples in random order, a fraction of them written twice."""
+    random = Random(seed)
+    data = Binary(urandom(tile_bytes))
+    side = int(count ** 0.5) + 1
+    keys = [(18, index // side, index % side) for index in range(count)]
+    keys.extend(random.sample(keys, int(count * duplicates)))
+    random.shuffle(keys)
+    return [(z, x, y, data) for z, x, y in keys]
+
+
+def time_load(tiles, deferred, profile):
+    """Returns the seconds taken to load tiles, directly or through the staging table."""
+    folder = mkdtemp()
+    try:
+        with Geopackage(join(folder, "out.gpkg"), SRS, TABLE_NAME, profile) as gpkg:
+            gpkg.initialize()
+            start = time()
+            if deferred:
+                gpkg.begin_bulk_load()
+            gpkg.insert_tiles(tiles)
+            if deferred:
+                gpkg.finish_bulk_load()
+            return time() - start
+    finally:
+        rmtree(folder)
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark deferred index builds")
+    PARSER.add_argument("-tiles", type=int, default=500000)
+    PARSER.add_argument("-tile_bytes", type=int, default=100)
+    PARSER.add_argument("-duplicates", type=float, nargs="+", default=[0.0, 0.1],
+                        help="Fractions of the tiles written a second time")
+    PARSER.add_argument("-cache_size", type=int, default=WRITE_PROFILES[BULK_LOAD].cache_size,
+                        help="SQLite cache_size, lower it to see what happens once the index outgrows the cache")
+    ARGS = PARSER.parse_args()
+    PROFILE = WRITE_PROFILES[BULK_LOAD].copy(cache_size=ARGS.cache_size)
+    print("{0} tiles of {1} bytes in random order, cache_size {2}".format(ARGS.tiles, ARGS.tile_bytes,
+                                                                          ARGS.cache_size))
+    for DUPLICATES in ARGS.duplicates:
+        TILES = make_tiles(ARGS.tiles, ARGS.tile_bytes, DUPLICATES, 1)
+        DIRECT = time_load(TILES, False, PROFILE)
+        DEFERRED = time_load(TILES, True, PROFILE)
+        print("{0:4.0%} duplicates: insert_tiles {1:7.2f} s  bulk load {2:7.2f} s  speedup {3:5.2f}x"
+              .format(DUPLICATES, DIRECT, DEFERRED, DIRECT / DEFERRED))
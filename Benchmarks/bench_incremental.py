@@ -0,0 +1,88 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Times a full tiles2gpkg run, encoding PNG tiles as JPEGs,
+ against an incremental run of the same tile folder after a fraction of
+ its tiles were rewritten, and one after nothing changed.
+
+ Usage: python -m Benchmarks.bench_incremental [-zoom N] [-changed F]
+"""
+from argparse import Namespace, ArgumentParser
+from os import makedirs, utime
+from os.path import join
+from random import Random
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from PIL.Image import new
+
+from scripts.packaging.tiles2gpkg_parallel import main
+
+
+def write_tile(path, seed):
+    """Writes a small PNG tile whose colour depends on seed."""
+    new("RGB", (256, 256), (seed % 256, (seed // 256) % 256, 128)).save(path, "PNG")
+
+
+def make_folder(folder, zoom):
+    """Writes every tile of a zoom level and returns their paths."""
+    paths = []
+    for x in range(2 ** zoom):
+        column = join(folder, str(zoom), str(x))
+        makedirs(column)
+        for y in range(2 ** zoom):
+            paths.append(join(column, "{0}.png".format(y)))
+            write_tile(paths[-1], len(paths))
+    return paths
+
+
+def time_run(source, output_file, incremental, threading):
+    """Returns the seconds taken by one tiles2gpkg run."""
+    arg_list = Namespace(source_folder=source, output_file=output_file, tileorigin="ll", srs=3857,
+                         imagery="jpeg", q=75, threading=threading, nsg_profile=False, renumber=False,
+                         table_name="tiles", incremental=incremental)
+    start = time()
+    main(arg_list)
+    return time() - start
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark incremental tiles2gpkg runs")
+    PARSER.add_argument("-zoom", type=int, default=7)
+    PARSER.add_argument("-changed", type=float, default=0.01, help="Fraction of the tiles rewritten")
+    PARSER.add_argument("-T", dest="threading", action="store_false", default=True)
+    ARGS = PARSER.parse_args()
+    FOLDER = mkdtemp()
+    try:
+        SOURCE = join(FOLDER, "tiles")
+        PATHS = make_folder(SOURCE, ARGS.zoom)
+        FULL = time_run(SOURCE, join(FOLDER, "full.gpkg"), False, ARGS.threading)
+        OUTPUT = join(FOLDER, "incremental.gpkg")
+        FIRST = time_run(SOURCE, OUTPUT, True, ARGS.threading)
+        for INDEX, PATH in enumerate(Random(1).sample(PATHS, int(len(PATHS) * ARGS.changed))):
+            write_tile(PATH, INDEX + 7)
+            utime(PATH, (1, 1))
+        CHANGED = time_run(SOURCE, OUTPUT, True, ARGS.threading)
+        UNCHANGED = time_run(SOURCE, OUTPUT, True, ARGS.threading)
+        print("{0} tiles, {1:.0%} changed".format(len(PATHS), ARGS.changed))
+        print("full run {0:.2f} s, first incremental run {1:.2f} s, after the change {2:.2f} s, "
+              "unchanged {3:.2f} s".format(FULL, FIRST, CHANGED, UNCHANGED))
+    finally:
+        rmtree(FOLDER)
@@ -0,0 +1,108 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Compares merging .gpkg.part files one connection and one
+ INSERT OR REPLACE per part, as Geopackage.assimilate used to, against
+ Geopackage.merge_parts, for several part counts.
+
+ Usage: python -m Benchmarks.bench_merge [-tiles N] [-parts 8 32 64]
+"""
+from argparse import ArgumentParser
+from glob import glob
+from os import remove, urandom
+from os.path import join
+from shutil import rmtree
+from sqlite3 import Binary
+from tempfile import mkdtemp
+from time import time
+
+from scripts.geopackage.geopackage import Geopackage
+from scripts.geopackage.utility.sql_utility import get_database_connection
+from scripts.geopackage.utility.write_profile import WriteProfile
+from scripts.packaging.temp_db import TempDB
+
+TABLE_NAME = "tiles"
+SRS = 3857
+MERGE_PROFILE = WriteProfile(journal_mode='OFF', synchronous='OFF')
+
+
+def make_parts(folder, tiles, parts, tile_bytes):
+    """
+    Writes parts .gpkg.part files holding consecutive, disjoint ranges of a
+    z/x/y sorted list of tiles, as the chunked workers of tiles2gpkg do.
+    """
+    data = Binary(urandom(tile_bytes))
+    side = int(tiles ** 0.5) + 1
+    coordinates = [(18, index // side, index % side) for index in range(tiles)]
+    size = (tiles + parts - 1) // parts
+    for start in range(0, tiles, size):
+        with TempDB(folder, TABLE_NAME) as temp_db:
+            temp_db.insert_image_blobs((z, x, y, data) for z, x, y in coordinates[start:start + size])
+
+
+def assimilate_each(gpkg_path, sources):
+    """The former Geopackage.assimilate, one new connection per part."""
+    for source in sources:
+        db_con = get_database_connection(gpkg_path)
+        db_con.isolation_level = None
+        cursor = db_con.cursor()
+        cursor.execute("pragma synchronous = off;")
+        cursor.execute("pragma journal_mode = off;")
+        cursor.execute("pragma page_size = 65536;")
+        cursor.execute("attach '" + source + "' as source;")
+        cursor.execute("""INSERT OR REPLACE INTO '{0}' (zoom_level, tile_column, tile_row, tile_data)
+                          SELECT zoom_level, tile_column, tile_row, tile_data FROM source.'{0}';"""
+                       .format(TABLE_NAME))
+        cursor.execute("detach source;")
+        db_con.close()
+        remove(source)
+
+
+def time_merge(method, tiles, parts, tile_bytes):
+    """Returns the seconds taken to merge parts part files with method."""
+    folder = mkdtemp()
+    try:
+        make_parts(folder, tiles, parts, tile_bytes)
+        # glob order, not tile order, like combine_worker_dbs
+        sources = glob(join(folder, "*.gpkg.part"))
+        # the pragmas assimilate used to set, and a connection assimilate_each can share the file with
+        with Geopackage(join(folder, "out.gpkg"), SRS, TABLE_NAME, MERGE_PROFILE) as gpkg:
+            gpkg.initialize()
+            start = time()
+            if method == "assimilate":
+                assimilate_each(gpkg.file_path, sources)
+            else:
+                gpkg.merge_parts(sources)
+            return time() - start
+    finally:
+        rmtree(folder)
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark merging .gpkg.part files")
+    PARSER.add_argument("-tiles", type=int, default=64000)
+    PARSER.add_argument("-tile_bytes", type=int, default=8000)
+    PARSER.add_argument("-parts", type=int, nargs="+", default=[8, 32, 64])
+    ARGS = PARSER.parse_args()
+    print("{0} tiles of {1} bytes".format(ARGS.tiles, ARGS.tile_bytes))
+    for PARTS in ARGS.parts:
+        OLD = time_merge("assimilate", ARGS.tiles, PARTS, ARGS.tile_bytes)
+        NEW = time_merge("merge_parts", ARGS.tiles, PARTS, ARGS.tile_bytes)
+        print("{0:3d} parts: assimilate {1:7.2f} s  merge_parts {2:7.2f} s  speedup {3:5.2f}x"
+              .format(PARTS, OLD, NEW, OLD / NEW))
@@ -0,0 +1,127 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Compares wall-clock time and peak disk usage of the 'parts'
+ and 'stream' packaging engines of tiles2gpkg_parallel on a synthetic
+ JPEG pyramid.
+
+ Usage: python -m Benchmarks.bench_packaging_engines [-zoom N] [-imagery jpeg]
+"""
+from argparse import ArgumentParser
+from multiprocessing import cpu_count
+from os import listdir, makedirs, urandom
+from os.path import getsize, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Event, Thread
+from time import time
+
+from PIL.Image import frombytes
+
+from scripts.geopackage.geopackage import Geopackage
+from scripts.geopackage.utility.write_profile import BULK_LOAD
+from scripts.packaging.tiles2gpkg_parallel import build_lut, write_worker_dbs, combine_worker_dbs, stream_tiles
+
+TABLE_NAME = "tiles"
+SRS = 3857
+
+
+def make_pyramid(base_dir, max_zoom):
+    """Writes a full z/x/y.jpg pyramid of noise tiles and returns its file list."""
+    file_list = []
+    for z in range(1, max_zoom + 1):
+        for x in range(2 ** z):
+            column_dir = join(base_dir, str(z), str(x))
+            makedirs(column_dir)
+            for y in range(2 ** z):
+                path = join(column_dir, "{0}.jpg".format(y))
+                frombytes("RGB", (256, 256), urandom(256 * 256 * 3)).save(path, "JPEG")
+                file_list.append(dict(z=z, x=x, y=y, path=path))
+    return file_list
+
+
+class DiskSampler(Thread):
+    """Samples the total size of the files in a directory until stopped."""
+
+    def __init__(self, folder):
+        super(DiskSampler, self).__init__()
+        self.daemon = True
+        self.folder = folder
+        self.peak = 0
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            total = 0
+            for name in listdir(self.folder):
+                try:
+                    total += getsize(join(self.folder, name))
+                except OSError:
+                    pass
+            self.peak = max(self.peak, total)
+            self.stopped.wait(0.02)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+
+def run_engine(engine, file_list, imagery):
+    """Packages file_list with engine, returning (seconds, peak bytes on disk)."""
+    out_dir = mkdtemp()
+    extra_args = dict(root_dir=out_dir, tile_info=build_lut(file_list, True, SRS), lower_left=True, srs=SRS,
+                      imagery=imagery, jpeg_quality=75, nsg_profile=False, renumber=False, table_name=TABLE_NAME)
+    sampler = DiskSampler(out_dir)
+    sampler.start()
+    start = time()
+    try:
+        if engine == 'stream':
+            with Geopackage(join(out_dir, "out.gpkg"), SRS, TABLE_NAME, BULK_LOAD) as gpkg:
+                gpkg.initialize()
+                stream_tiles(gpkg, file_list, extra_args, cpu_count())
+                gpkg.update_metadata(extra_args['tile_info'])
+        else:
+            write_worker_dbs(file_list, extra_args, True)
+            with Geopackage(join(out_dir, "out.gpkg"), SRS, TABLE_NAME, BULK_LOAD) as gpkg:
+                gpkg.initialize()
+                combine_worker_dbs(gpkg)
+                gpkg.update_metadata(extra_args['tile_info'])
+        elapsed = time() - start
+        return elapsed, sampler.stop()
+    finally:
+        sampler.stop()
+        rmtree(out_dir)
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark the tiles2gpkg packaging engines")
+    PARSER.add_argument("-zoom", type=int, default=6, help="Deepest zoom level of the synthetic pyramid")
+    PARSER.add_argument("-imagery", default="jpeg", choices=["jpeg", "png", "source"])
+    ARGS = PARSER.parse_args()
+    SOURCE = mkdtemp()
+    try:
+        FILES = make_pyramid(SOURCE, ARGS.zoom)
+        RESULTS = [(engine,) + run_engine(engine, FILES, ARGS.imagery) for engine in ("parts", "stream")]
+    finally:
+        rmtree(SOURCE)
+    print("")
+    print("{0} tiles, {1} cores, -imagery {2}".format(len(FILES), cpu_count(), ARGS.imagery))
+    for ENGINE, SECONDS, PEAK in RESULTS:
+        print("{0:>7}: {1:8.2f} s  {2:10.1f} MB peak on disk".format(ENGINE, SECONDS, PEAK / 1048576.0))
@@ -0,0 +1,104 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Compares reading tile files with a buffered open().read(), as
+ the raw path of tiles2gpkg used to, against read_ahead.read_file(), which
+ reads them unbuffered into a bytearray of their size.  Reports the time
+ and the peak memory allocated per tile, and the time to store the tiles
+ with TempDB.insert_image_blobs.
+
+ Usage: python -m Benchmarks.bench_raw_read [-tiles N] [-tile_bytes N]
+"""
+from argparse import ArgumentParser
+from os import urandom
+from os.path import join
+from shutil import rmtree
+from sqlite3 import Binary
+from tempfile import mkdtemp
+from time import time
+
+from scripts.packaging.read_ahead import read_file
+from scripts.packaging.temp_db import TempDB
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def buffered_read(path):
+    """The former raw path read."""
+    with open(path, 'rb') as file_handle:
+        return file_handle.read()
+
+
+def peak_bytes(read, path):
+    """Returns the peak bytes allocated reading path once, None without tracemalloc."""
+    if tracemalloc is None:
+        return None
+    read(path)
+    tracemalloc.start()
+    try:
+        read(path)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def time_reads(read, paths, repeat):
+    """Returns the best time of repeat passes reading every file."""
+    best = None
+    for _ in range(repeat):
+        start = time()
+        for path in paths:
+            read(path)
+        seconds = time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def time_inserts(read, paths, folder):
+    """Returns the seconds taken to read every file and store it in a .gpkg.part file."""
+    with TempDB(folder, "tiles") as temp_db:
+        start = time()
+        temp_db.insert_image_blobs((1, index, 0, Binary(read(path))) for index, path in enumerate(paths))
+        return time() - start
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark the raw tile read path")
+    PARSER.add_argument("-tiles", type=int, default=5000)
+    PARSER.add_argument("-tile_bytes", type=int, default=20000)
+    PARSER.add_argument("-repeat", type=int, default=5)
+    ARGS = PARSER.parse_args()
+    FOLDER = mkdtemp()
+    try:
+        PATHS = [join(FOLDER, "{0}.png".format(index)) for index in range(ARGS.tiles)]
+        for PATH in PATHS:
+            with open(PATH, 'wb') as tile_file:
+                tile_file.write(urandom(ARGS.tile_bytes))
+        print("{0} tiles of {1} bytes, page cache warm".format(ARGS.tiles, ARGS.tile_bytes))
+        for NAME, READ in (("open().read()", buffered_read), ("read_file()", read_file)):
+            SECONDS = time_reads(READ, PATHS, ARGS.repeat)
+            PEAK = peak_bytes(READ, PATHS[0])
+            INSERT = time_inserts(READ, PATHS, FOLDER)
+            print("{0:>14}: {1:6.2f} us/tile read  {2:>7} bytes peak/tile  {3:6.2f} s read and insert".format(
+                NAME, SECONDS / ARGS.tiles * 1e6, PEAK if PEAK is not None else "n/a", INSERT))
+    finally:
+        rmtree(FOLDER)
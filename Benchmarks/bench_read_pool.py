@@ -0,0 +1,131 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Compares three ways for a threaded tile server to read a
+ GeoPackage: one connection shared by every thread behind a lock, a new
+ connection per request, and a TileReader over a ReadConnectionPool, at
+ 1, 8 and 32 threads.  Every thread reads random tiles, with the tile
+ cache off, and the reads per second and p99 latency are reported.
+
+ Usage: python -m Benchmarks.bench_read_pool [-zoom N] [-reads N] [-threads 1 8 32]
+"""
+from argparse import ArgumentParser
+from os import urandom
+from os.path import join
+from random import Random
+from shutil import rmtree
+from sqlite3 import Binary, connect
+from tempfile import mkdtemp
+from threading import Lock, Thread
+from timeit import default_timer as timer
+
+from scripts.geopackage.geopackage import Geopackage
+from scripts.geopackage.tiles.tile_reader import TileReader
+from scripts.geopackage.utility.connection_pool import ReadConnectionPool
+from scripts.geopackage.utility.sql_utility import get_database_connection
+from scripts.geopackage.utility.write_profile import BULK_LOAD
+
+TABLE_NAME = "tiles"
+SRS = 3857
+QUERY = """SELECT tile_data FROM "{0}" WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?;""".format(TABLE_NAME)
+
+
+def make_geopackage(file_path, zoom, tile_bytes):
+    """Writes every tile of a zoom level."""
+    side = 2 ** zoom
+    with Geopackage(file_path, SRS, TABLE_NAME, BULK_LOAD) as gpkg:
+        gpkg.initialize()
+        gpkg.insert_tiles((zoom, x, y, Binary(urandom(tile_bytes))) for x in range(side) for y in range(side))
+
+
+def shared_reader(file_path):
+    """Returns a read(z, x, y) function sharing one connection behind a lock, and a close function."""
+    db_con = connect(file_path, check_same_thread=False)
+    lock = Lock()
+
+    def read(zoom, column, row):
+        with lock:
+            return db_con.execute(QUERY, (zoom, column, row)).fetchone()[0]
+    return read, db_con.close
+
+
+def reconnecting_reader(file_path):
+    """Returns a read(z, x, y) function opening a connection per call, and a close function."""
+    def read(zoom, column, row):
+        db_con = get_database_connection(file_path)
+        try:
+            return db_con.execute(QUERY, (zoom, column, row)).fetchone()[0]
+        finally:
+            db_con.close()
+    return read, lambda: None
+
+
+def pooled_reader(file_path):
+    """Returns the get_tile of a TileReader over a ReadConnectionPool, and its close function."""
+    reader = TileReader(file_path, 0, ReadConnectionPool(file_path, immutable=True))
+    return lambda zoom, column, row: reader.get_tile(TABLE_NAME, zoom, column, row), reader.close
+
+
+def run(make_reader, file_path, zoom, threads, reads):
+    """Returns (reads per second, p99 latency in microseconds) of threads threads reading reads tiles each."""
+    read, close = make_reader(file_path)
+    latencies = []
+
+    def work(seed):
+        random = Random(seed)
+        side = 2 ** zoom
+        mine = []
+        for _ in range(reads):
+            start = timer()
+            read(zoom, random.randrange(side), random.randrange(side))
+            mine.append(timer() - start)
+        latencies.extend(mine)
+
+    workers = [Thread(target=work, args=(seed,)) for seed in range(threads)]
+    start = timer()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = timer() - start
+    close()
+    latencies.sort()
+    return len(latencies) / seconds, latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark concurrent GeoPackage reads")
+    PARSER.add_argument("-zoom", type=int, default=8)
+    PARSER.add_argument("-tile_bytes", type=int, default=8000)
+    PARSER.add_argument("-reads", type=int, default=2000, help="Tiles read by every thread")
+    PARSER.add_argument("-threads", type=int, nargs="+", default=[1, 8, 32])
+    ARGS = PARSER.parse_args()
+    FOLDER = mkdtemp()
+    try:
+        PATH = join(FOLDER, "tiles.gpkg")
+        make_geopackage(PATH, ARGS.zoom, ARGS.tile_bytes)
+        print("zoom {0} ({1} tiles of {2} bytes), {3} random reads per thread".format(
+            ARGS.zoom, 4 ** ARGS.zoom, ARGS.tile_bytes, ARGS.reads))
+        for THREADS in ARGS.threads:
+            for NAME, MAKE_READER in (("shared + lock", shared_reader), ("reconnect", reconnecting_reader),
+                                      ("pool", pooled_reader)):
+                RATE, P99 = run(MAKE_READER, PATH, ARGS.zoom, THREADS, ARGS.reads)
+                print("{0:3d} threads {1:>14}: {2:8.0f} reads/s  p99 {3:9.1f} us".format(THREADS, NAME, RATE, P99))
+    finally:
+        rmtree(FOLDER)
@@ -0,0 +1,155 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Compares the query builders of sql_utility as they were, with
+ a table_exists() query before every statement, the SQL built on every call
+ and a SELECT before every insert or update, against the cached statements
+ and upserts they use now.  The operations are the metadata writes and
+ reads of a GeoPackage: gpkg_extensions rows with and without NULL keys,
+ and gpkg_contents lookups.
+
+ Usage: python -m Benchmarks.bench_sql_utility [-rows N] [-rounds N]
+"""
+from argparse import ArgumentParser
+from os.path import join
+from shutil import rmtree
+from sqlite3 import sqlite_version
+from tempfile import mkdtemp
+from time import time
+
+from scripts.geopackage.core.geopackage_core import GEOPACKAGE_CONTENTS_TABLE_NAME
+from scripts.geopackage.extensions.geopackage_extensions import GEOPACKAGE_EXTENSIONS_TABLE_NAME, \
+    GeoPackageExtensions
+from scripts.geopackage.geopackage import Geopackage
+from scripts.geopackage.utility import sql_utility
+from scripts.geopackage.utility.sql_column_query import SqlColumnQuery
+from scripts.geopackage.utility.sql_utility import get_database_connection, table_exists
+
+TABLE_NAME = "tiles"
+SRS = 3857
+
+
+def where_clause(where_columns_dictionary):
+    """The former __build_where_clause."""
+    return ' AND '.join(key + " = ? " if value is not None else key + " IS NULL "
+                        for key, value in where_columns_dictionary.items())
+
+
+def select_each(cursor, table_name, select_columns, where_columns_dictionary):
+    """The former select_query."""
+    if not table_exists(cursor=cursor, table_name=table_name):
+        raise ValueError("Table must exist to select entries from it")
+    if any(column_name is None or len(column_name) == 0 for column_name in select_columns):
+        raise ValueError("The column names cannot be None or empty")
+    cursor.execute("SELECT {columns} FROM '{table}' WHERE {where_clause};"
+                   .format(columns=', '.join(select_columns), table=table_name,
+                           where_clause=where_clause(where_columns_dictionary)),
+                   tuple(value for value in where_columns_dictionary.values() if value is not None))
+    return cursor.fetchall()
+
+
+def update_each(cursor, table_name, set_columns_dictionary, where_columns_dictionary):
+    """The former update_row."""
+    if not table_exists(cursor=cursor, table_name=table_name):
+        raise ValueError("Table must exist to update entries")
+    cursor.execute("UPDATE '{table}' SET {columns} WHERE {where_clause};"
+                   .format(columns=' = ?, '.join(set_columns_dictionary.keys()) + ' = ? ', table=table_name,
+                           where_clause=where_clause(where_columns_dictionary)),
+                   tuple(list(set_columns_dictionary.values()) +
+                         [value for value in where_columns_dictionary.values() if value is not None]))
+
+
+def insert_each(cursor, table_name, sql_columns_list):
+    """The former insert_row."""
+    if not table_exists(cursor=cursor, table_name=table_name):
+        raise ValueError("Table must exist to update entries")
+    cursor.execute("INSERT INTO '{table_name}' ({column_names}) VALUES ({question_marks});"
+                   .format(table_name=table_name,
+                           column_names=', '.join([column.column_name for column in sql_columns_list]),
+                           question_marks=', '.join(['?' for _ in sql_columns_list])),
+                   tuple(column.column_value for column in sql_columns_list))
+    return cursor.lastrowid
+
+
+def insert_or_update_each(cursor, table_name, sql_columns_list):
+    """The former insert_or_update_row."""
+    where = dict((column.column_name, column.column_value)
+                 for column in sql_columns_list if column.include_in_where_clause)
+    existing_row = select_each(cursor, table_name,
+                               [column.column_name for column in sql_columns_list if column.include_in_select_clause],
+                               where)
+    if len(existing_row) != 1:
+        insert_each(cursor, table_name, sql_columns_list)
+    else:
+        update_each(cursor, table_name,
+                    dict((column.column_name, column.column_value) for column in sql_columns_list), where)
+
+
+BUILDERS = {'former': (select_each, insert_or_update_each),
+            'cached': (sql_utility.select_query, sql_utility.insert_or_update_row)}
+
+
+def extension_columns(table_name, name, definition):
+    """The columns GeoPackageExtensions.insert_or_update_extensions_row writes."""
+    return [SqlColumnQuery(column_name='table_name', column_value=table_name),
+            SqlColumnQuery(column_name='column_name', column_value=None if table_name is None else 'tile_data'),
+            SqlColumnQuery(column_name='extension_name', column_value=name),
+            SqlColumnQuery(column_name='definition', column_value=definition, include_in_where_clause=False),
+            SqlColumnQuery(column_name='scope', column_value='read-write', include_in_where_clause=False)]
+
+
+def run(file_path, builders, rows, rounds, null_keys):
+    """Returns the operations per second of rounds of upserting rows extension rows and reading them back."""
+    select, insert_or_update = BUILDERS[builders]
+    with get_database_connection(file_path) as db_con:
+        cursor = db_con.cursor()
+        operations = 0
+        start = time()
+        for current in range(rounds):
+            for row in range(rows):
+                insert_or_update(cursor, GEOPACKAGE_EXTENSIONS_TABLE_NAME,
+                                 extension_columns(None if null_keys else TABLE_NAME, "bench_{0}".format(row),
+                                                   "round {0}".format(current)))
+                select(cursor, GEOPACKAGE_CONTENTS_TABLE_NAME, ['table_name', 'srs_id'], {'table_name': TABLE_NAME})
+                operations += 2
+        seconds = time() - start
+        db_con.rollback()
+    return operations / seconds
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark the sql_utility query builders on GeoPackage metadata")
+    PARSER.add_argument("-rows", type=int, default=50, help="Extension rows upserted per round")
+    PARSER.add_argument("-rounds", type=int, default=40)
+    ARGS = PARSER.parse_args()
+    FOLDER = mkdtemp()
+    try:
+        PATH = join(FOLDER, "bench.gpkg")
+        with Geopackage(PATH, SRS, TABLE_NAME) as gpkg:
+            gpkg.initialize()
+        with get_database_connection(PATH) as DB_CON:
+            GeoPackageExtensions.create_extensions_table(DB_CON.cursor())
+        print("SQLite {0}, {1} rounds of {2} extension rows".format(sqlite_version, ARGS.rounds, ARGS.rows))
+        for NULL_KEYS in (False, True):
+            FORMER = run(PATH, 'former', ARGS.rows, ARGS.rounds, NULL_KEYS)
+            CACHED = run(PATH, 'cached', ARGS.rows, ARGS.rounds, NULL_KEYS)
+            print("{0:>15}: former {1:8.0f} ops/s  cached {2:8.0f} ops/s  speedup {3:5.2f}x"
+                  .format("NULL keys" if NULL_KEYS else "non-NULL keys", FORMER, CACHED, CACHED / FORMER))
+    finally:
+        rmtree(FOLDER)
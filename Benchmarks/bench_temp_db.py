@@ -0,0 +1,80 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Compares the tiles/sec of the per-tile TempDB.insert_image_blob
+ path against the batched TempDB.insert_image_blobs path.
+
+ Usage: python -m Benchmarks.bench_temp_db [-tiles N] [-commit_size N]
+"""
+from argparse import ArgumentParser
+from os import urandom
+from shutil import rmtree
+from sqlite3 import Binary
+from tempfile import mkdtemp
+from time import time
+
+from scripts.packaging.temp_db import TempDB, DEFAULT_COMMIT_SIZE
+
+TABLE_NAME = "tiles"
+
+
+def make_tiles(count, tile_bytes):
+    """Yields count (z, x, y, data) tuples with random payloads."""
+    data = Binary(urandom(tile_bytes))
+    side = int(count ** 0.5) + 1
+    for index in range(count):
+        yield 18, index // side, index % side, data
+
+
+def time_single(count, tile_bytes):
+    """Returns the tiles/sec of calling insert_image_blob once per tile."""
+    folder = mkdtemp()
+    try:
+        with TempDB(folder, TABLE_NAME) as temp_db:
+            start = time()
+            for z, x, y, data in make_tiles(count, tile_bytes):
+                temp_db.insert_image_blob(z, x, y, data)
+            return count / (time() - start)
+    finally:
+        rmtree(folder)
+
+
+def time_batched(count, tile_bytes, commit_size):
+    """Returns the tiles/sec of feeding insert_image_blobs a generator."""
+    folder = mkdtemp()
+    try:
+        with TempDB(folder, TABLE_NAME) as temp_db:
+            start = time()
+            temp_db.insert_image_blobs(make_tiles(count, tile_bytes), commit_size)
+            return count / (time() - start)
+    finally:
+        rmtree(folder)
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark TempDB tile ingestion")
+    PARSER.add_argument("-tiles", type=int, default=20000)
+    PARSER.add_argument("-tile_bytes", type=int, default=15000)
+    PARSER.add_argument("-commit_size", type=int, default=DEFAULT_COMMIT_SIZE)
+    ARGS = PARSER.parse_args()
+    SINGLE = time_single(ARGS.tiles, ARGS.tile_bytes)
+    BATCHED = time_batched(ARGS.tiles, ARGS.tile_bytes, ARGS.commit_size)
+    print("insert_image_blob:  {0:10.0f} tiles/sec".format(SINGLE))
+    print("insert_image_blobs: {0:10.0f} tiles/sec (commit_size={1})".format(BATCHED, ARGS.commit_size))
+    print("speedup:            {0:10.1f}x".format(BATCHED / SINGLE))
@@ -0,0 +1,134 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Compares the read locality of a geopackage whose tiles are
+ stored column by column, as they are packaged, against the same tiles
+ stored in Z-order and Hilbert order by Geopackage.order_tiles().  A map
+ viewer panning across one zoom level is replayed, and the table leaf pages
+ every viewport reads are run through a simulated LRU page cache.  The
+ SQLite page of every tile is taken from the dbstat virtual table.
+
+ Usage: python -m Benchmarks.bench_tile_order [-zoom N] [-cache_pages N]
+"""
+from argparse import ArgumentParser
+from collections import OrderedDict
+from os import urandom
+from os.path import join
+from random import Random
+from shutil import rmtree
+from sqlite3 import Binary
+from tempfile import mkdtemp
+from time import time
+
+from scripts.geopackage.geopackage import Geopackage
+from scripts.geopackage.utility.write_profile import BULK_LOAD
+
+TABLE_NAME = "tiles"
+SRS = 3857
+
+
+def make_geopackage(file_path, zoom, tile_bytes, tile_order):
+    """Writes every tile of a zoom level column by column, then orders them."""
+    side = 2 ** zoom
+    with Geopackage(file_path, SRS, TABLE_NAME, BULK_LOAD) as gpkg:
+        gpkg.initialize()
+        gpkg.insert_tiles((zoom, x, y, Binary(urandom(tile_bytes))) for x in range(side) for y in range(side))
+        if tile_order is not None:
+            gpkg.order_tiles(tile_order)
+
+
+def tile_pages(gpkg):
+    """Returns a dictionary of (column, row) to the table leaf page holding the tile."""
+    leaves = gpkg.execute("""SELECT pageno, ncell FROM dbstat WHERE name = ? AND pagetype = 'leaf'
+                             ORDER BY path;""", (TABLE_NAME,)).fetchall()
+    pages = []
+    for page, cells in leaves:
+        pages.extend([page] * cells)
+    rows = gpkg.execute("SELECT tile_column, tile_row FROM '{0}' ORDER BY id;".format(TABLE_NAME)).fetchall()
+    return dict(((column, row), page) for (column, row), page in zip(rows, pages))
+
+
+def viewports(side, width, height, steps, pan, seed):
+    """Yields the tile windows of a viewer panning pan tiles at a time."""
+    random = Random(seed)
+    x, y = random.randrange(side - width), random.randrange(side - height)
+    for _ in range(steps):
+        yield x, y
+        dx, dy = random.choice([(pan, 0), (-pan, 0), (0, pan), (0, -pan)])
+        x = min(max(x + dx, 0), side - width)
+        y = min(max(y + dy, 0), side - height)
+
+
+def replay(file_path, zoom, cache_pages, width, height, steps, pan, seed):
+    """
+    Returns (distinct leaf pages per viewport, simulated cache misses per
+    viewport, seconds spent running the viewport queries).
+    """
+    side = 2 ** zoom
+    with Geopackage(file_path, SRS, TABLE_NAME) as gpkg:
+        pages = tile_pages(gpkg)
+        gpkg.execute("pragma cache_size = {0};".format(cache_pages))
+        cache = OrderedDict()
+        misses = distinct = 0
+        query = """SELECT tile_data FROM '{0}' WHERE zoom_level = ?
+                   AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?;""".format(TABLE_NAME)
+        seconds = 0.0
+        windows = list(viewports(side, width, height, steps, pan, seed))
+        for x, y in windows:
+            start = time()
+            gpkg.execute(query, (zoom, x, x + width - 1, y, y + height - 1)).fetchall()
+            seconds += time() - start
+            read = set(pages[(column, row)] for column in range(x, x + width) for row in range(y, y + height))
+            distinct += len(read)
+            for page in read:
+                if page in cache:
+                    cache.pop(page)
+                else:
+                    misses += 1
+                    if len(cache) >= cache_pages:
+                        cache.popitem(last=False)
+                cache[page] = True
+        return distinct / float(len(windows)), misses / float(len(windows)), seconds
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark the read locality of tile orders")
+    PARSER.add_argument("-zoom", type=int, default=8)
+    PARSER.add_argument("-tile_bytes", type=int, default=600)
+    PARSER.add_argument("-cache_pages", type=int, default=64)
+    PARSER.add_argument("-viewport", type=int, nargs=2, default=[8, 6])
+    PARSER.add_argument("-steps", type=int, default=2000)
+    PARSER.add_argument("-pan", type=int, default=4, help="Tiles moved per pan step")
+    ARGS = PARSER.parse_args()
+    FOLDER = mkdtemp()
+    try:
+        print("zoom {0} ({1} tiles of {2} bytes), {3}x{4} viewport, {5} pans of {6} tiles, {7} page cache".format(
+            ARGS.zoom, 4 ** ARGS.zoom, ARGS.tile_bytes, ARGS.viewport[0], ARGS.viewport[1], ARGS.steps, ARGS.pan,
+            ARGS.cache_pages))
+        for ORDER in (None, "zorder", "hilbert"):
+            PATH = join(FOLDER, "{0}.gpkg".format(ORDER))
+            start = time()
+            make_geopackage(PATH, ARGS.zoom, ARGS.tile_bytes, ORDER)
+            BUILD = time() - start
+            PAGES, MISSES, SECONDS = replay(PATH, ARGS.zoom, ARGS.cache_pages, ARGS.viewport[0],
+                                              ARGS.viewport[1], ARGS.steps, ARGS.pan, 1)
+            print("{0:>8}: {1:6.1f} pages/viewport  {2:6.2f} cache misses/viewport  {3:6.2f} s queries  "
+                  "{4:6.2f} s build".format(ORDER or "columns", PAGES, MISSES, SECONDS, BUILD))
+    finally:
+        rmtree(FOLDER)
@@ -0,0 +1,129 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Compares the latency of reading tiles through
+ GeoPackageTiles.get_tile_data, the path the web front end used, with
+ TileReader.get_tile without and with its cache, and the latency of
+ fetching whole viewports with TileReader.get_tiles.  A map viewer panning
+ across one zoom level is replayed and the p50 and p99 latency of every
+ call is reported.
+
+ Usage: python -m Benchmarks.bench_tile_reader [-zoom N] [-steps N]
+"""
+from argparse import ArgumentParser
+from os import urandom
+from os.path import join
+from random import Random
+from shutil import rmtree
+from sqlite3 import Binary
+from tempfile import mkdtemp
+from timeit import default_timer as timer
+
+from scripts.geopackage.geopackage import Geopackage
+from scripts.geopackage.tiles.geopackage_tiles import GeoPackageTiles
+from scripts.geopackage.tiles.tile_reader import TileReader
+from scripts.geopackage.utility.sql_utility import get_database_connection
+from scripts.geopackage.utility.write_profile import BULK_LOAD
+
+TABLE_NAME = "tiles"
+SRS = 3857
+
+
+def make_geopackage(file_path, zoom, tile_bytes):
+    """Writes every tile of a zoom level."""
+    side = 2 ** zoom
+    with Geopackage(file_path, SRS, TABLE_NAME, BULK_LOAD) as gpkg:
+        gpkg.initialize()
+        gpkg.insert_tiles((zoom, x, y, Binary(urandom(tile_bytes))) for x in range(side) for y in range(side))
+
+
+def viewports(side, width, height, steps, pan, seed):
+    """Returns the tile coordinates of every viewport of a viewer panning pan tiles at a time."""
+    random = Random(seed)
+    x, y = random.randrange(side - width), random.randrange(side - height)
+    windows = []
+    for _ in range(steps):
+        windows.append([(column, row) for column in range(x, x + width) for row in range(y, y + height)])
+        dx, dy = random.choice([(pan, 0), (-pan, 0), (0, pan), (0, -pan)])
+        x = min(max(x + dx, 0), side - width)
+        y = min(max(y + dy, 0), side - height)
+    return windows
+
+
+def percentiles(latencies):
+    """Returns the (p50, p99) of a list of seconds, in microseconds."""
+    latencies = sorted(latencies)
+    return (latencies[len(latencies) // 2] * 1e6,
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6)
+
+
+def time_calls(read, zoom, windows):
+    """Returns the latency of read(zoom, column, row) for every tile of every viewport."""
+    latencies = []
+    for window in windows:
+        for column, row in window:
+            start = timer()
+            read(zoom, column, row)
+            latencies.append(timer() - start)
+    return latencies
+
+
+def time_viewports(read, zoom, windows):
+    """Returns the latency of read(zoom, coordinates) for every viewport."""
+    latencies = []
+    for window in windows:
+        start = timer()
+        read(zoom, window)
+        latencies.append(timer() - start)
+    return latencies
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark the tile read path")
+    PARSER.add_argument("-zoom", type=int, default=8)
+    PARSER.add_argument("-tile_bytes", type=int, default=8000)
+    PARSER.add_argument("-viewport", type=int, nargs=2, default=[8, 6])
+    PARSER.add_argument("-steps", type=int, default=2000)
+    PARSER.add_argument("-pan", type=int, default=2, help="Tiles moved per pan step")
+    ARGS = PARSER.parse_args()
+    FOLDER = mkdtemp()
+    try:
+        PATH = join(FOLDER, "tiles.gpkg")
+        make_geopackage(PATH, ARGS.zoom, ARGS.tile_bytes)
+        WINDOWS = viewports(2 ** ARGS.zoom, ARGS.viewport[0], ARGS.viewport[1], ARGS.steps, ARGS.pan, 1)
+        print("zoom {0} ({1} tiles of {2} bytes), {3}x{4} viewport, {5} pans of {6} tiles".format(
+            ARGS.zoom, 4 ** ARGS.zoom, ARGS.tile_bytes, ARGS.viewport[0], ARGS.viewport[1], ARGS.steps, ARGS.pan))
+        with get_database_connection(PATH) as DB_CON:
+            CURSOR = DB_CON.cursor()
+            RESULTS = [("get_tile_data", time_calls(
+                lambda zoom, column, row: GeoPackageTiles.get_tile_data(CURSOR, TABLE_NAME, zoom, column, row),
+                ARGS.zoom, WINDOWS))]
+        for NAME, CACHE_BYTES in (("get_tile, no cache", 0), ("get_tile, cache", 64 * 1024 * 1024)):
+            with TileReader(PATH, CACHE_BYTES) as READER:
+                RESULTS.append((NAME, time_calls(lambda zoom, column, row: READER.get_tile(TABLE_NAME, zoom, column,
+                                                                                            row), ARGS.zoom, WINDOWS)))
+        for NAME, CACHE_BYTES in (("get_tiles, no cache", 0), ("get_tiles, cache", 64 * 1024 * 1024)):
+            with TileReader(PATH, CACHE_BYTES) as READER:
+                RESULTS.append((NAME + " (per tile)", [latency / len(WINDOWS[0]) for latency in time_viewports(
+                    lambda zoom, window: READER.get_tiles(TABLE_NAME, zoom, window), ARGS.zoom, WINDOWS)]))
+        for NAME, LATENCIES in RESULTS:
+            P50, P99 = percentiles(LATENCIES)
+            print("{0:>30}: p50 {1:7.1f} us  p99 {2:7.1f} us".format(NAME, P50, P99))
+    finally:
+        rmtree(FOLDER)
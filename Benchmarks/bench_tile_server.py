@@ -0,0 +1,171 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Serves the tiles of a GeoPackage over a minimal asyncio HTTP
+ server at /{table}/{z}/{x}/{y} and loads it with concurrent keep-alive
+ clients replaying map viewers that pan over the same area, so many of
+ them ask for the same tiles at the same time.  Requests per second and
+ p50/p99 latency are reported for reading in the event loop (blocking),
+ reading on a thread pool, and reading on a thread pool with concurrent
+ identical requests coalesced, each with the tile cache off.
+
+ Usage: python -m Benchmarks.bench_tile_server [-clients N] [-requests N]
+"""
+import asyncio
+from argparse import ArgumentParser
+from os import urandom
+from os.path import join
+from random import Random
+from shutil import rmtree
+from sqlite3 import Binary
+from tempfile import mkdtemp
+from timeit import default_timer as timer
+
+from scripts.geopackage.geopackage import Geopackage
+from scripts.geopackage.tiles.async_tile_reader import AsyncTileReader
+from scripts.geopackage.tiles.tile_reader import TileReader
+from scripts.geopackage.utility.connection_pool import ReadConnectionPool
+from scripts.geopackage.utility.write_profile import BULK_LOAD
+
+TABLE_NAME = "tiles"
+SRS = 3857
+
+
+def make_geopackage(file_path, zoom, tile_bytes):
+    """Writes every tile of a zoom level."""
+    side = 2 ** zoom
+    with Geopackage(file_path, SRS, TABLE_NAME, BULK_LOAD) as gpkg:
+        gpkg.initialize()
+        gpkg.insert_tiles((zoom, x, y, Binary(urandom(tile_bytes))) for x in range(side) for y in range(side))
+
+
+def response(status, body=b""):
+    """Returns the bytes of an HTTP/1.1 keep-alive response."""
+    content_type = b"image/png" if body.startswith(b"\x89PNG") else b"application/octet-stream"
+    return (b"HTTP/1.1 " + status + b"\r\nContent-Type: " + content_type +
+            b"\r\nContent-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+
+
+def make_handler(get_tile):
+    """Returns the connection handler of a server answering GET /{table}/{z}/{x}/{y} with await get_tile(...)."""
+    async def handle(reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b"\r\n\r\n")
+                try:
+                    path = request.split(b" ", 2)[1].decode()
+                    table_name, zoom, column, row = path.strip("/").split("/")
+                    tile = await get_tile(table_name, int(zoom), int(column), int(row))
+                except ValueError:
+                    writer.write(response(b"400 Bad Request"))
+                else:
+                    writer.write(response(b"200 OK", tile) if tile is not None else response(b"404 Not Found"))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+async def client(port, paths, latencies):
+    """Requests every path over one keep-alive connection, recording the latencies."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for path in paths:
+        start = timer()
+        writer.write("GET {0} HTTP/1.1\r\nHost: localhost\r\n\r\n".format(path).encode())
+        headers = await reader.readuntil(b"\r\n\r\n")
+        length = int(headers.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+        await reader.readexactly(length)
+        latencies.append(timer() - start)
+    writer.close()
+
+
+def client_paths(zoom, clients, requests, width, height, seed):
+    """Returns the paths of every client: viewers starting at the same place and panning one tile at a time."""
+    side = 2 ** zoom
+    paths = []
+    for index in range(clients):
+        random = Random(seed + index)
+        x, y = side // 2, side // 2
+        mine = []
+        while len(mine) < requests:
+            mine.extend("/{0}/{1}/{2}/{3}".format(TABLE_NAME, zoom, column, row)
+                        for column in range(x, x + width) for row in range(y, y + height))
+            dx, dy = random.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+            x = min(max(x + dx, 0), side - width)
+            y = min(max(y + dy, 0), side - height)
+        paths.append(mine[:requests])
+    return paths
+
+
+async def serve(get_tile, paths):
+    """Returns (requests per second, latencies) of the clients requesting their paths from a server of get_tile."""
+    server = await asyncio.start_server(make_handler(get_tile), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    latencies = []
+    start = timer()
+    await asyncio.gather(*[client(port, mine, latencies) for mine in paths])
+    seconds = timer() - start
+    server.close()
+    await server.wait_closed()
+    return len(latencies) / seconds, sorted(latencies)
+
+
+async def run(mode, file_path, paths, max_workers):
+    """Returns the results of serve() for one way of reading the tiles."""
+    if mode == "blocking":
+        reader = TileReader(file_path, 0)
+
+        async def get_tile(*key):
+            return reader.get_tile(*key)
+        try:
+            return await serve(get_tile, paths)
+        finally:
+            reader.close()
+    async_reader = AsyncTileReader(TileReader(file_path, 0, ReadConnectionPool(file_path, immutable=True)),
+                                   max_workers, coalesce=mode == "coalesced")
+    try:
+        return await serve(async_reader.get_tile, paths)
+    finally:
+        async_reader.close()
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark serving GeoPackage tiles over HTTP with asyncio")
+    PARSER.add_argument("-zoom", type=int, default=8)
+    PARSER.add_argument("-tile_bytes", type=int, default=8000)
+    PARSER.add_argument("-clients", type=int, default=64)
+    PARSER.add_argument("-requests", type=int, default=200, help="Requests made by every client")
+    PARSER.add_argument("-workers", type=int, default=8, help="Threads reading the GeoPackage")
+    ARGS = PARSER.parse_args()
+    FOLDER = mkdtemp()
+    try:
+        PATH = join(FOLDER, "tiles.gpkg")
+        make_geopackage(PATH, ARGS.zoom, ARGS.tile_bytes)
+        PATHS = client_paths(ARGS.zoom, ARGS.clients, ARGS.requests, 8, 6, 1)
+        print("zoom {0} ({1} tiles of {2} bytes), {3} clients making {4} requests each, {5} reader threads".format(
+            ARGS.zoom, 4 ** ARGS.zoom, ARGS.tile_bytes, ARGS.clients, ARGS.requests, ARGS.workers))
+        for MODE in ("blocking", "executor", "coalesced"):
+            RATE, LATENCIES = asyncio.run(run(MODE, PATH, PATHS, ARGS.workers))
+            print("{0:>10}: {1:8.0f} requests/s  p50 {2:8.1f} us  p99 {3:8.1f} us".format(
+                MODE, RATE, LATENCIES[len(LATENCIES) // 2] * 1e6,
+                LATENCIES[min(len(LATENCIES) - 1, int(len(LATENCIES) * 0.99))] * 1e6))
+    finally:
+        rmtree(FOLDER)
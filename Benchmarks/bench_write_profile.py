@@ -0,0 +1,83 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: Compares the load throughput of the SQLite write profiles by
+ writing the same tiles into a Geopackage with insert_tiles under each of
+ them, next to the SQLite defaults and the synchronous/journal_mode OFF
+ pragmas the packaging code used to hard code.
+
+ Usage: python -m Benchmarks.bench_write_profile [-tiles N] [-tile_bytes N]
+"""
+from argparse import ArgumentParser
+from os import urandom
+from os.path import getsize, join
+from shutil import rmtree
+from sqlite3 import Binary
+from tempfile import mkdtemp
+from time import time
+
+from scripts.geopackage.geopackage import Geopackage, DEFAULT_COMMIT_SIZE
+from scripts.geopackage.utility.write_profile import WriteProfile, WRITE_PROFILES, BULK_LOAD, SAFE
+
+TABLE_NAME = "tiles"
+SRS = 3857
+
+PROFILES = [("sqlite defaults", None),
+            ("journal/sync off", WriteProfile(journal_mode='OFF', synchronous='OFF')),
+            (SAFE, WRITE_PROFILES[SAFE]),
+            (BULK_LOAD, WRITE_PROFILES[BULK_LOAD]),
+            (BULK_LOAD + " 4k pages", WRITE_PROFILES[BULK_LOAD].copy(page_size=4096)),
+            (BULK_LOAD + " shared", WRITE_PROFILES[BULK_LOAD].copy(locking_mode=None))]
+
+
+def make_tiles(count, tile_bytes):
+    """Yields count (z, x, y, data) tuples with distinct random payloads."""
+    side = int(count ** 0.5) + 1
+    for index in range(count):
+        yield 18, index // side, index % side, Binary(urandom(tile_bytes))
+
+
+def time_profile(profile, count, tile_bytes, commit_size):
+    """Returns (tiles/sec, file size) of loading count tiles with profile."""
+    folder = mkdtemp()
+    try:
+        file_path = join(folder, "out.gpkg")
+        tiles = list(make_tiles(count, tile_bytes))
+        with Geopackage(file_path, SRS, TABLE_NAME, profile) as gpkg:
+            gpkg.initialize()
+            start = time()
+            gpkg.insert_tiles(tiles, commit_size)
+            elapsed = time() - start
+        return count / elapsed, getsize(file_path)
+    finally:
+        rmtree(folder)
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser(description="Benchmark the SQLite write profiles")
+    PARSER.add_argument("-tiles", type=int, default=20000)
+    PARSER.add_argument("-tile_bytes", type=int, default=15000)
+    PARSER.add_argument("-commit_size", type=int, default=DEFAULT_COMMIT_SIZE)
+    PARSER.add_argument("-repeat", type=int, default=3, help="Runs per profile, the best one is kept")
+    ARGS = PARSER.parse_args()
+    print("{0} tiles of {1} bytes, commit_size {2}".format(ARGS.tiles, ARGS.tile_bytes, ARGS.commit_size))
+    for NAME, PROFILE in PROFILES:
+        RUNS = [time_profile(PROFILE, ARGS.tiles, ARGS.tile_bytes, ARGS.commit_size) for _ in range(ARGS.repeat)]
+        RATE, SIZE = max(RUNS)
+        print("{0:>20}: {1:8.0f} tiles/sec  {2:8.1f} MB".format(NAME, RATE, SIZE / 1048576.0))
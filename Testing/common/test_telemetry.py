@@ -0,0 +1,154 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3, argparse
+   Optional: Python Imaging Library (PIL or Pillow)
+
+Version:
+"""
+from json import load
+from os import remove
+from os.path import join
+from tempfile import gettempdir
+from uuid import uuid4
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from pytest import raises
+
+from scripts.common.telemetry import SharedProgress, Telemetry, new_stats, time_insert, timed_tiles
+
+
+class TestTelemetry(object):
+
+    def test_timed_tiles(self):
+        stats = new_stats()
+        tiles = list(timed_tiles([(1, 0, 0, b'abc'), (1, 0, 1, b'de')], stats))
+        assert len(tiles) == 2
+        assert stats['tiles'] == 2 and stats['bytes'] == 5
+        assert stats['encode'] >= 0
+
+    def test_time_insert(self):
+        written = []
+
+        def insert(tiles, commit_size):
+            written.extend(tiles)
+            return len(written)
+
+        stats = time_insert(insert, [(1, 0, 0, b'abc')], 10)
+        assert written == [(1, 0, 0, b'abc')]
+        assert stats['tiles'] == 1 and stats['bytes'] == 3 and stats['insert'] >= 0
+
+    def test_merge_and_phases(self):
+        telemetry = Telemetry(stream=None)
+        with telemetry.phase('discovery'):
+            pass
+        telemetry.start(10)
+        telemetry.merge(dict(tiles=4, skipped=0, bytes=400, encode=1.5, insert=0.5))
+        telemetry.merge(dict(tiles=1, skipped=2, bytes=100, encode=0.5, insert=0.25))
+        assert telemetry.tiles == 5 and telemetry.skipped == 2 and telemetry.done == 7 and telemetry.bytes == 500
+        assert telemetry.phases['encode'] == 2.0 and telemetry.phases['insert'] == 0.75
+        assert 'discovery' in telemetry.phases
+        assert telemetry.eta is not None
+
+    def test_track_reports(self):
+        stream = StringIO()
+        telemetry = Telemetry(stream=stream, interval=0)
+        telemetry.start(2)
+        assert len(list(telemetry.track([(1, 0, 0, b'a'), None]))) == 1
+        assert telemetry.tiles == 1 and telemetry.skipped == 1
+        telemetry.finish()
+        output = stream.getvalue()
+        assert "[X] Progress:" in output and "2/2 tiles" in output and output.endswith("All Done!\n")
+
+    def test_write_summary(self):
+        telemetry = Telemetry(stream=None)
+        telemetry.start(1)
+        telemetry.add(1, 10)
+        telemetry.info['engine'] = 'parts'
+        file_path = join(gettempdir(), uuid4().hex + '.json')
+        telemetry.write_summary(file_path)
+        try:
+            with open(file_path) as summary_file:
+                summary = load(summary_file)
+        finally:
+            remove(file_path)
+        assert summary['tiles'] == 1 and summary['bytes'] == 10
+        assert summary['info'] == {'engine': 'parts'}
+        assert set(summary) == {'tiles', 'skipped', 'bytes', 'encode_tiles_per_second', 'encode_bytes_per_second',
+                                'merge_tiles_per_second', 'seconds', 'phases', 'info'}
+        assert summary['merge_tiles_per_second'] is None
+
+    def test_summary_rates(self):
+        telemetry = Telemetry(stream=None)
+        telemetry.start(10)
+        telemetry.add(10, 1000)
+        telemetry.finish()
+        # encoded in 2 seconds, then merged in 5 seconds that are left out of the encode rates
+        telemetry.started = telemetry.finished - 2
+        telemetry.add_time('merge', 5.0)
+        summary = telemetry.summary()
+        assert summary['encode_tiles_per_second'] == 5.0 and summary['encode_bytes_per_second'] == 500.0
+        assert summary['merge_tiles_per_second'] == 2.0
+
+    def test_shared_progress(self):
+        progress = SharedProgress(batch=2)
+        counts = []
+
+        def insert(tiles, commit_size):
+            for _ in tiles:
+                counts.append(progress.done)
+
+        stats = new_stats()
+        stats['skipped'] = 1
+        time_insert(insert, [(1, 0, x, b'a') for x in range(4)], 10, stats, progress)
+        # updated every two tiles, not once at the end
+        assert counts == [0, 2, 2, 4]
+        assert progress.done == 5
+        telemetry = Telemetry(stream=None)
+        telemetry.update_pending(progress.done)
+        assert telemetry.done == 5
+        telemetry.merge(stats)
+        telemetry.update_pending(progress.done)
+        assert telemetry.pending == 0 and telemetry.done == 5
+
+    def test_shared_progress_failure(self):
+        progress = SharedProgress(batch=1)
+        progress.add(3)
+
+        def insert(tiles, commit_size):
+            next(tiles)
+            next(tiles)
+            raise ValueError("disk full")
+
+        with raises(ValueError):
+            time_insert(insert, [(1, 0, x, b'a') for x in range(4)], 10, progress=progress)
+        # the tiles of the failed attempt are taken back
+        assert progress.done == 3
+
+    def test_shared_progress_large(self):
+        # a 64 bit counter, built the same way on Python 2 and 3
+        progress = SharedProgress()
+        progress.add(2 ** 40)
+        assert progress.done == 2 ** 40
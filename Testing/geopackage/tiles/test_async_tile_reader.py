@@ -0,0 +1,91 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3, asyncio
+
+Version:
+"""
+import asyncio
+from shutil import rmtree
+from sqlite3 import Binary
+from sys import version_info
+
+import pytest
+from pytest import raises
+
+from Testing.geopackage.tiles.test_tile_addressing import package
+from Testing.test_tiles2gpkg import make_gpkg
+from scripts.geopackage.tiles.async_tile_reader import AsyncTileReader
+
+# asyncio.run() is new in Python 3.7, older versions do not collect this module at all, see conftest.py
+pytestmark = pytest.mark.skipif(version_info < (3, 7), reason="requires Python 3.7 or later")
+
+
+def write_tiles(gpkg):
+    gpkg.initialize()
+    gpkg.insert_tiles((2, x, y, Binary(bytes(bytearray([x, y]) * 50))) for x in range(4) for y in range(4))
+
+
+class TestAsyncTileReader(object):
+
+    def test_get_tile(self, make_gpkg):
+        write_tiles(make_gpkg)
+
+        async def read():
+            async with AsyncTileReader.open(make_gpkg.file_path) as reader:
+                assert await reader.get_tile('tiles', 2, 1, 3) == bytes(bytearray([1, 3]) * 50)
+                # from the cache, without another read
+                assert await reader.get_tile('tiles', 2, 1, 3) == bytes(bytearray([1, 3]) * 50)
+                assert (reader.reader.hits, reader.reader.misses) == (1, 1)
+                assert await reader.get_tile('tiles', 2, 9, 9) is None
+                with raises(ValueError):
+                    await reader.get_tile('missing', 2, 0, 0)
+
+        asyncio.run(read())
+
+    def test_coalesce(self, make_gpkg):
+        write_tiles(make_gpkg)
+
+        async def read(coalesce):
+            reader = AsyncTileReader.open(make_gpkg.file_path, cache_bytes=0)
+            reader.coalesce = coalesce
+            try:
+                tiles = await asyncio.gather(*[reader.get_tile('tiles', 2, 2, 1) for _ in range(10)])
+                assert tiles == [bytes(bytearray([2, 1]) * 50)] * 10
+                return reader.coalesced, reader.reader.misses
+            finally:
+                reader.close()
+
+        assert asyncio.run(read(True)) == (9, 1)
+        assert asyncio.run(read(False)) == (0, 10)
+
+    def test_get_tile_xyz(self):
+        tiles = [(2, 1, 1), (2, 2, 1)]
+        folder, output_file, written = package(tiles, 3857, 'll')
+
+        async def read():
+            async with AsyncTileReader.open(output_file) as reader:
+                return [await reader.get_tile_xyz('tiles', z, x, y, tms=True) for z, x, y in tiles]
+
+        try:
+            assert asyncio.run(read()) == [written[tile] for tile in tiles]
+        finally:
+            rmtree(folder)
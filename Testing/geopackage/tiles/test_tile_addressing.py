@@ -0,0 +1,143 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3
+
+Version:
+"""
+from argparse import Namespace
+from io import BytesIO
+from os import makedirs
+from os.path import isdir, join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import pytest
+from PIL.Image import new
+from pytest import raises
+
+from scripts.common.zoom_metadata import ZoomMetadata
+from scripts.geopackage.geopackage import Geopackage
+from scripts.geopackage.srs.ellipsoidal_mercator import EllipsoidalMercator
+from scripts.geopackage.srs.geodetic import Geodetic
+from scripts.geopackage.srs.mercator import Mercator
+from scripts.geopackage.srs.scaled_world_mercator import ScaledWorldMercator
+from scripts.geopackage.tiles.tile_addressing import TileAddressing
+from scripts.geopackage.tiles.tile_reader import TileReader
+from scripts.packaging.tiles2gpkg_parallel import main, tile_key
+
+
+def make_level(zoom, min_tile_row, max_tile_row, min_tile_col, max_tile_col):
+    level = ZoomMetadata()
+    level.zoom = zoom
+    level.min_tile_row, level.max_tile_row = min_tile_row, max_tile_row
+    level.min_tile_col, level.max_tile_col = min_tile_col, max_tile_col
+    return level
+
+
+def write_source_tiles(folder, tiles):
+    """Writes a distinct PNG per (z, x, y) in a z/x/y.png tree, returning the bytes of every tile."""
+    written = {}
+    for index, (z, x, y) in enumerate(tiles):
+        if not isdir(join(folder, str(z), str(x))):
+            makedirs(join(folder, str(z), str(x)))
+        data = BytesIO()
+        new('RGB', (4, 4), (index, 2 * index, 255 - index)).save(data, 'PNG')
+        with open(join(folder, str(z), str(x), "{0}.png".format(y)), 'wb') as tile_file:
+            tile_file.write(data.getvalue())
+        written[(z, x, y)] = data.getvalue()
+    return written
+
+
+def package(tiles, srs, tile_origin):
+    """Packages source tiles with tiles2gpkg, returning (folder, output file, bytes of every source tile)."""
+    folder = mkdtemp()
+    written = write_source_tiles(join(folder, "source"), tiles)
+    output_file = join(folder, "out.gpkg")
+    main(Namespace(source_folder=join(folder, "source"), output_file=output_file, tileorigin=tile_origin, srs=srs,
+                   imagery='source', q=75, threading=False, nsg_profile=False, renumber=False, table_name='tiles'))
+    return folder, output_file, written
+
+
+class TestTileAddressing(object):
+
+    def test_from_levels_relative(self):
+        addressing = TileAddressing.from_levels([make_level(3, 2, 3, 5, 6)], False, None, False)
+        assert addressing.to_stored(3, 2, 5) == (3, 0, 0)
+        assert addressing.to_stored(3, 3, 6) == (3, 1, 1)
+        assert addressing.to_stored(4, 0, 0) is None
+        assert not addressing.flipped
+
+    def test_from_levels_flipped(self):
+        addressing = TileAddressing.from_levels([make_level(3, 2, 3, 5, 6)], False, Mercator.invert_y, False)
+        # the top row of a TMS grid is its highest y
+        assert addressing.to_stored(3, 2, 6) == (3, 0, 0)
+        assert addressing.to_stored(3, 2, 5) == (3, 0, 1)
+        assert addressing.flipped
+
+    def test_from_levels_nsg_renumber(self):
+        addressing = TileAddressing.from_levels([make_level(1, 0, 4, 0, 2)], True, None, True)
+        assert addressing.to_stored(2, 3, 1) == (1, 3, 1)
+        assert addressing.to_stored(1, 3, 1) is None
+
+    def test_tile_key_caches_addressing(self):
+        extra_args = dict(tile_info=[make_level(3, 2, 3, 5, 6)], nsg_profile=False, renumber=False)
+        assert tile_key(3, 3, 6, extra_args, None) == (3, 1, 1)
+        addressing = extra_args['addressing']
+        assert tile_key(3, 2, 5, extra_args, None) == (3, 0, 0)
+        assert extra_args['addressing'] is addressing
+        # switching to a TMS grid builds it again
+        assert tile_key(3, 2, 6, extra_args, Mercator.invert_y) == (3, 0, 0)
+        assert extra_args['addressing'].flipped
+        with raises(ValueError):
+            tile_key(5, 0, 0, extra_args, None)
+
+    @pytest.mark.parametrize("srs,invert_y", [(3395, EllipsoidalMercator.invert_y), (3857, Mercator.invert_y),
+                                              (4326, Geodetic.invert_y), (9804, ScaledWorldMercator.invert_y)])
+    @pytest.mark.parametrize("tile_origin", ['ll', 'ul'])
+    def test_round_trip(self, srs, invert_y, tile_origin):
+        tiles = [(2, 1, 1), (2, 1, 2), (3, 2, 3), (3, 3, 5)]
+        folder, output_file, written = package(tiles, srs, tile_origin)
+        tms = tile_origin == 'll'
+        try:
+            with TileReader(output_file) as reader:
+                for (z, x, y), data in written.items():
+                    # the source addresses, and the same tiles addressed the other way
+                    assert reader.get_tile_xyz('tiles', z, x, y, tms) == data
+                    assert reader.get_tile_xyz('tiles', z, x, invert_y(z, y), not tms) == data
+                # outside of the tile matrix, or of the zoom levels
+                assert reader.get_tile_xyz('tiles', 3, 0, 0, tms) is None
+                assert reader.get_tile_xyz('tiles', 7, 1, 1, tms) is None
+                assert reader.addressing('tiles', tms) is reader.addressing('tiles', tms)
+            with Geopackage(output_file, srs, 'tiles') as gpkg:
+                assert len(gpkg.addressing(tms)) == 2
+                assert gpkg.addressing(tms) is gpkg.addressing(tms)
+        finally:
+            rmtree(folder)
+
+    def test_unknown_table(self):
+        folder, output_file, _ = package([(1, 0, 0)], 3857, 'll')
+        try:
+            with TileReader(output_file) as reader:
+                with raises(ValueError):
+                    reader.get_tile_xyz('missing', 1, 0, 0)
+        finally:
+            rmtree(folder)
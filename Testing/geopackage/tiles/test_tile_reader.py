@@ -0,0 +1,93 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3
+
+Version:
+"""
+from os.path import exists
+from sqlite3 import Binary, OperationalError
+from sys import version_info
+
+import pytest
+from pytest import raises
+
+from Testing.test_tiles2gpkg import make_gpkg
+from scripts.geopackage.tiles.tile_reader import ENTRY_OVERHEAD, TileReader
+
+
+def write_tiles(gpkg):
+    gpkg.initialize()
+    gpkg.insert_tiles((2, x, y, Binary(bytes(bytearray([x, y]) * 50))) for x in range(4) for y in range(4))
+
+
+class TestTileReader(object):
+
+    def test_get_tile(self, make_gpkg):
+        write_tiles(make_gpkg)
+        with TileReader(make_gpkg.file_path) as reader:
+            assert reader.get_tile('tiles', 2, 1, 3) == bytes(bytearray([1, 3]) * 50)
+            assert reader.get_tile('tiles', 2, 1, 3) == bytes(bytearray([1, 3]) * 50)
+            assert reader.get_tile('tiles', 2, 9, 9) is None
+            assert reader.get_tile('tiles', 2, 9, 9) is None
+            assert (reader.hits, reader.misses) == (2, 2)
+            assert reader.size == 2 * ENTRY_OVERHEAD + 100
+            with raises(ValueError):
+                reader.get_tile('missing', 2, 0, 0)
+
+    def test_cache_evicts(self, make_gpkg):
+        write_tiles(make_gpkg)
+        with TileReader(make_gpkg.file_path, cache_bytes=2 * (ENTRY_OVERHEAD + 100)) as reader:
+            for y in range(3):
+                reader.get_tile('tiles', 2, 0, y)
+            assert len(reader) == 2
+            assert reader.size <= reader.cache_bytes
+            # the least recently used tile went first
+            reader.get_tile('tiles', 2, 0, 0)
+            assert reader.hits == 0
+            reader.get_tile('tiles', 2, 0, 2)
+            assert reader.hits == 1
+            reader.clear()
+            assert (len(reader), reader.size) == (0, 0)
+
+    def test_get_tiles(self, make_gpkg):
+        write_tiles(make_gpkg)
+        with TileReader(make_gpkg.file_path) as reader:
+            reader.get_tile('tiles', 2, 0, 0)
+            viewport = [(x, y) for x in range(3) for y in range(3)] + [(4, 0)]
+            tiles = reader.get_tiles('tiles', 2, viewport)
+            assert sorted(tiles) == sorted(viewport)
+            assert tiles[(2, 1)] == bytes(bytearray([2, 1]) * 50)
+            assert tiles[(4, 0)] is None
+            assert reader.hits == 1
+            # scattered tiles are looked up one by one
+            tiles = reader.get_tiles('tiles', 2, [(0, 3), (3, 0), (9, 9)])
+            assert tiles == {(0, 3): bytes(bytearray([0, 3]) * 50), (3, 0): bytes(bytearray([3, 0]) * 50),
+                             (9, 9): None}
+            assert reader.get_tiles('tiles', 2, []) == {}
+
+    @pytest.mark.skipif(version_info < (3, 4), reason="read only URI filenames require Python 3.4 or later")
+    def test_missing_file(self, make_gpkg):
+        file_path = make_gpkg.file_path + ".missing"
+        # opened read only, so no empty database is created in its place
+        with raises(OperationalError):
+            TileReader(file_path)
+        assert not exists(file_path)
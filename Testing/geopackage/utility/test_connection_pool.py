@@ -0,0 +1,80 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3
+
+Version:
+"""
+from sqlite3 import Binary, OperationalError
+from threading import Thread
+
+from pytest import raises
+
+from Testing.test_tiles2gpkg import make_gpkg
+from scripts.geopackage.core.geopackage_core import GeoPackageCore
+from scripts.geopackage.utility.connection_pool import ReadConnectionPool
+from scripts.geopackage.utility.sql_utility import get_read_only_connection
+
+
+def run_threads(target, count):
+    threads = [Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class TestReadConnectionPool(object):
+
+    def test_read_only_connection(self, make_gpkg):
+        make_gpkg.initialize()
+        for immutable in (False, True):
+            db_con = get_read_only_connection(make_gpkg.file_path, immutable)
+            assert db_con.execute("SELECT count(*) FROM gpkg_contents;").fetchone()[0] == 1
+            with raises(OperationalError):
+                db_con.execute("CREATE TABLE test (value INTEGER);")
+            db_con.close()
+
+    def test_connection_per_thread(self, make_gpkg):
+        make_gpkg.initialize()
+        with ReadConnectionPool(make_gpkg.file_path) as pool:
+            assert pool.connection() is pool.connection()
+            assert pool.connection().execute("pragma mmap_size;").fetchone()[0] > 0
+            connections = []
+            run_threads(lambda: connections.append(pool.connection()), 4)
+            assert len(set(id(db_con) for db_con in connections + [pool.connection()])) == 5
+            assert len(pool) == 5
+            # the getters take the cursors of the pool
+            entries = GeoPackageCore.get_all_content_entries(pool.cursor())
+            assert [entry.table_name for entry in entries] == ['tiles']
+        closed = ReadConnectionPool(make_gpkg.file_path)
+        closed.close()
+        with raises(ValueError):
+            closed.connection()
+
+    def test_shared_tile_reader(self, make_gpkg):
+        make_gpkg.initialize()
+        make_gpkg.insert_tiles((1, x, 0, Binary(bytes(bytearray([x])))) for x in range(8))
+        results = []
+        with make_gpkg.open_reader(immutable=True) as reader:
+            run_threads(lambda: results.append(reader.get_tiles('tiles', 1, [(x, 0) for x in range(8)])), 8)
+        assert len(results) == 8
+        assert all(tiles[(3, 0)] == bytes(bytearray([3])) for tiles in results)
@@ -1,3 +1,5 @@
+from sqlite3 import sqlite_version_info
+
 from pytest import raises
 
 from Testing.test_tiles2gpkg import make_gpkg
@@ -6,7 +8,7 @@ from scripts.geopackage.extensions.extension import Extension, EXTENSION_READ_WR
 from scripts.geopackage.extensions.geopackage_extensions import GeoPackageExtensions, GEOPACKAGE_EXTENSIONS_TABLE_NAME
 from scripts.geopackage.utility.sql_column_query import SqlColumnQuery
 from scripts.geopackage.utility.sql_utility import get_database_connection, column_exists, row_id_exists, select_query, \
-    update_row, insert_row
+    update_row, insert_row, insert_or_update_row, upsert_row, UPSERT_MINIMUM_SQLITE_VERSION
 
 
 class TestSqlUtility(object):
@@ -162,3 +164,63 @@ class TestSqlUtility(object):
                            table_name='not existant',  # doesn't exist
                            sql_columns_list=[SqlColumnQuery(column_name='column',
                                                             column_value=None)])
+
+    def test_select_query_remembers_table(self, make_gpkg):
+        gpkg = make_gpkg
+
+        with get_database_connection(gpkg.file_path) as db_conn:
+            cursor = db_conn.cursor()
+            cursor.execute("CREATE TABLE things (name TEXT, size INTEGER);")
+            insert_row(cursor=cursor,
+                       table_name='things',
+                       sql_columns_list=[SqlColumnQuery(column_name='name', column_value='a'),
+                                         SqlColumnQuery(column_name='size', column_value=1)])
+            assert 'things' in db_conn.verified_tables
+            rows = select_query(cursor=cursor,
+                                table_name='things',
+                                select_columns=['size'],
+                                where_columns_dictionary={'name': 'a'})
+            assert [row['size'] for row in rows] == [1]
+            # a table dropped after it was verified still raises the error of a missing table
+            cursor.execute("DROP TABLE things;")
+            with raises(ValueError):
+                select_query(cursor=cursor,
+                             table_name='things',
+                             select_columns=['size'],
+                             where_columns_dictionary={'name': 'a'})
+            assert 'things' not in db_conn.verified_tables
+
+    def test_insert_or_update_row_upsert(self, make_gpkg):
+        gpkg = make_gpkg
+
+        with get_database_connection(gpkg.file_path) as db_conn:
+            cursor = db_conn.cursor()
+            cursor.execute("CREATE TABLE things (name TEXT PRIMARY KEY, size INTEGER);")
+            for size in (1, 2):
+                insert_or_update_row(cursor=cursor,
+                                     table_name='things',
+                                     sql_columns_list=[SqlColumnQuery(column_name='name', column_value='a'),
+                                                       SqlColumnQuery(column_name='size', column_value=size,
+                                                                      include_in_where_clause=False)])
+            assert [tuple(row) for row in cursor.execute("SELECT name, size FROM things;")] == [('a', 2)]
+            upserted = upsert_row(cursor=cursor,
+                                  table_name='things',
+                                  sql_columns_list=[SqlColumnQuery(column_name='name', column_value='b'),
+                                                    SqlColumnQuery(column_name='size', column_value=3,
+                                                                   include_in_where_clause=False)])
+            assert upserted == (sqlite_version_info >= UPSERT_MINIMUM_SQLITE_VERSION)
+
+    def test_insert_or_update_row_without_constraint(self, make_gpkg):
+        gpkg = make_gpkg
+
+        with get_database_connection(gpkg.file_path) as db_conn:
+            cursor = db_conn.cursor()
+            # no unique constraint on name, so the row is looked up with a SELECT instead
+            cursor.execute("CREATE TABLE things (name TEXT, size INTEGER);")
+            columns = [SqlColumnQuery(column_name='name', column_value='a'),
+                       SqlColumnQuery(column_name='size', column_value=1, include_in_where_clause=False)]
+            assert not upsert_row(cursor=cursor, table_name='things', sql_columns_list=columns)
+            for size in (1, 2):
+                columns[1].column_value = size
+                insert_or_update_row(cursor=cursor, table_name='things', sql_columns_list=columns)
+            assert [tuple(row) for row in cursor.execute("SELECT name, size FROM things;")] == [('a', 2)]
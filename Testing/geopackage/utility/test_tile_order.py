@@ -0,0 +1,31 @@
+from sqlite3 import connect
+
+from pytest import mark
+
+from scripts.geopackage.utility.tile_order import zorder_key, hilbert_key, register_tile_order_functions, CURVE_BITS
+
+
+class TestTileOrder(object):
+
+    def test_zorder_key(self):
+        assert [zorder_key(x, y) for y in range(2) for x in range(2)] == [0, 1, 2, 3]
+        assert zorder_key(3, 5) == 0b100111
+        assert zorder_key(2 ** CURVE_BITS - 1, 2 ** CURVE_BITS - 1) == 4 ** CURVE_BITS - 1
+
+    @mark.parametrize("bits", [1, 2, 3, 5])
+    def test_hilbert_key_walks_neighbours(self, bits):
+        side = 2 ** bits
+        tiles = dict((hilbert_key(x, y), (x, y)) for x in range(side) for y in range(side))
+        assert sorted(tiles) == list(range(side * side))
+        for key in range(side * side - 1):
+            (x1, y1), (x2, y2) = tiles[key], tiles[key + 1]
+            assert abs(x1 - x2) + abs(y1 - y2) == 1
+
+    def test_hilbert_key_fits_sqlite_integer(self):
+        assert hilbert_key(2 ** CURVE_BITS - 1, 0) < 2 ** 63
+
+    def test_register_tile_order_functions(self):
+        db_con = connect(":memory:")
+        register_tile_order_functions(db_con)
+        assert db_con.execute("SELECT zorder_key(3, 5), hilbert_key(3, 5);").fetchone() == \
+            (zorder_key(3, 5), hilbert_key(3, 5))
@@ -0,0 +1,85 @@
+from os.path import join
+from shutil import rmtree
+from sqlite3 import connect
+from tempfile import mkdtemp
+
+from pytest import raises
+
+from scripts.geopackage.nsg_geopackage import NsgGeopackage
+from scripts.geopackage.utility.sql_utility import get_database_connection
+from scripts.geopackage.utility.write_profile import WriteProfile, WRITE_PROFILES, BULK_LOAD, SAFE, READ_SERVING, \
+    get_write_profile
+from scripts.packaging.temp_db import TempDB
+
+
+class TestWriteProfile(object):
+
+    def test_pragmas(self):
+        profile = WriteProfile(journal_mode='WAL', page_size=8192, cache_size=-1024)
+        assert profile.pragmas() == ["pragma page_size = 8192;",
+                                     "pragma cache_size = -1024;",
+                                     "pragma journal_mode = WAL;"]
+        assert WriteProfile().pragmas() == []
+
+    def test_invalid_page_size(self):
+        with raises(ValueError):
+            WriteProfile(page_size=80000)
+
+    def test_copy(self):
+        profile = WRITE_PROFILES[BULK_LOAD].copy(locking_mode=None)
+        assert profile.locking_mode is None
+        assert profile.page_size == WRITE_PROFILES[BULK_LOAD].page_size
+        assert WRITE_PROFILES[BULK_LOAD].locking_mode == 'EXCLUSIVE'
+
+    def test_journaled(self):
+        profile = WRITE_PROFILES[BULK_LOAD].journaled()
+        assert (profile.journal_mode, profile.synchronous) == ('DELETE', 'FULL')
+        # the other settings are kept
+        assert profile.cache_size == WRITE_PROFILES[BULK_LOAD].cache_size
+        assert WRITE_PROFILES[SAFE].journaled() is WRITE_PROFILES[SAFE]
+        assert WriteProfile(journal_mode='WAL', synchronous='NORMAL').journaled().journal_mode == 'WAL'
+        assert WriteProfile(synchronous='OFF').journaled().synchronous == 'FULL'
+
+    def test_get_write_profile(self):
+        assert get_write_profile(None) is None
+        assert get_write_profile(SAFE) is WRITE_PROFILES[SAFE]
+        profile = WriteProfile()
+        assert get_write_profile(profile) is profile
+        with raises(ValueError):
+            get_write_profile("fast")
+
+    def test_get_database_connection_applies_profile(self):
+        folder = mkdtemp()
+        try:
+            db_con = get_database_connection(join(folder, "test.gpkg"), BULK_LOAD)
+            db_con.execute("CREATE TABLE test (value INTEGER);")
+            assert db_con.execute("pragma page_size;").fetchone()[0] == 65536
+            assert db_con.execute("pragma journal_mode;").fetchone()[0] == 'off'
+            assert db_con.execute("pragma synchronous;").fetchone()[0] == 0
+            assert db_con.execute("pragma locking_mode;").fetchone()[0] == 'exclusive'
+            db_con.close()
+            db_con = get_database_connection(join(folder, "test.gpkg"), READ_SERVING)
+            assert db_con.execute("pragma mmap_size;").fetchone()[0] == WRITE_PROFILES[READ_SERVING].mmap_size
+            db_con.close()
+        finally:
+            rmtree(folder)
+
+    def test_temp_db_page_size(self):
+        folder = mkdtemp()
+        try:
+            with TempDB(folder, "tiles") as temp_db:
+                path = join(folder, temp_db.name)
+            db_con = connect(path)
+            assert db_con.execute("pragma page_size;").fetchone()[0] == 65536
+            db_con.close()
+        finally:
+            rmtree(folder)
+
+    def test_nsg_geopackage_shares_the_file(self):
+        folder = mkdtemp()
+        try:
+            with NsgGeopackage(join(folder, "test.gpkg"), 4326, "tiles", BULK_LOAD) as gpkg:
+                gpkg.initialize()
+                assert gpkg.execute("pragma locking_mode;").fetchone()[0] == 'normal'
+        finally:
+            rmtree(folder)
@@ -0,0 +1,66 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3, argparse
+   Optional: Python Imaging Library (PIL or Pillow)
+
+Version:
+"""
+from scripts.packaging.encode_cache import EncodeCache, ENTRY_OVERHEAD
+
+
+class TestEncodeCache(object):
+
+    def test_reuses_results(self):
+        calls = []
+
+        def encoder(data, suffix):
+            calls.append(data)
+            return data + suffix
+
+        cache = EncodeCache()
+        assert cache.encode(b'tile', encoder, b'!') == b'tile!'
+        assert cache.encode(b'tile', encoder, b'!') == b'tile!'
+        # the encoder arguments are part of the key
+        assert cache.encode(b'tile', encoder, b'?') == b'tile?'
+        assert calls == [b'tile', b'tile']
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_caches_none(self):
+        cache = EncodeCache()
+        assert cache.encode(b'empty', lambda data: None) is None
+        assert cache.encode(b'empty', lambda data: b'not called') is None
+        assert cache.hits == 1
+
+    def test_evicts_least_recently_used(self):
+        cache = EncodeCache(2 * (ENTRY_OVERHEAD + 10))
+        for data in (b'a', b'b', b'a', b'c'):
+            cache.encode(data, lambda value: value * 10)
+        assert len(cache) == 2 and cache.size <= cache.max_bytes
+        cache.encode(b'a', lambda value: b'x')
+        assert cache.hits == 2
+        cache.encode(b'b', lambda value: b'y' * 10)
+        assert cache.misses == 4
+
+    def test_large_results_are_not_cached(self):
+        cache = EncodeCache(ENTRY_OVERHEAD)
+        cache.encode(b'a', lambda value: b'too big')
+        assert len(cache) == 0 and cache.size == 0
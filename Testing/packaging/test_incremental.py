@@ -0,0 +1,92 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3
+
+Version:
+"""
+import shutil
+from os.path import join
+from sqlite3 import Binary
+from tempfile import mkdtemp
+
+import pytest
+
+from scripts.geopackage.geopackage import Geopackage
+from scripts.packaging.incremental import compare_sources, read_sources, read_tile_keys, record_sources, \
+    remove_tiles, remove_zoom_levels, stat_sources
+
+TABLE_NAME = "tiles"
+
+
+@pytest.fixture(scope="function")
+def gpkg():
+    folder = mkdtemp()
+    with Geopackage(join(folder, "test.gpkg"), 4326, TABLE_NAME) as geopackage:
+        geopackage.initialize()
+        yield geopackage
+    shutil.rmtree(folder)
+
+
+def test_stat_sources():
+    folder = mkdtemp()
+    try:
+        paths = [join(folder, "{0}.png".format(size)) for size in range(3)]
+        for size, path in enumerate(paths):
+            with open(path, 'wb') as tile_file:
+                tile_file.write(b'x' * size)
+        assert [size for size, _ in stat_sources(paths, 2)] == [0, 1, 2]
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_compare_sources():
+    keys = [(1, 0, 0), (1, 0, 1), (1, 1, 0)]
+    paths = ["a.png", "b.png", "c.png"]
+    stats = [(10, 1.0), (10, 2.0), (10, 1.0)]
+    stored = {(1, 0, 0): ("a.png", 10, 1.0),
+              (1, 0, 1): ("b.png", 10, 1.0),
+              (2, 0, 0): ("d.png", 10, 1.0)}
+    # (3, 0, 0) has no recorded source, e.g. the package was not built incrementally
+    tile_keys = {(1, 0, 0), (1, 0, 1), (2, 0, 0), (3, 0, 0)}
+    positions, vanished = compare_sources(keys, paths, stats, stored, tile_keys)
+    assert positions == [1, 2]
+    assert vanished == [(2, 0, 0), (3, 0, 0)]
+
+
+def test_record_and_remove(gpkg):
+    assert read_sources(gpkg, TABLE_NAME) == {}
+    gpkg.insert_tiles([(1, 0, 0, Binary(b'a')), (1, 0, 1, Binary(b'b')), (2, 0, 0, Binary(b'c'))])
+    record_sources(gpkg, TABLE_NAME, [(1, 0, 0, "a.png", 1, 1.5), (1, 0, 1, "b.png", 1, 1.5)])
+    record_sources(gpkg, "other", [(1, 0, 0, "z.png", 1, 1.5)])
+    assert read_sources(gpkg, TABLE_NAME) == {(1, 0, 0): ("a.png", 1, 1.5), (1, 0, 1): ("b.png", 1, 1.5)}
+    assert remove_tiles(gpkg, TABLE_NAME, [(1, 0, 1), (2, 0, 0)]) == 2
+    assert read_tile_keys(gpkg, TABLE_NAME) == {(1, 0, 0)}
+    assert list(read_sources(gpkg, TABLE_NAME)) == [(1, 0, 0)]
+    assert list(read_sources(gpkg, "other")) == [(1, 0, 0)]
+
+
+def test_remove_zoom_levels(gpkg):
+    for zoom in (1, 2, 3):
+        gpkg.execute("""INSERT INTO gpkg_tile_matrix VALUES (?, ?, 1, 1, 256, 256, 1.0, 1.0);""", (TABLE_NAME, zoom))
+    remove_zoom_levels(gpkg, TABLE_NAME, [1, 3])
+    result = gpkg.execute("SELECT zoom_level FROM gpkg_tile_matrix ORDER BY zoom_level;")
+    assert [row[0] for row in result.fetchall()] == [1, 3]
@@ -0,0 +1,114 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: multiprocessing
+
+Version:
+"""
+from multiprocessing import Process
+
+from scripts.packaging.memory_budget import ByteBudget, ReleasingWriter, bounded_insert, byte_batches
+
+
+def tiles(*sizes):
+    return [(1, 0, index, b'x' * size) for index, size in enumerate(sizes)]
+
+
+def test_byte_batches():
+    batches = list(byte_batches(tiles(4, 4, 4, 10, 1), 2, 8))
+    assert [[len(tile[3]) for tile in batch] for batch in batches] == [[4, 4], [4], [10], [1]]
+    assert list(byte_batches([], 2, 8)) == []
+
+
+def test_bounded_insert():
+    def insert(batch, commit_size):
+        transactions.append((len(list(batch)), commit_size))
+        return commit_size
+
+    transactions = []
+    assert bounded_insert(insert) is insert
+    assert bounded_insert(insert, 8)(iter(tiles(4, 4, 4)), 10) == 3
+    assert transactions == [(2, 2), (1, 1)]
+
+
+def release_later(budget, size):
+    budget.release(size)
+
+
+def test_byte_budget():
+    budget = ByteBudget(10)
+    budget.acquire(6)
+    budget.acquire(4)
+    assert budget.held == 10
+    worker = Process(target=release_later, args=(budget, 6))
+    worker.start()
+    # blocks until the other process gives the bytes back
+    budget.acquire(5)
+    worker.join()
+    assert budget.held == 9
+    budget.release(9)
+    # larger than the whole budget, let through when nothing is held
+    budget.acquire(50)
+    assert budget.held == 50
+
+
+def test_byte_budget_large():
+    # a 64 bit count of bytes, built the same way on Python 2 and 3
+    budget = ByteBudget(2 ** 40)
+    budget.acquire(2 ** 33)
+    assert budget.held == 2 ** 33
+
+
+def test_releasing_writer():
+    def insert(batch, commit_size):
+        # the bytes of a transaction are still held while it is written
+        transactions.append(([len(tile[3]) for tile in batch], commit_size, budget.held))
+        return commit_size
+
+    transactions = []
+    budget = ByteBudget(20)
+    budget.acquire(4 + 4 + 4 + 10 + 1)
+    writer = ReleasingWriter(insert, budget)
+    assert writer.commit_bytes == 10
+    assert writer.write(iter(tiles(4, 4, 4, 10, 1)), 2) == 5
+    assert transactions == [([4, 4], 2, 23), ([4, 10], 2, 15), ([1], 1, 1)]
+    assert budget.held == 0
+
+
+def test_releasing_writer_flush():
+    def insert(batch, commit_size):
+        transactions.append(len(batch))
+        return commit_size
+
+    def flushing(tiles):
+        for tile in tiles:
+            yield tile
+            # e.g. no more tiles come until the workers get their bytes back
+            writer.flush()
+            held.append(budget.held)
+
+    transactions, held = [], []
+    budget = ByteBudget(100)
+    budget.acquire(3)
+    writer = ReleasingWriter(insert, budget)
+    assert writer.write(flushing(tiles(1, 1, 1)), 10) == 3
+    assert transactions == [1, 1, 1]
+    assert held == [2, 1, 0]
@@ -0,0 +1,94 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: multiprocessing
+
+Version:
+"""
+import shutil
+from os.path import join
+from tempfile import mkdtemp
+from threading import current_thread
+
+import pytest
+
+from scripts.packaging.read_ahead import NETWORK_READ_AHEAD, get_file_system_type, get_read_ahead, read_ahead, \
+    read_file
+
+
+@pytest.fixture(scope="function")
+def folder():
+    folder = mkdtemp()
+    yield folder
+    shutil.rmtree(folder)
+
+
+def test_read_file(folder):
+    path = join(folder, "tile.png")
+    with open(path, 'wb') as tile_file:
+        tile_file.write(b'\x89PNG' * 1000)
+    data = read_file(path)
+    assert isinstance(data, bytearray)
+    assert data == b'\x89PNG' * 1000
+    with open(path, 'wb'):
+        pass
+    assert read_file(path) == b''
+
+
+def test_read_ahead():
+    main_thread = current_thread()
+
+    def read(item):
+        threads.append(current_thread() is main_thread)
+        return item * 2
+
+    threads = []
+    assert list(read_ahead(range(10), read, 0)) == [(item, item * 2) for item in range(10)]
+    assert all(threads)
+    threads = []
+    assert list(read_ahead(range(10), read, 3)) == [(item, item * 2) for item in range(10)]
+    assert not any(threads)
+
+
+def test_read_ahead_raises():
+    def read(item):
+        if item == 2:
+            raise IOError("missing")
+        return item
+
+    results = read_ahead(range(5), read, 2)
+    assert next(results) == (0, 0)
+    assert next(results) == (1, 1)
+    with pytest.raises(IOError):
+        next(results)
+
+
+def test_get_read_ahead(folder):
+    mounts_path = join(folder, "mounts")
+    with open(mounts_path, 'w') as mounts:
+        mounts.write("/dev/sda1 / ext4 rw 0 0\n")
+        mounts.write("server:/export /mnt/tiles\\040nfs nfs4 rw 0 0\n")
+    assert get_file_system_type("/home", mounts_path) == 'ext4'
+    assert get_file_system_type("/mnt/tiles nfs/0/0", mounts_path) == 'nfs4'
+    assert get_file_system_type("/mnt/tiles", mounts_path) == 'ext4'
+    assert get_read_ahead("/mnt/tiles nfs", mounts_path) == NETWORK_READ_AHEAD
+    assert get_read_ahead("/home", mounts_path) == 0
+    assert get_read_ahead("/home", join(folder, "missing")) == 0
@@ -0,0 +1,117 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3
+
+Version:
+"""
+import shutil
+from contextlib import closing
+from os import listdir
+from os.path import exists, join
+from sqlite3 import connect
+from tempfile import mkdtemp
+
+import pytest
+
+from scripts.packaging.run_journal import ENCODE, MERGE, RunJournal, make_run_id
+from scripts.packaging.tile_index import TileIndex
+
+
+@pytest.fixture(scope="function")
+def folder():
+    folder = mkdtemp()
+    yield folder
+    shutil.rmtree(folder)
+
+
+def touch(path):
+    with open(path, 'wb') as part_file:
+        part_file.write(b'part')
+
+
+def test_make_run_id():
+    tile_index = TileIndex()
+    tile_index.append(1, 0, 0, "base", "0.png")
+    tiles = list(tile_index)
+    assert make_run_id(tile_index, dict(imagery='png')) == make_run_id(tile_index, dict(imagery='png'))
+    assert make_run_id(tile_index, dict(imagery='png')) != make_run_id(tile_index, dict(imagery='jpeg'))
+    tile_index.append(1, 0, 1, "base", "1.png")
+    assert make_run_id(tile_index, dict(imagery='png')) != make_run_id(tile_index[:1], dict(imagery='png'))
+    assert len(make_run_id(tiles, {})) == 16
+    # a source file rewritten since
+    assert make_run_id(tiles, {}, [(10, 1.5)]) == make_run_id(tiles, {}, [(10, 1.5)])
+    assert make_run_id(tiles, {}, [(10, 1.5)]) != make_run_id(tiles, {}, [(10, 2.5)])
+    assert make_run_id(tiles, {}, [(10, 1.5)]) != make_run_id(tiles, {}, [(11, 1.5)])
+
+
+def test_resume(folder):
+    path = RunJournal.journal_path(join(folder, "out.gpkg"))
+    with RunJournal(path, "run1") as journal:
+        assert not journal.resumed
+        assert journal.state == ENCODE
+        assert journal.plan([(0, 2), (2, 4), (4, 5)]) == [(0, 0, 2), (1, 2, 4), (2, 4, 5)]
+        journal.commit(1)
+        assert journal.part_name(1) == "run1-000001.gpkg.part"
+    with RunJournal(path, "run1") as journal:
+        assert journal.resumed
+        # the chunks of the first attempt are kept
+        assert journal.plan([(0, 5)]) == [(0, 0, 2), (2, 4, 5)]
+        assert journal.committed() == [1]
+        journal.state = MERGE
+    with RunJournal(path, "run1") as journal:
+        assert journal.state == MERGE
+        journal.finish()
+    assert not exists(path)
+
+
+def test_clean(folder):
+    path = RunJournal.journal_path(join(folder, "out.gpkg"))
+    with RunJournal(path, "run1") as journal:
+        journal.plan([(0, 1), (1, 2)])
+        journal.commit(0)
+        for chunk in (0, 1):
+            touch(join(folder, journal.part_name(chunk)))
+    touch(join(folder, "0123456789abcdef0123456789abcdef.gpkg.part"))
+    with RunJournal(path, "run1") as journal:
+        # the part of the chunk that is not committed may be incomplete
+        assert journal.clean(folder) == 1
+        assert journal.part_paths(folder) == [join(folder, "run1-000000.gpkg.part")]
+    with RunJournal(path, "run2") as journal:
+        assert not journal.resumed
+        assert journal.plan([(0, 2)]) == [(0, 0, 2)]
+        assert journal.clean(folder) == 1
+        assert journal.part_paths(folder) == []
+    # parts of unknown runs are left alone
+    assert sorted(listdir(folder)) == ["0123456789abcdef0123456789abcdef.gpkg.part", "out.gpkg.journal"]
+
+
+def test_missing_state(folder):
+    path = RunJournal.journal_path(join(folder, "out.gpkg"))
+    with RunJournal(path, "run1") as journal:
+        journal.plan([(0, 1)])
+    # as left by a crash between writing the run id and the state
+    with closing(connect(path)) as db_con:
+        with db_con:
+            db_con.execute("DELETE FROM run WHERE key = 'state';")
+    with RunJournal(path, "run1") as journal:
+        assert journal.resumed
+        assert journal.state == ENCODE
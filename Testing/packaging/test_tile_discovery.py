@@ -0,0 +1,95 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3, argparse
+   Optional: Python Imaging Library (PIL or Pillow)
+
+Version:
+"""
+import shutil
+from os import makedirs, remove, stat, utime
+from os.path import join, exists
+from tempfile import mkdtemp
+
+import pytest
+
+from scripts.packaging.tile_discovery import discover_tiles, parse_tile_name
+
+
+def touch(path):
+    with open(path, 'wb') as tile_file:
+        tile_file.write(b'tile')
+
+
+@pytest.fixture(scope="function")
+def tile_folder():
+    folder = mkdtemp()
+    for z, x, y in [(1, 0, 0), (1, 0, 1), (1, 1, 0), (2, 3, 2)]:
+        column = join(folder, str(z), str(x))
+        if not exists(column):
+            makedirs(column)
+        touch(join(column, "{0}.png".format(y)))
+    makedirs(join(folder, "3"))
+    touch(join(folder, "3", "5_6.jpg"))
+    # things that are not tiles
+    touch(join(folder, "1", "0", "readme.txt"))
+    touch(join(folder, "tilemapresource.xml"))
+    makedirs(join(folder, "legend"))
+    touch(join(folder, "legend", "0.png"))
+    yield folder
+    shutil.rmtree(folder)
+
+
+class TestTileDiscovery(object):
+
+    def test_parse_tile_name(self):
+        assert parse_tile_name("12.png") == (None, 12)
+        assert parse_tile_name("3_4.jpeg") == (3, 4)
+        assert parse_tile_name("readme.txt") is None
+        assert parse_tile_name("blank.png") is None
+
+    def test_discover_tiles(self, tile_folder):
+        tile_index = discover_tiles(tile_folder, io_threads=2)
+        assert list(tile_index.coordinates()) == [(1, 0, 0), (1, 0, 1), (1, 1, 0), (2, 3, 2), (3, 5, 6)]
+        assert tile_index.path(3) == join(tile_folder, "2", "3", "2.png")
+        assert tile_index.path(4) == join(tile_folder, "3", "5_6.jpg")
+
+    def test_discover_tiles_manifest_reused(self, tile_folder):
+        manifest = join(tile_folder, "manifest.json")
+        discover_tiles(tile_folder, manifest_path=manifest)
+        assert exists(manifest)
+        # remove a tile without changing the directory mtime, the manifest entry is trusted
+        column = join(tile_folder, "2", "3")
+        times = stat(column)
+        remove(join(column, "2.png"))
+        utime(column, (times.st_atime, times.st_mtime))
+        tile_index = discover_tiles(tile_folder, manifest_path=manifest)
+        assert (2, 3, 2) in list(tile_index.coordinates())
+
+    def test_discover_tiles_manifest_revalidated(self, tile_folder):
+        manifest = join(tile_folder, "manifest.json")
+        discover_tiles(tile_folder, manifest_path=manifest)
+        column = join(tile_folder, "2", "3")
+        times = stat(column)
+        touch(join(column, "3.png"))
+        utime(column, (times.st_atime, times.st_mtime + 10))
+        tile_index = discover_tiles(tile_folder, manifest_path=manifest)
+        assert [tile for tile in tile_index.coordinates() if tile[0] == 2] == [(2, 3, 2), (2, 3, 3)]
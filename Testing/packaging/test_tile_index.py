@@ -0,0 +1,120 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3, argparse
+   Optional: Python Imaging Library (PIL or Pillow)
+
+Version:
+"""
+from os.path import join
+from pickle import dumps, loads
+
+import pytest
+
+from scripts.packaging import tile_index as tile_index_module
+from scripts.packaging.tile_index import TileIndex, column_starts, spatial_chunks, tile_coordinates, zoom_extents
+
+
+def make_tile_index():
+    tile_index = TileIndex()
+    tile_index.append(1, 0, 0, join("base", "1", "0"), "0.png")
+    tile_index.append(1, 0, 1, join("base", "1", "0"), "1.png")
+    tile_index.append(2, 3, 2, join("base", "2"), "3_2.jpg")
+    tile_index.append(2, 3, 3, join("base", "2", "3"), "003.png")
+    return tile_index
+
+
+class TestTileIndex(object):
+
+    def test_getitem(self):
+        tile_index = make_tile_index()
+        assert len(tile_index) == 4
+        assert tile_index[1] == dict(z=1, x=0, y=1, path=join("base", "1", "0", "1.png"))
+        assert tile_index[-2]['path'] == join("base", "2", "3_2.jpg")
+        # names that cannot be rebuilt from the coordinates are kept as they are
+        assert tile_index[3]['path'] == join("base", "2", "3", "003.png")
+
+    def test_slice(self):
+        subset = make_tile_index()[1:3]
+        assert isinstance(subset, TileIndex)
+        assert [tile['path'] for tile in subset] == [join("base", "1", "0", "1.png"), join("base", "2", "3_2.jpg")]
+
+    def test_take(self):
+        tile_index = make_tile_index()
+        subset = tile_index.take([3, 0])
+        assert isinstance(subset, TileIndex)
+        assert list(subset) == [tile_index[3], tile_index[0]]
+        assert len(tile_index.take([])) == 0
+
+    def test_paths_are_interned(self):
+        tile_index = make_tile_index()
+        assert tile_index.prefix_ids[0] == tile_index.prefix_ids[1]
+        assert tile_index.template_ids[0] == tile_index.template_ids[1]
+
+    def test_pickle(self):
+        tile_index = make_tile_index()
+        copy = loads(dumps(tile_index))
+        assert list(copy) == list(tile_index)
+        copy.append(3, 0, 0, join("base", "3", "0"), "0.png")
+        assert copy[4]['path'] == join("base", "3", "0", "0.png")
+
+    def test_tile_coordinates(self):
+        tile_index = make_tile_index()
+        assert list(tile_coordinates(tile_index)) == list(tile_coordinates(list(tile_index)))
+
+    def test_zoom_extents(self, monkeypatch):
+        tile_index = make_tile_index()
+        tile_index.append(1, 5, 7, join("base", "1", "5"), "7.png")
+        expected = {1: (0, 5, 0, 7), 2: (3, 3, 2, 3)}
+        assert zoom_extents(list(tile_index)) == expected
+        monkeypatch.setattr(tile_index_module, "numpy", None)
+        assert zoom_extents(tile_index) == expected
+
+    def test_zoom_extents_numpy(self):
+        pytest.importorskip("numpy")
+        tile_index = make_tile_index()
+        # out of zoom order, as a hand built index may be
+        tile_index.append(1, 5, 7, join("base", "1", "5"), "7.png")
+        assert zoom_extents(tile_index) == {1: (0, 5, 0, 7), 2: (3, 3, 2, 3)}
+        assert zoom_extents(TileIndex()) == {}
+
+    @pytest.mark.parametrize("use_numpy", [True, False])
+    def test_spatial_chunks(self, monkeypatch, use_numpy):
+        if use_numpy:
+            pytest.importorskip("numpy")
+        else:
+            monkeypatch.setattr(tile_index_module, "numpy", None)
+        tile_index = TileIndex()
+        for z, x, rows in [(1, 0, 2), (1, 1, 2), (2, 0, 1), (2, 1, 7), (2, 2, 1), (2, 3, 1)]:
+            for y in range(rows):
+                tile_index.append(z, x, y, "base", "{0}.png".format(y))
+        assert column_starts(tile_index) == [0, 2, 4, 5, 12, 13]
+        # ranges end on columns, the seven tile column is split by rows on its own
+        assert spatial_chunks(tile_index, 3) == [(0, 2), (2, 5), (5, 8), (8, 11), (11, 12), (12, 14)]
+        assert spatial_chunks(tile_index, 100) == [(0, 14)]
+
+    def test_spatial_chunks_unsorted(self):
+        tile_index = make_tile_index()
+        tile_index.append(1, 5, 7, join("base", "1", "5"), "7.png")
+        assert column_starts(tile_index) is None
+        assert spatial_chunks(tile_index, 2) == [(0, 2), (2, 4), (4, 5)]
+        assert spatial_chunks(list(range(5)), 2) == [(0, 2), (2, 4), (4, 5)]
+        assert spatial_chunks(TileIndex(), 2) == []
@@ -28,6 +28,7 @@ Description: Test cases for tiles2gpkg_parallel.py
 Version:
 """
 import argparse
+import json
 import os
 import shutil
 from math import pi
@@ -35,18 +36,21 @@ from os import getcwd
 from os import listdir
 from os import mkdir
 from os import remove
+from os import utime
 from os import walk
-from os.path import abspath, dirname
+from os.path import abspath, dirname, exists
 from os.path import join
 from random import randint
-from sqlite3 import Binary
-from sys import path
+from sqlite3 import Binary, IntegrityError
+from subprocess import PIPE, Popen
+from sys import executable, path
 from sys import version_info
 
 import pytest
 from pytest import raises
 
 from Testing.rgb_tiles import geodetic, mercator
+from scripts.common.telemetry import Telemetry
 from scripts.common.zoom_metadata import ZoomMetadata
 from scripts.geopackage.geopackage import Geopackage
 from scripts.geopackage.nsg_geopackage import NsgGeopackage
@@ -55,13 +59,19 @@ from scripts.geopackage.srs.geodetic import Geodetic
 from scripts.geopackage.srs.mercator import Mercator
 from scripts.geopackage.srs.scaled_world_mercator import ScaledWorldMercator
 from scripts.geopackage.utility.sql_utility import get_database_connection, table_exists
+from scripts.geopackage.utility.tile_order import hilbert_key, zorder_key
+from scripts.packaging import tile_index as tile_index_module
+from scripts.packaging import tiles2gpkg_parallel as tiles2gpkg_module
 from scripts.packaging.temp_db import TempDB
+from scripts.packaging.tile_index import TileIndex
 from scripts.packaging.tiles2gpkg_parallel import img_to_buf, img_has_transparency, file_count, split_all, worker_map, \
-    build_lut, sqlite_worker, allocate, build_lut_nsg, combine_worker_dbs, main
+    build_lut, sqlite_worker, allocate, build_lut_nsg, combine_worker_dbs, main, stream_tiles, get_chunk_size, \
+    sqlite_chunk_worker, write_worker_dbs, encode_tile_bytes, sniff_image_type, get_backend, get_worker_count, \
+    positive_float, positive_int, get_parser
 
 if version_info[0] == 3:
     xrange = range
-from tempfile import gettempdir
+from tempfile import gettempdir, mkdtemp
 from uuid import uuid4
 
 from PIL import ImageDraw
@@ -70,6 +80,7 @@ from PIL.Image import open as iopen
 
 path.append(abspath("Packaging"))
 
+TESTING_PATH = dirname(abspath(__file__))
 GEODETIC_FILE_PATH = dirname(geodetic.__file__)
 MERCATOR_FILE_PATH = dirname(mercator.__file__)
 DEFAULT_TILES_TABLE_NAME = "tiles table"
@@ -485,6 +496,168 @@ class Testgeopackage:
         cursor = gpkg.execute("select min_x from gpkg_contents")
         assert cursor.fetchone()[0] == 1.0
 
+    def test_insert_tiles(self, make_gpkg):
+        gpkg = make_gpkg
+        gpkg.initialize()
+        tiles = ((2, x, y, Binary(b'data')) for x in xrange(3) for y in xrange(3))
+        assert gpkg.insert_tiles(tiles, commit_size=2) == 9
+        result = gpkg.execute("select count(*) from tiles;")
+        assert result.fetchone()[0] == 9
+
+    def test_bulk_load(self, make_gpkg):
+        gpkg = make_gpkg
+        gpkg.initialize()
+        gpkg.insert_tiles([(2, 0, 0, Binary(b'old'))])
+        gpkg.begin_bulk_load()
+        # out of order, with duplicates
+        gpkg.insert_tiles([(3, 1, 1, Binary(b'a')), (2, 1, 0, Binary(b'a')), (3, 1, 1, Binary(b'b')),
+                           (2, 0, 0, Binary(b'new')), (3, 0, 1, Binary(b'a'))], commit_size=2)
+        result = gpkg.execute("select count(*) from tiles;")
+        assert result.fetchone()[0] == 1
+        assert gpkg.finish_bulk_load() == (4, 1)
+        result = gpkg.execute("select zoom_level, tile_column, tile_row, tile_data from tiles order by id;")
+        tiles = [(z, x, y, bytes(data)) for z, x, y, data in result.fetchall()]
+        # the tiles written during the bulk load are in key order, the last one staged wins
+        assert tiles[1:] == [(2, 1, 0, b'a'), (3, 0, 1, b'a'), (3, 1, 1, b'b')]
+        assert [tile for tile in tiles if tile[:3] == (2, 0, 0)] == [(2, 0, 0, b'new')]
+        result = gpkg.execute("select count(*) from sqlite_master where name = 'bulk_load_staging_tiles';")
+        assert result.fetchone()[0] == 0
+        # the table keeps its constraints and insert_tiles writes into it again
+        with raises(IntegrityError):
+            gpkg.insert_tiles([(1, 0, 0, None)])
+        gpkg.insert_tiles([(1, 0, 0, Binary(b'tile'))])
+        result = gpkg.execute("select count(*) from tiles;")
+        assert result.fetchone()[0] == 5
+
+    def test_bulk_load_not_started(self, make_gpkg):
+        gpkg = make_gpkg
+        gpkg.initialize()
+        with raises(ValueError):
+            gpkg.finish_bulk_load()
+        gpkg.begin_bulk_load()
+        with raises(ValueError):
+            gpkg.begin_bulk_load()
+
+    def test_bulk_load_staging_name_taken(self, make_gpkg):
+        gpkg = make_gpkg
+        gpkg.initialize()
+        gpkg.execute("create table bulk_load_staging_tiles (name TEXT);")
+        gpkg.execute("insert into bulk_load_staging_tiles values ('mine');")
+        with raises(ValueError):
+            gpkg.begin_bulk_load()
+        with raises(ValueError):
+            gpkg.finish_bulk_load()
+        # the table of the user is neither dropped nor filled
+        result = gpkg.execute("select name from bulk_load_staging_tiles;")
+        assert [row[0] for row in result.fetchall()] == ['mine']
+
+    def test_bulk_load_interrupted(self):
+        tmp_file = join(gettempdir(), uuid4().hex + '.gpkg')
+        try:
+            with Geopackage(tmp_file, 4326, 'tiles') as gpkg:
+                gpkg.initialize()
+                gpkg.begin_bulk_load()
+                gpkg.insert_tiles([(1, 0, 0, Binary(b'tile'))])
+            with Geopackage(tmp_file, 4326, 'tiles') as gpkg:
+                # opening the file leaves it as it is
+                assert table_exists(gpkg.execute("select 1;"), 'bulk_load_staging_tiles')
+                # the next bulk load replaces the staging table of the one that was never finished
+                gpkg.begin_bulk_load()
+                gpkg.insert_tiles([(2, 0, 0, Binary(b'tile'))])
+                assert gpkg.finish_bulk_load() == (1, 0)
+                assert not table_exists(gpkg.execute("select 1;"), 'bulk_load_staging_tiles')
+                result = gpkg.execute("select zoom_level from tiles;")
+                assert [row[0] for row in result.fetchall()] == [2]
+        finally:
+            remove(tmp_file)
+
+    def __make_parts(self, folder, tile_lists):
+        parts = []
+        for tiles in tile_lists:
+            with TempDB(folder, DEFAULT_TILES_TABLE_NAME) as temp_db:
+                temp_db.insert_image_blobs(tiles)
+                parts.append(join(folder, temp_db.name))
+        return parts
+
+    def test_merge_parts(self, make_session_folder):
+        folder = join(gettempdir(), make_session_folder)
+        # disjoint parts, handed over out of order
+        parts = self.__make_parts(folder, [[(3, x, y, Binary(b'high')) for x in xrange(2) for y in xrange(2)],
+                                           [(1, x, 0, Binary(b'low')) for x in xrange(2)],
+                                           []])
+        with Geopackage(join(folder, "test.gpkg"), 3857, DEFAULT_TILES_TABLE_NAME) as gpkg:
+            gpkg.initialize()
+            merged = []
+            assert gpkg.merge_parts(parts, merged.append) == 6
+            assert sorted(merged) == sorted(parts)
+            result = gpkg.execute("select zoom_level, tile_column, tile_row from '{table}' order by id;"
+                                  .format(table=DEFAULT_TILES_TABLE_NAME))
+            assert [tuple(row) for row in result.fetchall()] == [(1, 0, 0), (1, 1, 0), (3, 0, 0), (3, 0, 1), (3, 1, 0), (3, 1, 1)]
+        assert not any(exists(part) for part in parts)
+
+    def test_merge_parts_unordered(self, make_session_folder):
+        folder = join(gettempdir(), make_session_folder)
+        # rows written bottom up, as from a TMS source
+        parts = self.__make_parts(folder, [[(2, x, y, Binary(b'tile')) for x in xrange(2) for y in (1, 0)]])
+        with Geopackage(join(folder, "test.gpkg"), 3857, DEFAULT_TILES_TABLE_NAME) as gpkg:
+            gpkg.initialize()
+            assert gpkg.merge_parts(parts) == 4
+            result = gpkg.execute("select zoom_level, tile_column, tile_row from '{table}' order by id;"
+                                  .format(table=DEFAULT_TILES_TABLE_NAME))
+            assert [tuple(row) for row in result.fetchall()] == [(2, 0, 0), (2, 0, 1), (2, 1, 0), (2, 1, 1)]
+
+    def test_merge_parts_overlapping(self, make_session_folder):
+        folder = join(gettempdir(), make_session_folder)
+        parts = self.__make_parts(folder, [[(2, 0, 0, Binary(b'a')), (2, 1, 1, Binary(b'a'))],
+                                           [(2, 1, 0, Binary(b'b')), (2, 1, 1, Binary(b'b'))]])
+        with Geopackage(join(folder, "test.gpkg"), 3857, DEFAULT_TILES_TABLE_NAME) as gpkg:
+            gpkg.initialize()
+            gpkg.merge_parts(parts)
+            result = gpkg.execute("select count(*), count(distinct tile_column || '_' || tile_row) from '{table}';"
+                                  .format(table=DEFAULT_TILES_TABLE_NAME))
+            assert tuple(result.fetchone()) == (3, 3)
+            # a tile already in the geopackage is replaced
+            part = self.__make_parts(folder, [[(2, 0, 0, Binary(b'c'))]])
+            gpkg.merge_parts(part)
+            result = gpkg.execute("select tile_data from '{table}' where tile_column = 0;"
+                                  .format(table=DEFAULT_TILES_TABLE_NAME))
+            assert [bytes(row[0]) for row in result.fetchall()] == [b'c']
+
+    def test_merge_parts_many(self, make_session_folder):
+        folder = join(gettempdir(), make_session_folder)
+        # one part per tile
+        parts = self.__make_parts(folder, [[(4, x, 0, Binary(b'tile'))] for x in xrange(12)])
+        with Geopackage(join(folder, "test.gpkg"), 3857, DEFAULT_TILES_TABLE_NAME) as gpkg:
+            gpkg.initialize()
+            assert gpkg.merge_parts(parts, tile_order="hilbert") == 12
+            result = gpkg.execute("select count(*) from '{table}';".format(table=DEFAULT_TILES_TABLE_NAME))
+            assert result.fetchone()[0] == 12
+            # the connection is still usable and left in its usual mode
+            gpkg.insert_tiles([(5, 0, 0, Binary(b'tile'))])
+            result = gpkg.execute("select count(*) from '{table}';".format(table=DEFAULT_TILES_TABLE_NAME))
+            assert result.fetchone()[0] == 13
+
+    @pytest.mark.parametrize("tile_order", ["zorder", "hilbert"])
+    def test_order_tiles(self, make_gpkg, tile_order):
+        gpkg = make_gpkg
+        gpkg.initialize()
+        gpkg.insert_tiles((z, x, y, Binary(b'tile')) for z in (2, 1) for x in xrange(2 ** z) for y in xrange(2 ** z))
+        gpkg.order_tiles(tile_order)
+        key = zorder_key if tile_order == "zorder" else hilbert_key
+        result = gpkg.execute("select zoom_level, tile_column, tile_row from tiles order by id;")
+        tiles = [tuple(row) for row in result.fetchall()]
+        assert tiles == sorted(tiles, key=lambda tile: (tile[0], key(tile[1], tile[2])))
+        assert len(tiles) == 20
+        # the table keeps its constraints
+        with raises(IntegrityError):
+            gpkg.insert_tiles([(1, 0, 0, None)])
+
+    def test_order_tiles_unknown(self, make_gpkg):
+        gpkg = make_gpkg
+        gpkg.initialize()
+        with raises(ValueError):
+            gpkg.order_tiles("rows")
+
     def test_matrix_width(self, make_gpkg):
         test_width_stmt = """
             SELECT matrix_width
@@ -602,6 +775,30 @@ class TestTempDB:
         assert result.fetchone()[0] == 1
         shutil.rmtree(temp_db_folder)
 
+    def test_insert_image_blobs(self):
+        img = new("RGB", (256, 256), "red")
+        data = Binary(img_to_buf(img, 'jpeg').read())
+        temp_db_folder, tempDB = self.__make_tempDB()
+        tiles = ((1, x, y, data) for x in xrange(2) for y in xrange(3))
+        assert tempDB.insert_image_blobs(tiles, commit_size=4) == 6
+        result = tempDB.execute("select count(*) from '{table}';".format(table=DEFAULT_TILES_TABLE_NAME))
+        assert result.fetchone()[0] == 6
+        shutil.rmtree(temp_db_folder)
+
+    def test_insert_image_blobs_replaces_duplicates(self):
+        temp_db_folder, tempDB = self.__make_tempDB()
+        tiles = [(0, 0, 0, Binary(b'first')), (0, 0, 0, Binary(b'second'))]
+        assert tempDB.insert_image_blobs(tiles) == 2
+        result = tempDB.execute("select tile_data from '{table}';".format(table=DEFAULT_TILES_TABLE_NAME))
+        assert [bytes(row[0]) for row in result.fetchall()] == [b'second']
+        shutil.rmtree(temp_db_folder)
+
+    def test_insert_image_blobs_invalid_commit_size(self):
+        temp_db_folder, tempDB = self.__make_tempDB()
+        with raises(ValueError):
+            tempDB.insert_image_blobs([], commit_size=0)
+        shutil.rmtree(temp_db_folder)
+
 
 
 class TestImgToBuf:
@@ -660,6 +857,31 @@ class TestImgHasTransparency:
         img = new('P', (256, 256))
         assert img_has_transparency(img) == 0
 
+    def test_paletted_image_transparent_index_unused(self):
+        img = new("P", (256, 256), 1)
+        img.info['transparency'] = 0
+        assert img_has_transparency(img) == 0
+
+    def test_paletted_image_partially_transparent(self):
+        img = new("P", (256, 256), 1)
+        ImageDraw.Draw(img).rectangle([0, 0, 10, 10], fill=0)
+        img.info['transparency'] = b'\x00'
+        assert img_has_transparency(img) == 1
+
+    def test_non_square(self):
+        img = new("RGBA", (512, 128), (255, 0, 0, 255))
+        assert img_has_transparency(img) == 0
+        ImageDraw.Draw(img).rectangle([500, 0, 511, 10], fill=(0, 0, 0, 0))
+        assert img_has_transparency(img) == 1
+        assert img_has_transparency(new("RGBA", (512, 128))) == -1
+
+    def test_semi_transparent(self):
+        img = new("RGBA", (256, 256), (255, 0, 0, 128))
+        assert img_has_transparency(img) == 1
+
+    def test_grayscale_alpha(self):
+        assert img_has_transparency(new("LA", (256, 256), (0, 0))) == -1
+
 
 def test_file_count():
     assert len(file_count(MERCATOR_FILE_PATH)) == 4
@@ -689,6 +911,73 @@ def test_worker_map(make_session_folder):
     assert len(files) == 1 and '.gpkg.part' in files[0]
 
 
+class TestEncodeTileBytes:
+    """Test the raw passthrough of encode_tile_bytes."""
+
+    @staticmethod
+    def encode(file_path, imagery):
+        tile = dict(z=1, x=0, y=0, path=file_path)
+        extra_args = dict(tile_info=build_lut([tile], True, 4326), imagery=imagery, jpeg_quality=75,
+                          nsg_profile=False, renumber=False)
+        with open(file_path, 'rb') as tile_file:
+            return encode_tile_bytes(tile, extra_args, None)[3], tile_file.read()
+
+    def test_sniff_image_type(self):
+        with open(join(TESTING_PATH, "test2.jpg"), 'rb') as jpeg, open(join(TESTING_PATH, "test1.png"), 'rb') as png:
+            assert sniff_image_type(jpeg.read()) == 'jpeg'
+            assert sniff_image_type(png.read()) == 'png'
+        assert sniff_image_type(b'GIF89a') is None
+
+    def test_matching_format_is_not_encoded(self):
+        for imagery in ('source', 'jpeg', 'mixed'):
+            data, source = self.encode(join(TESTING_PATH, "test2.jpg"), imagery)
+            assert data == source
+        for imagery in ('source', 'png'):
+            data, source = self.encode(join(TESTING_PATH, "test1.png"), imagery)
+            assert data == source
+
+    def test_other_format_is_encoded(self):
+        data, source = self.encode(join(TESTING_PATH, "test1.png"), 'jpeg')
+        assert sniff_image_type(data) == 'jpeg'
+        data, source = self.encode(join(TESTING_PATH, "test2.jpg"), 'png')
+        assert sniff_image_type(data) == 'png'
+
+    def test_mixed_opaque_png_is_encoded(self):
+        data, source = self.encode(join(TESTING_PATH, "test1.png"), 'mixed')
+        assert sniff_image_type(data) == 'jpeg'
+
+    def test_mixed_transparent_png_is_not_encoded(self, make_session_folder):
+        file_path = join(gettempdir(), make_session_folder, "0.png")
+        img = new("RGBA", (256, 256), (255, 0, 0, 255))
+        ImageDraw.Draw(img).rectangle([0, 0, 10, 10], fill=(0, 0, 0, 0))
+        img.save(file_path, 'PNG')
+        data, source = self.encode(file_path, 'mixed')
+        assert data == source
+
+    def test_dedup_reuses_encoded_tiles(self, monkeypatch):
+        monkeypatch.setattr(tiles2gpkg_module, "ENCODE_CACHE", None)
+        tile = dict(z=1, x=0, y=0, path=join(TESTING_PATH, "test1.png"))
+        extra_args = dict(tile_info=build_lut([tile], True, 4326), imagery='jpeg', jpeg_quality=75,
+                          nsg_profile=False, renumber=False, dedup=True)
+        first = encode_tile_bytes(tile, extra_args, None)
+        assert encode_tile_bytes(tile, extra_args, None) == first
+        cache = tiles2gpkg_module.ENCODE_CACHE
+        assert (cache.hits, cache.misses) == (1, 1)
+        # tiles stored as they are never reach the cache
+        encode_tile_bytes(dict(tile, path=join(TESTING_PATH, "test2.jpg")), extra_args, None)
+        assert len(cache) == 1
+
+    def test_mixed_fully_transparent_is_skipped(self, make_session_folder):
+        file_path = join(gettempdir(), make_session_folder, "0.png")
+        new("RGBA", (256, 256)).save(file_path, 'PNG')
+        tile = dict(z=1, x=0, y=0, path=file_path)
+        extra_args = dict(tile_info=build_lut([tile], True, 4326), imagery='mixed', jpeg_quality=75,
+                          nsg_profile=False, renumber=False)
+        assert encode_tile_bytes(tile, extra_args, None) is None
+        extra_args['imagery'] = 'png'
+        assert encode_tile_bytes(tile, extra_args, None) is not None
+
+
 class Testsqliteworker:
     """Test the sqlite_worker function."""
 
@@ -702,7 +991,7 @@ class Testsqliteworker:
         sqlite_worker(file_list, extra_args)
         # assert that worker put the .gpkg.part file into base_dir
         files = listdir(session_folder)
-        assert len(files) == 2 and '.gpkg.part' in files[0]
+        assert len(files) == 1 and '.gpkg.part' in files[0]
 
     def test_sqlite_worker_3857(self, make_session_folder):
         session_folder = join(gettempdir(), make_session_folder)
@@ -713,7 +1002,7 @@ class Testsqliteworker:
                           jpeg_quality=75, nsg_profile=False, renumber=False, table_name='t a b l e')
         sqlite_worker(file_list, extra_args)
         files = listdir(session_folder)
-        assert len(files) == 2 and '.gpkg.part' in files[0]
+        assert len(files) == 1 and '.gpkg.part' in files[0]
 
     def test_sqlite_worker_3395(self, make_session_folder):
         session_folder = join(gettempdir(), make_session_folder)
@@ -724,7 +1013,7 @@ class Testsqliteworker:
                           jpeg_quality=75, nsg_profile=False, renumber=False, table_name='n am e')
         sqlite_worker(file_list, extra_args)
         files = listdir(session_folder)
-        assert len(files) == 2 and '.gpkg.part' in files[0]
+        assert len(files) == 1 and '.gpkg.part' in files[0]
 
     def test_sqlite_worker_9804(self, make_session_folder):
         session_folder = join(gettempdir(), make_session_folder)
@@ -735,7 +1024,7 @@ class Testsqliteworker:
                           jpeg_quality=75, nsg_profile=False, renumber=False, table_name='table-name')
         sqlite_worker(file_list, extra_args)
         files = listdir(session_folder)
-        assert len(files) == 2 and '.gpkg.part' in files[0]
+        assert len(files) == 1 and '.gpkg.part' in files[0]
 
 
 class TestAllocate:
@@ -762,6 +1051,139 @@ class TestAllocate:
             assert e is not None and type(e) == TypeError
 
 
+    class RecordingPool:
+        """Runs every task as soon as it is queued, failing the first attempt of chosen chunks."""
+
+        class Result:
+            def __init__(self, value=None, error=None):
+                self.value, self.error = value, error
+
+            def ready(self):
+                return True
+
+            def successful(self):
+                return self.error is None
+
+            def get(self):
+                if self.error is not None:
+                    raise self.error
+                return self.value
+
+        def __init__(self, *args, **kwargs):
+            self.tasks = []
+            self.fail = set(kwargs.pop('fail', ()))
+            self.run = kwargs.pop('run', True)
+
+        def apply_async(self, worker, args):
+            self.tasks.append(tuple(args[:2]))
+            if args[0] in self.fail:
+                self.fail.discard(args[0])
+                return self.Result(error=IOError("chunk failed"))
+            return self.Result(worker(*args) if self.run else None)
+
+        def close(self):
+            pass
+
+        def join(self):
+            pass
+
+        def terminate(self):
+            pass
+
+    def test_allocate_chunks(self):
+        pool = self.RecordingPool(run=False)
+        file_list = list(range(10))
+        chunks = allocate(2, pool, file_list, dict(chunk_size=4))
+        assert pool.tasks == [(0, 4), (4, 8), (8, 10)]
+        assert [chunk[:3] for chunk in chunks] == [[0, 4, 1], [4, 8, 1], [8, 10, 1]]
+
+    def test_allocate_spatial_chunks(self):
+        pool = self.RecordingPool(run=False)
+        file_list = TileIndex()
+        for z, x, y in [(1, 0, 0), (1, 0, 1), (1, 1, 0), (1, 1, 1), (2, 0, 0), (2, 0, 1), (2, 0, 2)]:
+            file_list.append(z, x, y, "base", "{0}.png".format(y))
+        allocate(2, pool, file_list, dict(chunk_size=3))
+        # no column is shared by two chunks
+        assert pool.tasks == [(0, 2), (2, 4), (4, 7)]
+
+    def test_get_chunk_size(self):
+        assert get_chunk_size(4, 10) == 1
+        assert get_chunk_size(2, 100) == 13
+        assert get_chunk_size(8, 10 ** 7) == 4096
+        assert get_chunk_size(8, 10 ** 7, 50) == 50
+
+    def test_write_worker_dbs_chunks(self, make_session_folder, monkeypatch):
+        session_folder = join(gettempdir(), make_session_folder)
+        file_list = make_geodetic_filelist()
+        extra_args = dict(root_dir=session_folder, tile_info=build_lut(file_list, True, 4326), lower_left=True,
+                          srs=4326, imagery='mixed', jpeg_quality=75, nsg_profile=False, renumber=False,
+                          table_name='tiles', chunk_size=2)
+        pools = []
+        monkeypatch.setattr(tiles2gpkg_module, "Pool", lambda *args, **kwargs: pools.append(
+            self.RecordingPool(fail=[2])) or pools[-1])
+        write_worker_dbs(file_list, extra_args, True)
+        # the failed chunk is queued again and only its successful attempt leaves a part behind
+        assert pools[0].tasks == [(0, 2), (2, 4), (4, 5), (2, 4)]
+        assert len([name for name in listdir(session_folder) if name.endswith('.gpkg.part')]) == 3
+
+    def test_write_worker_dbs_worker_options(self, make_session_folder, monkeypatch):
+        session_folder = join(gettempdir(), make_session_folder)
+        file_list = make_geodetic_filelist()
+        extra_args = dict(root_dir=session_folder, tile_info=build_lut(file_list, True, 4326), lower_left=True,
+                          srs=4326, imagery='mixed', jpeg_quality=75, nsg_profile=False, renumber=False,
+                          table_name='tiles', chunk_size=2, workers=3, max_tiles_per_worker=5, max_memory=30)
+        calls = []
+        monkeypatch.setattr(tiles2gpkg_module, "Pool", lambda *args, **kwargs: calls.append(
+            (args, kwargs)) or self.RecordingPool())
+        write_worker_dbs(file_list, extra_args, True)
+        args, kwargs = calls[0]
+        assert args[0] == 3
+        # recycled after 5 tiles, two chunks of 2 tiles
+        assert kwargs['maxtasksperchild'] == 2
+        assert 'commit_bytes' not in extra_args
+
+    def test_write_worker_dbs_threads(self, make_session_folder):
+        session_folder = join(gettempdir(), make_session_folder)
+        file_list = make_geodetic_filelist()
+        extra_args = dict(root_dir=session_folder, tile_info=build_lut(file_list, True, 4326), lower_left=True,
+                          srs=4326, imagery='source', jpeg_quality=75, nsg_profile=False, renumber=False,
+                          table_name='tiles', chunk_size=2, read_ahead=2)
+        assert get_backend(extra_args) == 'thread'
+        telemetry = Telemetry(stream=None)
+        write_worker_dbs(file_list, extra_args, True, telemetry)
+        assert telemetry.tiles == len(file_list)
+        # every tile counted by the workers was merged
+        assert telemetry.pending == 0 and telemetry.done == len(file_list)
+        assert len([name for name in listdir(session_folder) if name.endswith('.gpkg.part')]) == 3
+
+    def test_get_backend(self):
+        assert get_backend(dict(imagery='source', read_ahead=8)) == 'thread'
+        assert get_backend(dict(imagery='source', read_ahead=0)) == 'process'
+        assert get_backend(dict(imagery='mixed', read_ahead=8)) == 'process'
+        assert get_backend(dict(imagery='mixed', backend='thread')) == 'thread'
+        assert get_worker_count('thread', 3) == 3
+        assert get_worker_count('thread') >= get_worker_count('process')
+
+    def test_write_worker_dbs_gives_up(self, make_session_folder, monkeypatch):
+        session_folder = join(gettempdir(), make_session_folder)
+        file_list = make_geodetic_filelist()
+        extra_args = dict(root_dir=session_folder, tile_info=build_lut(file_list, True, 4326), lower_left=True,
+                          srs=4326, imagery='mixed', jpeg_quality=75, nsg_profile=False, renumber=False,
+                          table_name='tiles', chunk_size=2, chunk_attempts=1)
+        monkeypatch.setattr(tiles2gpkg_module, "Pool", lambda *args, **kwargs: self.RecordingPool(fail=[0]))
+        with raises(IOError):
+            write_worker_dbs(file_list, extra_args, True)
+
+    def test_sqlite_chunk_worker_removes_failed_part(self, make_session_folder):
+        session_folder = join(gettempdir(), make_session_folder)
+        extra_args = dict(root_dir=session_folder, tile_info=build_lut(make_geodetic_filelist(), True, 4326),
+                          lower_left=True, srs=4326, imagery='mixed', jpeg_quality=75, nsg_profile=False,
+                          renumber=False, table_name='tiles')
+        with raises(IOError):
+            sqlite_chunk_worker(0, 1, extra_args, [dict(z=1, x=0, y=0, path=join(session_folder, "missing.png"))])
+        assert listdir(session_folder) == []
+
+
 class TestBuildLut:
     """Test the build_lut function."""
 
@@ -845,6 +1267,69 @@ class TestBuildLutNSG:
         assert result[1].matrix_height == 4
 
 
+class TestBuildLutEquivalence:
+    """build_lut output on a sparse pyramid, recorded before the single pass rewrite."""
+
+    ATTRIBUTES = ('zoom', 'min_tile_row', 'max_tile_row', 'min_tile_col', 'max_tile_col', 'matrix_width',
+                  'matrix_height', 'min_x', 'min_y', 'max_x', 'max_y')
+
+    @staticmethod
+    def make_sparse_filelist(tile_index):
+        tiles = [(3, x, y) for x in range(2, 6) for y in range(1, 4)]
+        tiles += [(4, 5, 3), (4, 9, 6), (4, 7, 2)]
+        tiles += [(6, x, y) for x in range(40, 51, 3) for y in range(20, 34, 4)]
+        tiles += [(0, 0, 0)]
+        if tile_index:
+            file_list = TileIndex()
+            for z, x, y in tiles:
+                file_list.append(z, x, y, join("tiles", str(z), str(x)), "{0}.png".format(y))
+            return file_list
+        return [dict(z=z, x=x, y=y, path="p") for z, x, y in tiles]
+
+    def check(self, result, expected):
+        assert [tuple(getattr(level, name) for name in self.ATTRIBUTES) for level in result] == \
+            [pytest.approx(level) for level in expected]
+
+    @pytest.fixture(params=["list", "tile_index", "tile_index_numpy"])
+    def sparse_filelist(self, request, monkeypatch):
+        if request.param == "tile_index_numpy":
+            pytest.importorskip("numpy")
+        elif request.param == "tile_index":
+            monkeypatch.setattr(tile_index_module, "numpy", None)
+        return self.make_sparse_filelist(request.param != "list")
+
+    def test_build_lut_lower_left(self, sparse_filelist):
+        self.check(build_lut(sparse_filelist, True, 4326),
+                   [(0, 0, 0, 0, 0, 1, 1, -180.0, -90.0, 180.0, 270.0),
+                    (3, 2, 5, 1, 3, 4, 3, -90.0, -45.0, 90.0, 90.0),
+                    (4, 4, 11, 2, 7, 8, 6, -90.0, -45.0, 90.0, 90.0),
+                    (6, 40, 49, 20, 32, 10, 13, 45.0, 22.5, 101.25, 95.625)])
+
+    def test_build_lut_upper_left(self, sparse_filelist):
+        self.check(build_lut(sparse_filelist, False, 3857),
+                   [(0, 0, 0, 0, 0, 1, 1, -20037508.342789244, -20037508.342789255, 20037508.342789244,
+                     20037508.342789277),
+                    (3, 2, 5, 1, 3, 4, 3, -10018754.171394622, -7.081154551613622e-10, 10018754.171394622,
+                     15028131.257091932),
+                    (4, 4, 11, 2, 7, 8, 6, -10018754.171394622, -7.081154551613622e-10, 10018754.171394622,
+                     15028131.257091932),
+                    (6, 40, 49, 20, 32, 10, 13, 5009377.085697311, -626172.1357121639, 11271098.44281895,
+                     7514065.628545966)])
+
+    def test_build_lut_nsg(self, sparse_filelist):
+        self.check(build_lut_nsg(sparse_filelist, True, 4326, False),
+                   [(0, 0, 2, 0, 1, 2, 1, -180.0, -90.0, 0.0, 90.0),
+                    (3, 0, 16, 0, 8, 16, 8, -135.0, -67.5, -45.0, 0.0),
+                    (4, 0, 32, 0, 16, 32, 16, -123.75, -67.5, -67.5, -11.25),
+                    (6, 0, 128, 0, 64, 128, 64, -67.5, -33.75, -39.375, 2.8125)])
+
+    def test_build_lut_nsg_renumber(self, sparse_filelist):
+        self.check(build_lut_nsg(sparse_filelist, False, 4326, True),
+                   [(2, 0, 8, 0, 4, 8, 4, -90.0, -90.0, 90.0, 45.0),
+                    (3, 0, 16, 0, 8, 16, 8, -67.5, -67.5, 45.0, 45.0),
+                    (5, 0, 64, 0, 32, 64, 32, 45.0, -95.625, 101.25, -22.5)])
+
+
 def test_combine_worker_dbs(make_session_folder):
     session_folder = make_session_folder
     # make a random number of tempdbs with dummy data
@@ -865,6 +1350,75 @@ def test_combine_worker_dbs(make_session_folder):
     remove(gpkg.file_path)
 
 
+def killed_stream_worker(task_queue, tile_queue, extra_args, file_list, budget=None):
+    """A stream worker that dies without putting anything on the tile queue, as if it was killed."""
+    os._exit(9)
+
+
+class TestStreamTiles:
+    """Test the streaming packaging engine."""
+
+    def __extra_args(self, file_list):
+        return dict(tile_info=build_lut(file_list, True, 4326), lower_left=True, srs=4326, imagery='png',
+                    jpeg_quality=75, nsg_profile=False, renumber=False, queue_size=2, commit_size=2)
+
+    def test_stream_tiles_in_process(self, make_gpkg):
+        gpkg = make_gpkg
+        gpkg.initialize()
+        file_list = make_geodetic_filelist()
+        assert stream_tiles(gpkg, file_list, self.__extra_args(file_list), 0) == len(file_list)
+        result = gpkg.execute("select count(*) from tiles;")
+        assert result.fetchone()[0] == len(file_list)
+
+    def test_stream_tiles_workers(self, make_gpkg):
+        gpkg = make_gpkg
+        gpkg.initialize()
+        file_list = make_geodetic_filelist()
+        assert stream_tiles(gpkg, file_list, self.__extra_args(file_list), 2) == len(file_list)
+        result = gpkg.execute("select zoom_level, tile_column, tile_row from tiles "
+                              "order by zoom_level, tile_column, tile_row;")
+        assert [tuple(row) for row in result.fetchall()] == [(1, 0, 0), (2, 0, 0), (2, 0, 1), (2, 1, 0), (2, 1, 1)]
+        assert not [name for name in listdir(dirname(gpkg.file_path)) if name.endswith('.gpkg.part')]
+
+    def test_stream_tiles_max_memory(self, make_gpkg):
+        gpkg = make_gpkg
+        gpkg.initialize()
+        file_list = make_geodetic_filelist()
+        extra_args = self.__extra_args(file_list)
+        # smaller than any tile, the workers hand them over one at a time
+        extra_args['max_memory'] = 1
+        extra_args.update(read_ahead=2, io_threads=1)
+        assert stream_tiles(gpkg, file_list, extra_args, 2) == len(file_list)
+        result = gpkg.execute("select count(*) from tiles;")
+        assert result.fetchone()[0] == len(file_list)
+
+    def test_stream_tiles_killed_worker(self, make_gpkg, monkeypatch):
+        gpkg = make_gpkg
+        gpkg.initialize()
+        file_list = make_geodetic_filelist()
+        monkeypatch.setattr(tiles2gpkg_module, 'stream_worker', killed_stream_worker)
+        # the writer stops waiting for tiles that never come
+        with raises(RuntimeError):
+            stream_tiles(gpkg, file_list, self.__extra_args(file_list), 2)
+
+    def test_stream_tiles_skips_transparent(self, make_gpkg, make_session_folder):
+        gpkg = make_gpkg
+        gpkg.initialize()
+        folder = join(gettempdir(), make_session_folder)
+        new("RGBA", (256, 256)).save(join(folder, "0.png"), 'PNG')
+        new("RGBA", (256, 256), (255, 0, 0, 255)).save(join(folder, "1.png"), 'PNG')
+        file_list = [dict(z=1, x=0, y=0, path=join(folder, "0.png")), dict(z=1, x=0, y=1, path=join(folder, "1.png"))]
+        extra_args = self.__extra_args(file_list)
+        extra_args['imagery'] = 'mixed'
+        for cores in (0, 2):
+            telemetry = Telemetry(stream=None)
+            assert stream_tiles(gpkg, file_list, extra_args, cores, telemetry) == 1
+            assert telemetry.skipped == 1
+        result = gpkg.execute("select tile_data from tiles;")
+        # only the opaque tile is stored, as a jpeg
+        assert [sniff_image_type(bytes(row[0])) for row in result.fetchall()] == ['jpeg']
+
+
 # todo: test main
 def test_main():
     table_name = "my_table"
@@ -889,6 +1443,243 @@ def test_main():
     os.remove(output_file)
 
 
+def test_main_telemetry():
+    output_file = join(gettempdir(), uuid4().hex + ".gpkg")
+    summary_file = output_file + ".json"
+    main(get_parser().parse_args([GEODETIC_FILE_PATH, output_file, "-srs", "4326", "-engine", "stream", "-T",
+                                  "-telemetry", summary_file]))
+    try:
+        with open(summary_file) as summary:
+            summary = json.load(summary)
+    finally:
+        os.remove(output_file)
+        os.remove(summary_file)
+    assert summary['tiles'] == len(make_geodetic_filelist())
+    assert set(summary['phases']) == {'discovery', 'lut', 'encode', 'insert'}
+    assert summary['info']['engine'] == 'stream'
+    assert summary['encode_tiles_per_second'] > 0 and summary['merge_tiles_per_second'] is None
+
+
+@pytest.mark.parametrize("engine", ["parts", "stream"])
+def test_main_incremental(engine):
+    folder = mkdtemp()
+    source = join(folder, "tiles")
+    shutil.copytree(GEODETIC_FILE_PATH, source)
+    output_file = join(folder, "out.gpkg")
+    summary_file = join(folder, "summary.json")
+    arg_list = get_parser().parse_args([source, output_file, "-srs", "4326", "-engine", engine, "-T", "-incremental",
+                                        "-telemetry", summary_file])
+
+    def run():
+        main(arg_list)
+        with open(summary_file) as summary:
+            info = json.load(summary)['info']
+        with get_database_connection(output_file) as db_conn:
+            tiles = dict(((z, x, y), bytes(data)) for z, x, y, data in
+                         db_conn.execute("select zoom_level, tile_column, tile_row, tile_data from tiles;"))
+            sources = db_conn.execute("select count(*) from tiles2gpkg_sources;").fetchone()[0]
+        return info, tiles, sources
+
+    try:
+        info, tiles, sources = run()
+        assert (info['changed'], info['removed'], len(tiles), sources) == (5, 0, 5, 5)
+        # one tile changed, one is gone
+        changed = join(source, "2", "1", "1.png")
+        buf = img_to_buf(new("RGB", (256, 256), (0, 0, 255)), 'png')
+        with open(changed, 'wb') as tile_file:
+            tile_file.write(buf.read())
+        utime(changed, (1, 1))
+        remove(join(source, "2", "0", "0.png"))
+        info, new_tiles, sources = run()
+        assert (info['changed'], info['removed'], len(new_tiles), sources) == (1, 1, 4, 4)
+        with open(changed, 'rb') as tile_file:
+            assert tile_file.read() in new_tiles.values()
+        assert len(set(new_tiles.values()) - set(tiles.values())) == 1
+        info, tiles, sources = run()
+        assert (info['changed'], info['removed'], tiles, sources) == (0, 0, new_tiles, 4)
+    finally:
+        shutil.rmtree(folder)
+
+
+@pytest.mark.parametrize("engine", ["parts", "stream"])
+def test_main_incremental_profile(engine, monkeypatch):
+    folder = mkdtemp()
+    output_file = join(folder, "out.gpkg")
+    journal_modes = []
+
+    class RecordingGeopackage(Geopackage):
+        def __init__(self, file_path, srs, tiles_table_name, write_profile=None):
+            journal_modes.append((exists(file_path), write_profile.journal_mode))
+            super(RecordingGeopackage, self).__init__(file_path, srs, tiles_table_name, write_profile)
+
+    monkeypatch.setattr(tiles2gpkg_module, 'Geopackage', RecordingGeopackage)
+    try:
+        arg_list = get_parser().parse_args([GEODETIC_FILE_PATH, output_file, "-srs", "4326", "-engine", engine, "-T",
+                                            "-incremental"])
+        main(arg_list)
+        main(arg_list)
+        # the bulk load profile only creates the file, the runs updating it keep a rollback journal
+        assert journal_modes == [(False, 'OFF'), (True, 'DELETE'), (True, 'DELETE')]
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_cli_incremental():
+    folder = mkdtemp()
+    source = join(folder, "tiles")
+    shutil.copytree(GEODETIC_FILE_PATH, source)
+    output_file = join(folder, "out.gpkg")
+    repository = dirname(dirname(abspath(__file__)))
+
+    def run(*options):
+        process = Popen([executable, "-m", "scripts.packaging.tiles2gpkg_parallel", source, output_file, "-srs", "4326",
+                         "-T"] + list(options), cwd=repository, stdout=PIPE, stderr=PIPE)
+        out, err = process.communicate()
+        return process.returncode, out.decode() + err.decode()
+
+    try:
+        assert run("-incremental")[0] == 0
+        # without -incremental an existing destination is refused
+        returncode, output = run()
+        assert returncode == 1
+        assert "-incremental" in output
+        remove(join(source, "2", "0", "0.png"))
+        assert run("-incremental")[0] == 0
+        with get_database_connection(output_file) as db_conn:
+            assert db_conn.execute("select count(*) from tiles;").fetchone()[0] == 4
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_positive_arguments():
+    assert positive_int("3") == 3
+    assert positive_float("0.5") == 0.5
+    for value in ("0", "-2"):
+        with raises(argparse.ArgumentTypeError):
+            positive_int(value)
+        with raises(argparse.ArgumentTypeError):
+            positive_float(value)
+    repository = dirname(dirname(abspath(__file__)))
+    for option, value in (("-max_memory", "0"), ("-io_threads", "0"), ("-chunk_size", "-1")):
+        process = Popen([executable, "-m", "scripts.packaging.tiles2gpkg_parallel", GEODETIC_FILE_PATH,
+                         join(gettempdir(), uuid4().hex + ".gpkg"), option, value], cwd=repository, stdout=PIPE,
+                        stderr=PIPE)
+        _, err = process.communicate()
+        # refused by argparse
+        assert process.returncode == 2
+        assert option.encode() in err
+
+
+def test_cli_deferred_index_parts():
+    output_file = join(gettempdir(), uuid4().hex + ".gpkg")
+    process = Popen([executable, "-m", "scripts.packaging.tiles2gpkg_parallel", GEODETIC_FILE_PATH, output_file,
+                     "-srs", "4326", "-engine", "parts", "-deferred_index"],
+                    cwd=dirname(dirname(abspath(__file__))), stdout=PIPE, stderr=PIPE)
+    out, _ = process.communicate()
+    assert process.returncode == 1
+    assert b"-deferred_index" in out
+    assert not exists(output_file)
+
+
+def test_main_resume(monkeypatch):
+    folder = mkdtemp()
+    source = join(folder, "tiles")
+    shutil.copytree(GEODETIC_FILE_PATH, source)
+    output_file = join(folder, "out.gpkg")
+    summary_file = join(folder, "summary.json")
+    arg_list = get_parser().parse_args([source, output_file, "-srs", "4326", "-imagery", "png", "-T", "-telemetry",
+                                        summary_file])
+    # a part left by another run
+    with TempDB(folder, "tiles") as temp_db:
+        temp_db.insert_image_blob(9, 0, 0, Binary(b'stale'))
+    chunk_worker = tiles2gpkg_module.sqlite_chunk_worker
+
+    def interrupted(start, stop, *args):
+        if stop == 5:
+            raise IOError("interrupted")
+        return chunk_worker(start, stop, *args)
+
+    try:
+        # the last chunk fails
+        monkeypatch.setattr(tiles2gpkg_module, 'sqlite_chunk_worker', interrupted)
+        with raises(IOError):
+            main(arg_list)
+        assert not exists(output_file)
+        assert exists(output_file + ".journal")
+        monkeypatch.undo()
+        main(arg_list)
+        with open(summary_file) as summary:
+            # only the chunk that failed is encoded again
+            assert json.load(summary)['tiles'] == 2
+        with get_database_connection(output_file) as db_conn:
+            tiles = db_conn.execute("select zoom_level, tile_column, tile_row from tiles;").fetchall()
+        assert sorted(tuple(tile) for tile in tiles) == [(1, 0, 0), (2, 0, 0), (2, 0, 1), (2, 1, 0), (2, 1, 1)]
+        assert not exists(output_file + ".journal")
+        assert [name for name in listdir(folder) if name.endswith(".gpkg.part")] == [temp_db.name]
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_main_resume_changed_source(monkeypatch):
+    folder = mkdtemp()
+    source = join(folder, "tiles")
+    shutil.copytree(GEODETIC_FILE_PATH, source)
+    output_file = join(folder, "out.gpkg")
+    summary_file = join(folder, "summary.json")
+    arg_list = get_parser().parse_args([source, output_file, "-srs", "4326", "-imagery", "png", "-T", "-telemetry",
+                                        summary_file])
+    chunk_worker = tiles2gpkg_module.sqlite_chunk_worker
+
+    def interrupted(start, stop, *args):
+        if stop == 5:
+            raise IOError("interrupted")
+        return chunk_worker(start, stop, *args)
+
+    try:
+        monkeypatch.setattr(tiles2gpkg_module, 'sqlite_chunk_worker', interrupted)
+        with raises(IOError):
+            main(arg_list)
+        monkeypatch.undo()
+        # the parts encoded from the old file cannot be used
+        utime(join(source, "1", "0", "0.png"), (1, 1))
+        main(arg_list)
+        with open(summary_file) as summary:
+            assert json.load(summary)['tiles'] == 5
+        assert [name for name in listdir(folder) if name.endswith(".gpkg.part")] == []
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_cli_resume_merge(monkeypatch):
+    folder = mkdtemp()
+    source = join(folder, "tiles")
+    shutil.copytree(GEODETIC_FILE_PATH, source)
+    output_file = join(folder, "out.gpkg")
+    repository = dirname(dirname(abspath(__file__)))
+
+    def interrupted(gpkg, tile_order=None, journal=None):
+        gpkg.merge_parts(journal.part_paths(folder)[:1])
+        raise IOError("interrupted")
+
+    try:
+        # stopped once the first part is merged
+        monkeypatch.setattr(tiles2gpkg_module, 'combine_worker_dbs', interrupted)
+        with raises(IOError):
+            main(get_parser().parse_args([source, output_file, "-srs", "4326", "-T"]))
+        assert exists(output_file)
+        assert exists(output_file + ".journal")
+        process = Popen([executable, "-m", "scripts.packaging.tiles2gpkg_parallel", source, output_file, "-srs", "4326",
+                         "-T"], cwd=repository, stdout=PIPE, stderr=PIPE)
+        out, _ = process.communicate()
+        assert process.returncode == 0
+        assert b"Resuming the previous run" in out
+        with get_database_connection(output_file) as db_conn:
+            assert db_conn.execute("select count(*) from tiles;").fetchone()[0] == 5
+        assert not exists(output_file + ".journal")
+    finally:
+        shutil.rmtree(folder)
+
+
 @pytest.fixture(scope="function")
 def make_gpkg(tiles_table_name='tiles'):
     filename = uuid4().hex + '.gpkg'
@@ -0,0 +1,32 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Description: pytest configuration of the repository.  The asyncio modules
+ use async def, which does not compile before Python 3.5, so they are not
+ collected, e.g. by --doctest-modules, on older versions.
+
+Version:
+"""
+from sys import version_info
+
+collect_ignore = []
+if version_info < (3, 5):
+    collect_ignore.extend(["Benchmarks/bench_tile_server.py",
+                           "scripts/geopackage/tiles/async_tile_reader.py",
+                           "Testing/geopackage/tiles/test_async_tile_reader.py"])
@@ -57,9 +57,16 @@ from collections import namedtuple
 from sys import exit, stdout, argv as sys_argv
 from os import path, unlink, makedirs
 from math import pi, tan, log, exp, atan, ceil, log10, floor
-from multiprocessing import cpu_count, Pool, Process, Queue
+from multiprocessing import cpu_count, Pool, Process, Value
 from optparse import OptionParser, OptionGroup
 from re import sub
+from time import sleep
+
+try:
+    from scripts.common.telemetry import Telemetry
+except ImportError:
+    # Running as a standalone script, outside of the repository
+    Telemetry = None
 
 try:
     from osgeo import gdal, osr
@@ -83,7 +90,9 @@ resampling_list = ('near', 'average', 'bilinear', 'cubic', 'cubicspline', \
         'lanczos', 'antialias')
 profile_list = ('mercator', 'geodetic', 'geodetic_nsg', 'raster')  #,'zoomify')
 webviewer_list = ('all', 'google', 'openlayers', 'none')
-queue = Queue()
+# Tile and byte counters shared with the worker processes, see init_worker()
+tile_counter = None
+byte_counter = None
 
 # =============================================================================
 # =============================================================================
@@ -1087,6 +1096,10 @@ class GDAL2Tiles(object):
                      action="store_true",
                      dest="verbose",
                      help="Print status messages to stdout")
+        p.add_option("--telemetry",
+                     dest="telemetry",
+                     metavar="FILE",
+                     help="Write a JSON summary of the run (tile counts, throughput and phase timings) to FILE")
 
         # KML options
         g = OptionGroup(
@@ -1736,9 +1749,7 @@ class GDAL2Tiles(object):
                 if self.options.resume and path.exists(tilefilename):
                     if self.options.verbose:
                         print("Tile generation skiped because of --resume")
-                    else:
-                        #queue.put(tcount)
-                        pass
+                    count_tile(tilefilename)
                     continue
 
                 # Create directories for the tile
@@ -1893,9 +1904,7 @@ class GDAL2Tiles(object):
                 #       f.write( self.generate_kml( tx, ty, tz ))
                 #       f.close()
 
-                if not self.options.verbose:
-                    #queue.put(tcount)
-                    pass
+                count_tile(tilefilename)
 
         # -------------------------------------------------------------------------
     def generate_overview_tiles(self, cpu, tz):
@@ -1938,9 +1947,7 @@ class GDAL2Tiles(object):
                         unlink(sidecar)
                     if self.options.verbose:
                         print("Tile generation skiped because of --resume")
-                    else:
-                        #queue.put(tcount)
-                        pass
+                    count_tile(tilefilename)
                     continue
 
                 # Create directories for the tile
@@ -2017,9 +2024,7 @@ class GDAL2Tiles(object):
                 if(path.exists(sidecar)):
                     unlink(sidecar)
 
-                if not self.options.verbose:
-                    #queue.put(tcount)
-                    pass
+                count_tile(tilefilename)
 
         # -------------------------------------------------------------------------
     def geo_query(self, ds, ulx, uly, lrx, lry, querysize=0):
@@ -2880,6 +2885,23 @@ class GDAL2Tiles(object):
 # =============================================================================
 
 
+def init_worker(tiles, byte_count):
+    """Pool initializer handing the shared progress counters to a worker."""
+    global tile_counter, byte_counter
+    tile_counter, byte_counter = tiles, byte_count
+
+
+def count_tile(tilefilename):
+    """Adds a finished tile and its size to the shared progress counters."""
+    if tile_counter is None:
+        return
+    size = path.getsize(tilefilename) if path.exists(tilefilename) else 0
+    with tile_counter.get_lock():
+        tile_counter.value += 1
+    with byte_counter.get_lock():
+        byte_counter.value += size
+
+
 def worker_metadata(argv):
     stdout.flush()
     print("\tStart of metadata worker.")
@@ -2916,57 +2938,78 @@ def getZooms(gdal2tiles):
     return gdal2tiles.tminz, gdal2tiles.tmaxz
 
 
+def count_zoom_tiles(gdal2tiles, tz):
+    """Number of tiles generated for zoom level tz, open_input() must have been called."""
+    tminx, tminy, tmaxx, tmaxy = gdal2tiles.tminmax[tz]
+    return (1 + abs(tmaxx - tminx)) * (1 + abs(tmaxy - tminy))
+
+
+def wait_for_workers(pool, results, telemetry, tiles, byte_count):
+    """
+    Closes the pool and waits for its workers, drawing the progress from the
+    shared counters.  The counters are only read here, unlike the queue that
+    used to deadlock the pool.join() call.
+    """
+    pool.close()
+    while telemetry is not None and not all(result.ready() for result in results):
+        telemetry.tiles, telemetry.bytes = tiles.value, int(byte_count.value)
+        telemetry.report()
+        sleep(.25)
+    pool.join()
+    for result in results:
+        # re-raises the exception of a failed worker
+        result.get()
+    if telemetry is not None:
+        telemetry.tiles, telemetry.bytes = tiles.value, int(byte_count.value)
+        telemetry.finish("")
+
+
 def main(argv=None):
     argv = gdal.GeneralCmdLineProcessor(sys_argv)
     if argv:
         gdal2tiles = GDAL2Tiles(argv[1:])  # handle command line options
+        telemetry = Telemetry(stream=None if gdal2tiles.options.verbose else stdout) \
+            if Telemetry is not None else None
+        tiles = Value('i', 0)
+        byte_count = Value('d', 0)
 
         print("Begin metadata generation complete.")
         p = Process(target=worker_metadata, args=[argv])
         p.start()
         p.join()
         print("Metadata generation complete.")
+        tminz, tmaxz = getZooms(gdal2tiles)
+        if telemetry is not None:
+            telemetry.add_time('metadata', telemetry.elapsed)
+            telemetry.start(sum(count_zoom_tiles(gdal2tiles, tz) for tz in range(tminz, tmaxz + 1)))
+            telemetry.info.update(processes=gdal2tiles.options.processes, tminz=tminz, tmaxz=tmaxz)
 
-        pool = Pool()
-        #processed_tiles = 0
+        pool = Pool(initializer=init_worker, initargs=(tiles, byte_count))
         print("Generating Base Tiles:")
-        for cpu in range(gdal2tiles.options.processes):
-            pool.apply_async(worker_base_tiles,
-                             [argv, cpu],
-                             callback=worker_callback)
-        pool.close()
-        # This progress code does not work. The queue deadlocks the pool.join() call.
-        #while len(active_children()) != 0:
-        #   try:
-        #       total = queue.get(timeout=1)
-        #       processed_tiles += 1
-        #       gdal.TermProgress_nocb(processed_tiles / float(total))
-        #       stdout.flush()
-        #   except:
-        #       pass
-        pool.join()
+        start = telemetry.elapsed if telemetry is not None else 0
+        results = [pool.apply_async(worker_base_tiles,
+                                    [argv, cpu],
+                                    callback=worker_callback)
+                   for cpu in range(gdal2tiles.options.processes)]
+        wait_for_workers(pool, results, telemetry, tiles, byte_count)
+        if telemetry is not None:
+            telemetry.add_time('base', telemetry.elapsed - start)
         print("Base tile generation complete.")
 
-        #processed_tiles = 0
-        tminz, tmaxz = getZooms(gdal2tiles)
         print("Generating Overview Tiles:")
+        start = telemetry.elapsed if telemetry is not None else 0
         for tz in range(tmaxz - 1, tminz - 1, -1):
             print("\tGenerating for zoom level: " + str(tz))
-            pool = Pool()
-            for cpu in range(gdal2tiles.options.processes):
-                pool.apply_async(worker_overview_tiles, [argv, cpu, tz])
-            pool.close()
-            #while len(active_children()) != 0:
-            #   try:
-            #       total = queue.get(timeout=1)
-            #       processed_tiles += 1
-            #       gdal.TermProgress_nocb(processed_tiles / float(total))
-            #       stdout.flush()
-            #   except:
-            #       pass
-            pool.join()
+            pool = Pool(initializer=init_worker, initargs=(tiles, byte_count))
+            results = [pool.apply_async(worker_overview_tiles, [argv, cpu, tz])
+                       for cpu in range(gdal2tiles.options.processes)]
+            wait_for_workers(pool, results, telemetry, tiles, byte_count)
             print("\tZoom level " + str(tz) + " complete.")
+        if telemetry is not None:
+            telemetry.add_time('overview', telemetry.elapsed - start)
         print("Overview tile generation complete")
+        if telemetry is not None and gdal2tiles.options.telemetry:
+            telemetry.write_summary(gdal2tiles.options.telemetry)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,358 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: json, multiprocessing
+Description: Progress and throughput telemetry shared by the tiling and
+ packaging tools.  Tracks tiles and bytes processed, draws a progress bar
+ with tiles/sec, bytes/sec and an ETA, times the phases of a run and writes
+ a JSON summary at the end.
+
+Version:
+"""
+
+from contextlib import contextmanager
+from ctypes import c_longlong
+from datetime import timedelta
+from json import dump
+from multiprocessing import Value
+from sys import stdout
+from time import time
+
+# Width of the progress bar in characters
+PROGRESS_WIDTH = 40
+# Minimum number of seconds between two progress bar redraws
+DEFAULT_REPORT_INTERVAL = 0.25
+# Tiles a worker processes between two updates of a SharedProgress
+DEFAULT_PROGRESS_BATCH = 100
+
+SPINNER = ["|", "/", "-", "\\"]
+
+
+def new_stats():
+    """
+    Returns an empty statistics dictionary, the form in which worker
+    processes send their counters and timings back to a Telemetry object.
+    """
+    return dict(tiles=0, skipped=0, bytes=0, encode=0.0, insert=0.0)
+
+
+def timed_tiles(tiles, stats):
+    """
+    Wraps an iterable of (z, x, y, data) tiles, counting the tiles and bytes
+    it yields into stats and adding the time spent producing them to
+    stats['encode'].
+
+    Inputs:
+    tiles -- an iterable of (z, x, y, data) tuples, usually a generator
+             that encodes them
+    stats -- a dictionary made with new_stats()
+    """
+    tiles = iter(tiles)
+    while True:
+        start = time()
+        try:
+            tile = next(tiles)
+        except StopIteration:
+            stats['encode'] += time() - start
+            return
+        stats['encode'] += time() - start
+        stats['tiles'] += 1
+        stats['bytes'] += len(tile[3])
+        yield tile
+
+
+def time_insert(insert, tiles, commit_size, stats=None, progress=None):
+    """
+    Calls insert(tiles, commit_size), e.g. TempDB.insert_image_blobs, and
+    splits the time it takes between producing the tiles and writing them.
+
+    Inputs:
+    insert -- the function writing the tiles
+    tiles -- an iterable of (z, x, y, data) tuples
+    commit_size -- passed on to insert
+    stats -- optional new_stats() dictionary to fill in, e.g. one already
+             counting the skipped tiles
+    progress -- optional SharedProgress the tiles are counted into as they
+                are produced, they are taken back out if insert fails
+
+    Returns:
+    A new_stats() dictionary for the tiles written.
+    """
+    if stats is None:
+        stats = new_stats()
+    start = time()
+    if progress is None:
+        insert(timed_tiles(tiles, stats), commit_size)
+    else:
+        reported = [0]
+        try:
+            insert(progress.track(timed_tiles(tiles, stats), stats, reported), commit_size)
+        except BaseException:
+            # the tiles are processed again if the work is retried
+            progress.add(-reported[0])
+            raise
+    stats['insert'] = time() - start - stats['encode']
+    return stats
+
+
+class SharedProgress(object):
+    """
+    Number of tiles processed by the workers of a run, shared by processes
+    and threads.  Workers add to it every batch tiles, so the progress bar
+    moves while they are in the middle of a chunk rather than only when
+    they send its new_stats() back.
+    """
+
+    def __init__(self, batch=DEFAULT_PROGRESS_BATCH):
+        """
+        Constructor.
+
+        Inputs:
+        batch -- the tiles a worker processes between two updates
+        """
+        self.batch = batch
+        # the 'q' typecode is missing from Python 2
+        self.__done = Value(c_longlong, 0)
+
+    def add(self, tiles):
+        """Adds tiles processed, or takes them back if negative."""
+        with self.__done.get_lock():
+            self.__done.value += tiles
+
+    @property
+    def done(self):
+        """The number of tiles processed, stored or skipped."""
+        return self.__done.value
+
+    def track(self, tiles, stats, reported):
+        """
+        Wraps timed_tiles(tiles, stats), adding the tiles and skipped tiles
+        counted in stats every batch tiles, and the rest once every tile
+        is produced.
+
+        Inputs:
+        tiles -- the timed_tiles() generator
+        stats -- the new_stats() dictionary it counts into
+        reported -- a list holding the number of tiles added so far, kept
+                    up to date
+        """
+        for tile in tiles:
+            yield tile
+            if stats['tiles'] + stats['skipped'] - reported[0] >= self.batch:
+                self.__report(stats, reported)
+        self.__report(stats, reported)
+
+    def __report(self, stats, reported):
+        """Adds the tiles counted in stats since the last update."""
+        done = stats['tiles'] + stats['skipped']
+        self.add(done - reported[0])
+        reported[0] = done
+
+
+class Telemetry(object):
+    """
+    Collects the progress of a tiling or packaging run.  Tile and byte
+    counts drive the progress bar, and phase() times named sections of the
+    run, such as discovery, encode or merge, for the summary.
+    """
+
+    def __init__(self, total=0, stream=stdout, interval=DEFAULT_REPORT_INTERVAL, unit="tiles"):
+        """
+        Constructor.
+
+        Inputs:
+        total -- the number of tiles the run is expected to process
+        stream -- where the progress bar is drawn, None to draw nothing
+        interval -- minimum seconds between two progress bar redraws
+        unit -- what is being counted, as shown on the progress bar
+        """
+        self.created = time()
+        self.started = self.created
+        self.total = total
+        self.tiles = 0
+        self.skipped = 0
+        self.bytes = 0
+        # tiles processed by workers that have not sent their new_stats() back yet
+        self.pending = 0
+        self.phases = {}
+        self.info = {}
+        self.stream = stream
+        self.interval = interval
+        self.unit = unit
+        self.finished = None
+        self.__last_report = None
+        self.__spinner = 0
+
+    def start(self, total):
+        """Sets the number of tiles to process and restarts the rate clock."""
+        self.total = total
+        self.started = time()
+        self.finished = None
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager adding the wall time of its block to phase name."""
+        start = time()
+        try:
+            yield self
+        finally:
+            self.add_time(name, time() - start)
+
+    def add_time(self, name, seconds):
+        """Adds seconds to phase name."""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add(self, tiles=1, byte_count=0):
+        """Records tiles processed and their size in bytes."""
+        self.tiles += tiles
+        self.bytes += byte_count
+
+    def skip(self, tiles=1):
+        """Records tiles that were processed but left out of the output."""
+        self.skipped += tiles
+
+    def update_pending(self, done):
+        """
+        Sets pending from the number of tiles processed by every worker so
+        far, e.g. SharedProgress.done, of which the tiles and skipped tiles
+        merged already are a part.
+        """
+        self.pending = max(0, done - self.tiles - self.skipped)
+
+    @property
+    def done(self):
+        """Number of tiles processed, stored or skipped."""
+        return self.tiles + self.skipped + self.pending
+
+    def merge(self, stats):
+        """
+        Adds a new_stats() dictionary sent back by a worker.  Worker encode and
+        insert times are summed over all workers, so with several processes
+        they can add up to more than the wall time of the run.
+        """
+        self.add(stats['tiles'], stats['bytes'])
+        self.skip(stats['skipped'])
+        self.add_time('encode', stats['encode'])
+        self.add_time('insert', stats['insert'])
+
+    @property
+    def elapsed(self):
+        """Seconds since start() was called."""
+        return time() - self.started
+
+    @property
+    def tiles_per_second(self):
+        """Average tiles processed per second since start()."""
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def bytes_per_second(self):
+        """Average bytes processed per second since start()."""
+        elapsed = self.elapsed
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Estimated seconds until every tile is processed, or None if unknown."""
+        rate = self.tiles_per_second
+        if not self.total or rate <= 0:
+            return None
+        return max(0.0, (self.total - self.done) / rate)
+
+    def report(self, force=False):
+        """
+        Redraws the progress bar, at most once per interval unless force is
+        set.
+        """
+        now = time()
+        if self.stream is None or (not force and self.__last_report is not None and
+                                   now - self.__last_report < self.interval):
+            return
+        self.__last_report = now
+        if self.total and self.done >= self.total:
+            status = "X"
+        else:
+            status = SPINNER[self.__spinner]
+            self.__spinner = (self.__spinner + 1) % len(SPINNER)
+        filled = min(PROGRESS_WIDTH, int(PROGRESS_WIDTH * self.done / self.total)) if self.total else 0
+        eta = self.eta
+        self.stream.write("\r[{0}] Progress: [{1}{2}] {3}/{4} {8} {5:.1f} {8}/s {6:.2f} MB/s ETA {7}  ".format(
+            status, "=" * filled, " " * (PROGRESS_WIDTH - filled), self.done, self.total,
+            self.tiles_per_second, self.bytes_per_second / 1048576.0,
+            timedelta(seconds=int(eta)) if eta is not None else "-", self.unit))
+        self.stream.flush()
+
+    def finish(self, message="All Done!"):
+        """Draws the final progress bar and ends the line with message."""
+        self.finished = time()
+        self.report(force=True)
+        if self.stream is not None:
+            self.stream.write(" " + message + "\n")
+            self.stream.flush()
+
+    @property
+    def encode_seconds(self):
+        """Seconds from start() until finish() was last called, or until now if it was not."""
+        return (self.finished or time()) - self.started
+
+    def phase_rate(self, name):
+        """Tiles per second over the time of phase name, None if it did not run."""
+        seconds = self.phases.get(name)
+        return self.tiles / seconds if seconds else None
+
+    def summary(self):
+        """
+        Returns a dictionary summarizing the run: tile, skipped tile and byte
+        counts, the average rates from start() to finish(), leaving out
+        whatever ran after the progress bar such as a merge, the rate of the
+        merge phase (None without one), the total wall time, the time of
+        every phase and any extra values stored in info.
+        """
+        seconds = self.encode_seconds
+        return dict(tiles=self.tiles,
+                    skipped=self.skipped,
+                    bytes=self.bytes,
+                    encode_tiles_per_second=self.done / seconds if seconds > 0 else 0.0,
+                    encode_bytes_per_second=self.bytes / seconds if seconds > 0 else 0.0,
+                    merge_tiles_per_second=self.phase_rate('merge'),
+                    seconds=time() - self.created,
+                    phases=dict(self.phases),
+                    info=dict(self.info))
+
+    def write_summary(self, file_path):
+        """Writes summary() to file_path as JSON."""
+        with open(file_path, 'w') as summary_file:
+            dump(self.summary(), summary_file, indent=2, sort_keys=True)
+
+    def track(self, tiles):
+        """
+        Wraps an iterable of (z, x, y, data) tiles, recording every tile as it
+        is consumed and redrawing the progress bar.  None entries stand for
+        skipped tiles, they are counted and left out.
+        """
+        for tile in tiles:
+            if tile is None:
+                self.skip()
+            else:
+                yield tile
+                self.add(1, len(tile[3]))
+            self.report()
@@ -36,8 +36,12 @@ from scripts.geopackage.srs.geodetic import Geodetic
 from scripts.geopackage.srs.mercator import Mercator
 from scripts.geopackage.srs.scaled_world_mercator import ScaledWorldMercator
 from scripts.geopackage.tiles.geopackage_tiles import GeoPackageTiles
+from scripts.geopackage.tiles.tile_addressing import TileAddressing
+from scripts.geopackage.tiles.tile_reader import DEFAULT_CACHE_BYTES, TileReader
 from scripts.geopackage.tiles.tiles_content_entry import TilesContentEntry
-from scripts.geopackage.utility.sql_utility import get_database_connection
+from scripts.geopackage.utility.connection_pool import ReadConnectionPool
+from scripts.geopackage.utility.sql_utility import get_database_connection, table_exists
+from scripts.geopackage.utility.tile_order import TILE_ORDER_FUNCTIONS, register_tile_order_functions
 
 try:
     from cStringIO import StringIO as ioBuffer
@@ -48,8 +52,10 @@ from sys import version_info
 if version_info[0] == 3:
     xrange = range
 
+from contextlib import closing
+from itertools import islice
 from operator import attrgetter
-from sqlite3 import Error, sqlite_version
+from sqlite3 import Error, connect, sqlite_version
 from os import remove
 from os.path import exists
 from distutils.version import LooseVersion
@@ -58,6 +64,9 @@ PRAGMA_MINIMUM_SQLITE_VERSION = '3.7.17'
 
 DEFAULT_TILES_IDENTIFIER = "tiles"
 
+# Number of tiles written per transaction by insert_tiles
+DEFAULT_COMMIT_SIZE = 1000
+
 
 class Geopackage(object):
     """Object representing a GeoPackage container."""
@@ -66,9 +75,10 @@ class Geopackage(object):
         """With-statement caller"""
         return self
 
-    def __init__(self, file_path, srs, tiles_table_name):
+    def __init__(self, file_path, srs, tiles_table_name, write_profile=None):
         """Constructor.
         :param tiles_table_name:
+        :param write_profile: optional WriteProfile, or preset name, the connection to the file is opened with
         """
         self.__file_path = file_path
         self.__srs = srs
@@ -80,8 +90,12 @@ class Geopackage(object):
             self.__projection = ScaledWorldMercator()
         else:
             self.__projection = Geodetic()
-        self.__db_con = get_database_connection(self.__file_path)
+        self.__db_con = get_database_connection(self.__file_path, write_profile)
         self.tiles_table_name = tiles_table_name
+        # set between begin_bulk_load() and finish_bulk_load()
+        self.__bulk_loading = False
+        # TileAddressing of the tiles table by tms flag, built by addressing()
+        self.__addressing = {}
 
     def initialize(self, populate_srs_extra_values=True):
         """Initialized the database schema. previously this was done in the __init__ constructor, however this
@@ -127,8 +141,32 @@ class Geopackage(object):
         """Return the path of the geopackage database on the file system."""
         return self.__file_path
 
+    def open_reader(self, cache_bytes=DEFAULT_CACHE_BYTES, immutable=False):
+        """
+        Returns a TileReader of this geopackage that can be shared by threads, reading through a
+        ReadConnectionPool.  Close it when done, the connection of this object stays open.
+
+        :param cache_bytes: the most bytes of tiles the reader caches
+        :param immutable: True if nothing writes to the file while the reader is open
+        """
+        return TileReader(self.__file_path, cache_bytes, ReadConnectionPool(self.__file_path, immutable))
+
+    def addressing(self, tms=False):
+        """
+        Returns the TileAddressing translating absolute XYZ, or TMS, addresses to the tiles of the tiles table.  It
+        is built from the tile matrix once, until update_metadata() changes it.
+
+        :param tms: whether the y of the addresses counts from the bottom of the grid rather than from the top
+        """
+        addressing = self.__addressing.get(tms)
+        if addressing is None:
+            addressing = TileAddressing.from_tile_matrix(self.__db_con.cursor(), self.tiles_table_name, tms)
+            self.__addressing[tms] = addressing
+        return addressing
+
     def update_metadata(self, metadata):
         """Update the metadata of the geopackage database after tile merge."""
+        self.__addressing.clear()
         # initialize a new projection
         with self.__db_con as db_con:
             cursor = db_con.cursor()
@@ -175,34 +213,212 @@ class Geopackage(object):
                 result_cursor = cursor.execute(statement)
             return result_cursor
 
-    def assimilate(self, source):
-        """Assimilate .gpkg.part tiles into this geopackage database."""
-        if not exists(source):
-            raise IOError
-        self.__db_con = get_database_connection(self.__file_path)
+    def executemany(self, statement, inputs):
+        """Execute a prepared SQL statement once per row of inputs, in one transaction."""
+        with self.__db_con as db_con:
+            return db_con.executemany(statement, inputs)
 
+    def begin_bulk_load(self):
+        """
+        Starts a bulk load: until finish_bulk_load() is called insert_tiles
+        appends tiles to a staging table without any index, instead of
+        updating the UNIQUE index of the tiles table for every tile.  Worth it
+        for large loads arriving out of (zoom_level, tile_column, tile_row)
+        order, e.g. from several workers at once.  The staging table of an
+        earlier bulk load that was never finished is dropped first, its
+        tiles were never written into the tiles table.
+        """
+        if self.__bulk_loading:
+            raise ValueError("A bulk load of {table} is already started".format(table=self.tiles_table_name))
         with self.__db_con as db_con:
-            # needed in python3 to avoid operation error on ATTACH.
-            db_con.isolation_level = None
             cursor = db_con.cursor()
-            cursor.execute("pragma synchronous = off;")
-            cursor.execute("pragma journal_mode = off;")
-            cursor.execute("pragma page_size = 65536;")
-            # print "Merging", source, "into", self.__file_path, "..."
-            query = "attach '" + source + "' as source;"
-            cursor.execute(query)
-
-            try:
-                cursor.execute("""INSERT OR REPLACE INTO '{table_name}'
-                (zoom_level, tile_column, tile_row, tile_data)
-                SELECT zoom_level, tile_column, tile_row, tile_data
-                FROM 'source'.'{table_name}';""".format(table_name=self.tiles_table_name))
-                cursor.execute("detach source;")
-            except Error as err:
-                print("Error: {}".format(type(err)))
-                print("Error msg:".format(err))
-                raise
-            remove(source)
+            if not table_exists(cursor, self.tiles_table_name):
+                raise ValueError("Cannot bulk load {table} because it does not exist"
+                                 .format(table=self.tiles_table_name))
+            GeoPackageTiles.create_staging_table(cursor, self.tiles_table_name)
+        self.__bulk_loading = True
+
+    def finish_bulk_load(self):
+        """
+        Ends a bulk load started by begin_bulk_load(): the staged tiles are
+        sorted and written into the tiles table in one pass, the last tile
+        staged for a (zoom_level, tile_column, tile_row) replacing the
+        others, as it would have without a bulk load.
+
+        Returns:
+        The number of tiles written, and the number of duplicate tiles dropped.
+        """
+        if not self.__bulk_loading:
+            raise ValueError("No bulk load of {table} is started".format(table=self.tiles_table_name))
+        with self.__db_con as db_con:
+            result = GeoPackageTiles.build_from_staging_table(db_con.cursor(), self.tiles_table_name)
+        self.__bulk_loading = False
+        return result
+
+    def insert_tiles(self, tiles, commit_size=DEFAULT_COMMIT_SIZE):
+        """
+        Write tiles directly into the tiles table of this geopackage database,
+        or into its staging table during a bulk load, see begin_bulk_load().
+
+        Inputs:
+        tiles -- an iterable (list or generator) of (z, x, y, data) tuples
+        commit_size -- the number of tiles written per transaction
+
+        Returns:
+        The number of tiles written.
+        """
+        if commit_size < 1:
+            raise ValueError("commit_size must be a positive integer")
+        cursor = self.__db_con.cursor()
+        if not table_exists(cursor, self.tiles_table_name):
+            raise ValueError("Cannot add row to {table} because it does not exist"
+                             .format(table=self.tiles_table_name))
+        cursor.close()
+        if self.__bulk_loading:
+            statement = GeoPackageTiles.get_insert_staging_tile_data_statement(table_name=self.tiles_table_name)
+        else:
+            statement = GeoPackageTiles.get_insert_or_update_tile_data_statement(table_name=self.tiles_table_name)
+        tiles = iter(tiles)
+        count = 0
+        while True:
+            chunk = list(islice(tiles, commit_size))
+            if not chunk:
+                break
+            with self.__db_con as db_con:
+                db_con.executemany(statement, chunk)
+            count += len(chunk)
+        return count
+
+    def assimilate(self, source, tile_order=None):
+        """
+        Assimilate .gpkg.part tiles into this geopackage database.
+
+        :param source: the path of the .gpkg.part file
+        :param tile_order: optional space filling curve to store the tiles
+                           along, see order_tiles()
+        """
+        self.merge_parts([source], tile_order=tile_order)
+
+    def __get_tile_range(self, source):
+        """
+        Returns the first and last (zoom_level, tile_column, tile_row) keys of
+        the tiles in a .gpkg.part file, or (None, None) if it has no tiles.
+        Both are read off the UNIQUE index of the tiles table.
+        """
+        query = """SELECT zoom_level, tile_column, tile_row FROM '{table_name}'
+                   ORDER BY zoom_level {order}, tile_column {order}, tile_row {order} LIMIT 1;"""
+        with closing(connect(source)) as part_con:
+            first = part_con.execute(query.format(table_name=self.tiles_table_name, order='ASC')).fetchone()
+            if first is None:
+                return None, None
+            last = part_con.execute(query.format(table_name=self.tiles_table_name, order='DESC')).fetchone()
+            return tuple(first), tuple(last)
+
+    def merge_parts(self, sources, callback=None, tile_order=None):
+        """
+        Merge .gpkg.part tile databases into this geopackage database on its
+        own connection, removing each part once it is merged.
+
+        Parts are merged in the order of their first tile, and the tiles of a
+        part are read in (zoom_level, tile_column, tile_row) order off its
+        UNIQUE index, whatever order the workers wrote them in, so rows are
+        appended to the end of the UNIQUE index instead of being scattered
+        through it.  A part whose tiles all come after the tiles already
+        merged cannot conflict with them and is copied with a plain INSERT,
+        the others fall back to INSERT OR REPLACE.
+
+        :param sources: the paths of the .gpkg.part files
+        :param callback: optional function called with the path of every
+                         part once it is merged and removed
+        :param tile_order: optional space filling curve to store the tiles
+                           along once every part is merged, see order_tiles()
+        :return: the number of tiles merged
+        """
+        for source in sources:
+            if not exists(source):
+                raise IOError("{0} does not exist".format(source))
+        # the first key of a part without tiles is None, those come first
+        parts = sorted(((self.__get_tile_range(source), source) for source in sources),
+                       key=lambda part: part[0][0] or ())
+        statement = """{verb} INTO '{table_name}' (zoom_level, tile_column, tile_row, tile_data)
+                       SELECT zoom_level, tile_column, tile_row, tile_data FROM part.'{table_name}'
+                       ORDER BY zoom_level, tile_column, tile_row;"""
+        db_con = self.__db_con
+        isolation_level = db_con.isolation_level
+        # needed in python3 to avoid operation error on ATTACH.
+        db_con.isolation_level = None
+        cursor = db_con.cursor()
+        merged = 0
+        try:
+            cursor.execute("SELECT 1 FROM '{table_name}' LIMIT 1;".format(table_name=self.tiles_table_name))
+            # existing tiles may conflict with any part
+            last_merged = None
+            replace_all = cursor.fetchone() is not None
+            for (first, last), source in parts:
+                if first is not None:
+                    replace = replace_all or (last_merged is not None and first <= last_merged)
+                    cursor.execute("ATTACH DATABASE ? AS part;", (source,))
+                    cursor.execute(statement.format(verb="INSERT OR REPLACE" if replace else "INSERT",
+                                                    table_name=self.tiles_table_name))
+                    merged += cursor.rowcount
+                    cursor.execute("DETACH DATABASE part;")
+                    last_merged = last if last_merged is None else max(last_merged, last)
+                remove(source)
+                if callback is not None:
+                    callback(source)
+        except Error as err:
+            print("Error: {}".format(type(err)))
+            print("Error msg: {}".format(err))
+            raise
+        finally:
+            cursor.close()
+            db_con.isolation_level = isolation_level
+        if tile_order is not None:
+            self.order_tiles(tile_order)
+        return merged
+
+    def order_tiles(self, tile_order):
+        """
+        Rewrites the tiles table sorted by zoom level, then by the position of
+        (tile_column, tile_row) on a space filling curve, so tiles that are
+        close on the map are close in the table and a viewer panning around
+        reads fewer SQLite pages.  The tile ids are renumbered in that order.
+
+        Only the ids are sorted, through a temporary table, and the tiles are
+        then copied once into a new table with the same schema that replaces
+        the old one.
+
+        :param tile_order: 'zorder' or 'hilbert', see TILE_ORDER_FUNCTIONS
+        """
+        if tile_order not in TILE_ORDER_FUNCTIONS:
+            raise ValueError("Unknown tile order {0}, expected one of {1}"
+                             .format(tile_order, sorted(TILE_ORDER_FUNCTIONS)))
+        db_con = self.__db_con
+        register_tile_order_functions(db_con)
+        ordered_table = self.tiles_table_name + "_ordered"
+        cursor = db_con.cursor()
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?;", (self.tiles_table_name,))
+        table_sql = cursor.fetchone()[0]
+        ordered_sql = table_sql.replace('"{0}"'.format(self.tiles_table_name), '"{0}"'.format(ordered_table), 1)
+        if ordered_sql == table_sql:
+            raise ValueError("Cannot copy the schema of {0}".format(self.tiles_table_name))
+        with db_con:
+            cursor.execute("DROP TABLE IF EXISTS temp.tile_order;")
+            cursor.execute("""CREATE TEMP TABLE tile_order AS
+                              SELECT id FROM '{table_name}'
+                              ORDER BY zoom_level, {function}(tile_column, tile_row);"""
+                           .format(table_name=self.tiles_table_name, function=TILE_ORDER_FUNCTIONS[tile_order]))
+            cursor.execute(ordered_sql)
+            # the rowid of tile_order is the position of the tile
+            cursor.execute("""INSERT INTO '{ordered_table}' (zoom_level, tile_column, tile_row, tile_data)
+                              SELECT tiles.zoom_level, tiles.tile_column, tiles.tile_row, tiles.tile_data
+                              FROM temp.tile_order AS positions JOIN '{table_name}' AS tiles ON tiles.id = positions.id
+                              ORDER BY positions.rowid;"""
+                           .format(ordered_table=ordered_table, table_name=self.tiles_table_name))
+            cursor.execute("DROP TABLE temp.tile_order;")
+            cursor.execute("DROP TABLE '{table_name}';".format(table_name=self.tiles_table_name))
+            cursor.execute("ALTER TABLE '{ordered_table}' RENAME TO '{table_name}';"
+                           .format(ordered_table=ordered_table, table_name=self.tiles_table_name))
 
     def __exit__(self, type, value, traceback):
         """Resource cleanup on destruction."""
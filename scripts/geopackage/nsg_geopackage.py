@@ -39,6 +39,7 @@ from scripts.geopackage.srs.geodetic_nsg import GeodeticNSG
 from scripts.geopackage.tiles.geopackage_tiles import GeoPackageTiles
 from scripts.geopackage.tiles.tiles_content_entry import TilesContentEntry
 from scripts.geopackage.utility.sql_utility import get_database_connection
+from scripts.geopackage.utility.write_profile import get_write_profile
 
 try:
     from cStringIO import StringIO as ioBuffer
@@ -62,10 +63,15 @@ class NsgGeopackage(Geopackage):
     into the geopackage spec, and remove the need for an advanced profile.
     """
 
-    def __init__(self, file_path, srs, tiles_table_name):
+    def __init__(self, file_path, srs, tiles_table_name, write_profile=None):
+        write_profile = get_write_profile(write_profile)
+        if write_profile is not None and write_profile.locking_mode is not None:
+            # the NSG tables and metadata are written through connections of their own
+            write_profile = write_profile.copy(locking_mode=None)
         super(NsgGeopackage, self).__init__(file_path=file_path,
                                             srs=srs,
-                                            tiles_table_name=tiles_table_name)
+                                            tiles_table_name=tiles_table_name,
+                                            write_profile=write_profile)
         """Constructor."""
         self.__file_path = file_path
         self.__srs = srs
@@ -75,7 +81,7 @@ class NsgGeopackage(Geopackage):
         else:
             raise ValueError("SRS for NSG GeoPackages must be 4326")
 
-        self.__db_con = get_database_connection(self.__file_path)
+        self.__db_con = get_database_connection(self.__file_path, write_profile)
         self.tiles_table_name = tiles_table_name
 
     def __enter__(self):
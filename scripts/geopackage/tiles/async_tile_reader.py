@@ -0,0 +1,128 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3, asyncio (Python 3.5 or later)
+Description: asyncio front end of a TileReader.  The SQLite reads run on a
+ bounded thread pool so they never block the event loop, and concurrent
+ requests for the same tile share a single read.
+
+Version:
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.geopackage.tiles.tile_reader import DEFAULT_CACHE_BYTES, TileReader
+from scripts.geopackage.utility.connection_pool import ReadConnectionPool
+
+# Threads reading the GeoPackage, and so connections of the pool
+DEFAULT_MAX_WORKERS = 8
+
+
+class AsyncTileReader(object):
+    """
+    Awaitable access to the tiles of a GeoPackage.  Tiles in the cache of
+    the TileReader are returned right away, the others are read on a
+    thread pool of max_workers threads.  While a tile is being read, every
+    other request for it waits on that same read instead of queueing
+    another one.
+    """
+
+    def __init__(self, reader, max_workers=DEFAULT_MAX_WORKERS, coalesce=True):
+        """
+        Constructor.
+
+        :param reader: the reader the tiles are read with, it has to read through a ReadConnectionPool since it is
+                       used by several threads
+        :type reader: TileReader
+
+        :param max_workers: the number of tiles read at the same time
+        :type max_workers: int
+
+        :param coalesce: False to read a tile once per request, even while it is already being read
+        :type coalesce: bool
+        """
+        self.reader = reader
+        self.coalesce = coalesce
+        self.coalesced = 0
+        self.__executor = ThreadPoolExecutor(max_workers)
+        self.__pending = {}
+
+    @classmethod
+    def open(cls, file_path, cache_bytes=DEFAULT_CACHE_BYTES, max_workers=DEFAULT_MAX_WORKERS, immutable=False):
+        """
+        Returns an AsyncTileReader of the GeoPackage at file_path, reading
+        through a new ReadConnectionPool.
+
+        :param file_path: the path of the GeoPackage
+        :param cache_bytes: the most bytes of tiles cached, see TileReader
+        :param max_workers: the number of tiles read at the same time
+        :param immutable: True if nothing writes to the file while it is open
+        """
+        return cls(TileReader(file_path, cache_bytes, ReadConnectionPool(file_path, immutable)), max_workers)
+
+    async def get_tile(self, table_name, zoom_level, tile_column, tile_row):
+        """
+        Returns the data of a tile, see TileReader.get_tile().
+
+        :return: the tile data, or None if the table has no such tile
+        :rtype: bytes
+        """
+        cached, data = self.reader.get_cached_tile(table_name, zoom_level, tile_column, tile_row)
+        if cached:
+            return data
+        key = (table_name, zoom_level, tile_column, tile_row)
+        future = self.__pending.get(key) if self.coalesce else None
+        if future is None:
+            future = asyncio.get_event_loop().run_in_executor(self.__executor, self.reader.get_tile, *key)
+            if self.coalesce:
+                self.__pending[key] = future
+                future.add_done_callback(lambda _: self.__pending.pop(key, None))
+        else:
+            self.coalesced += 1
+        # a cancelled request must not cancel the read the other requests wait on
+        return await asyncio.shield(future)
+
+    async def get_tile_xyz(self, table_name, zoom, x, y, tms=False):
+        """
+        Returns the data of the tile at an absolute address, see
+        TileReader.get_tile_xyz().  The addressing of a table is read from
+        its tile matrix by the first request only.
+
+        :return: the tile data, or None if the table has no such tile
+        :rtype: bytes
+        """
+        key = self.reader.addressing(table_name, tms).to_stored(zoom, x, y)
+        if key is None:
+            return None
+        return await self.get_tile(table_name, *key)
+
+    def close(self):
+        """Waits for the reads in progress, then closes the reader."""
+        self.__executor.shutdown(wait=True)
+        self.reader.close()
+
+    async def __aenter__(self):
+        """Async with-statement caller"""
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        """Resource cleanup on destruction."""
+        self.close()
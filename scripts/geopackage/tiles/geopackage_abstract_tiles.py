@@ -39,6 +39,16 @@ from scripts.geopackage.utility.sql_utility import table_exists, select_query
 
 GEOPACKAGE_TILE_MATRIX_TABLE_NAME = "gpkg_tile_matrix"
 GEOPACKAGE_TILE_MATRIX_SET_TABLE_NAME = "gpkg_tile_matrix_set"
+# Prefixed to the name of a pyramid user data table for its bulk load staging table.  A table of that name is only
+# filled or dropped if it has exactly the columns below and no index, so a table of the user is never mistaken for it
+STAGING_TABLE_PREFIX = "bulk_load_staging_"
+# (name, type, notnull, default, pk) of the columns of a staging table, as returned by pragma table_info
+STAGING_TABLE_COLUMNS = [('zoom_level', 'INTEGER', 1, None, 0),
+                         ('tile_column', 'INTEGER', 1, None, 0),
+                         ('tile_row', 'INTEGER', 1, None, 0),
+                         ('tile_data', 'BLOB', 1, None, 0)]
+# mmap_size used while building from a staging table, SQLite lowers it to its own compile time limit
+STAGING_MMAP_SIZE = 2 ** 40
 
 
 class GeoPackageAbstractTiles(object):
@@ -295,18 +305,189 @@ class GeoPackageAbstractTiles(object):
             raise ValueError("Cannot add row to {table} because it does not exist"
                              .format(table=table_name))
 
-        image_blob_stmt = """
-                              INSERT OR REPLACE INTO "{table_name}"
-                                  (zoom_level, 
-                                  tile_column, 
-                                  tile_row, 
-                                  tile_data)
-                              VALUES (?,?,?,?);
-                          """.format(table_name=table_name)
-        cursor.execute(image_blob_stmt, (zoom_level,
-                                         tile_column,
-                                         tile_row,
-                                         tile_data))
+        cursor.execute(GeoPackageAbstractTiles.get_insert_or_update_tile_data_statement(table_name=table_name),
+                       (zoom_level,
+                        tile_column,
+                        tile_row,
+                        tile_data))
+
+    @staticmethod
+    def get_insert_or_update_tile_data_statement(table_name):
+        """
+        Returns the parameterized statement used to insert or replace a row in the pyramid user data table. The
+        parameters are bound in the order (zoom_level, tile_column, tile_row, tile_data) so the same statement can be
+        reused with executemany for batched inserts.
+
+        :param table_name: Tile Pyramid User Data Table Name
+        :type table_name: str
+
+        :return: the INSERT OR REPLACE statement for the table given
+        :rtype: str
+        """
+        return """
+                   INSERT OR REPLACE INTO "{table_name}"
+                       (zoom_level,
+                       tile_column,
+                       tile_row,
+                       tile_data)
+                   VALUES (?,?,?,?);
+               """.format(table_name=table_name)
+
+    @staticmethod
+    def get_staging_table_name(table_name):
+        """
+        Returns the name of the staging table used to bulk load the pyramid user data table given.
+
+        :param table_name: Tile Pyramid User Data Table Name
+        :type table_name: str
+
+        :return: the name of the staging table
+        :rtype: str
+        """
+        return STAGING_TABLE_PREFIX + table_name
+
+    @staticmethod
+    def is_staging_table(cursor, table_name):
+        """
+        Returns whether the staging table name of the pyramid user data table given is taken by a staging table made by
+        create_staging_table(), rather than by a table of the user or by nothing.
+
+        :param cursor: the cursor to the GeoPackage database's connection
+        :type cursor: Cursor
+
+        :param table_name: Tile Pyramid User Data Table Name
+        :type table_name: str
+
+        :rtype: bool
+        """
+        staging_table_name = GeoPackageAbstractTiles.get_staging_table_name(table_name)
+        if not table_exists(cursor, staging_table_name):
+            return False
+        cursor.execute("""pragma table_info("{table_name}");""".format(table_name=staging_table_name))
+        columns = [tuple(column)[1:] for column in cursor.fetchall()]
+        cursor.execute("""pragma index_list("{table_name}");""".format(table_name=staging_table_name))
+        return columns == STAGING_TABLE_COLUMNS and not cursor.fetchall()
+
+    @staticmethod
+    def drop_staging_table(cursor, table_name):
+        """
+        Drops the staging table of the pyramid user data table given, left by a bulk load that was interrupted.  A
+        table of the user with the same name is left as it is.
+
+        :param cursor: the cursor to the GeoPackage database's connection
+        :type cursor: Cursor
+
+        :param table_name: Tile Pyramid User Data Table Name
+        :type table_name: str
+
+        :return: whether there was a staging table to drop
+        :rtype: bool
+        """
+        if not GeoPackageAbstractTiles.is_staging_table(cursor, table_name):
+            return False
+        cursor.execute("""DROP TABLE "{table_name}";""".format(
+            table_name=GeoPackageAbstractTiles.get_staging_table_name(table_name)))
+        return True
+
+    @staticmethod
+    def create_staging_table(cursor, table_name):
+        """
+        Creates an empty staging table for the pyramid user data table given. It has the same columns but no index or
+        constraint, so tiles are appended to it in the order they arrive, duplicates included, without maintaining a
+        B-tree index in random order. build_from_staging_table moves its tiles into the pyramid user data table.  A
+        staging table left by an earlier bulk load is replaced, a table of the user with the same name is not.
+
+        :param cursor: the cursor to the GeoPackage database's connection
+        :type cursor: Cursor
+
+        :param table_name: Tile Pyramid User Data Table Name
+        :type table_name: str
+        """
+        staging_table_name = GeoPackageAbstractTiles.get_staging_table_name(table_name)
+        if not GeoPackageAbstractTiles.drop_staging_table(cursor, table_name) and \
+                table_exists(cursor, staging_table_name):
+            raise ValueError("Cannot bulk load {table} because {staging_table} is not its staging table"
+                             .format(table=table_name, staging_table=staging_table_name))
+        cursor.execute("""
+                          CREATE TABLE "{table_name}"
+                          ({columns})
+                       """.format(table_name=staging_table_name,
+                                  columns=", ".join("{0} {1} NOT NULL".format(name, column_type)
+                                                    for name, column_type, _, _, _ in STAGING_TABLE_COLUMNS)))
+
+    @staticmethod
+    def get_insert_staging_tile_data_statement(table_name):
+        """
+        Returns the parameterized statement appending a tile to the staging table of the pyramid user data table given,
+        with the parameters bound in the order (zoom_level, tile_column, tile_row, tile_data).
+
+        :param table_name: Tile Pyramid User Data Table Name
+        :type table_name: str
+
+        :return: the INSERT statement for the staging table
+        :rtype: str
+        """
+        return """
+                   INSERT INTO "{table_name}"
+                       (zoom_level,
+                       tile_column,
+                       tile_row,
+                       tile_data)
+                   VALUES (?,?,?,?);
+               """.format(table_name=GeoPackageAbstractTiles.get_staging_table_name(table_name))
+
+    @staticmethod
+    def build_from_staging_table(cursor, table_name):
+        """
+        Moves the tiles of the staging table into the pyramid user data table given and drops the staging table.
+
+        Duplicates are resolved first: of the tiles staged for the same zoom level, column and row only the last one
+        staged is kept, as INSERT OR REPLACE would have done. Only the keys and row ids are sorted, then the tiles are
+        copied once in (zoom_level, tile_column, tile_row) order, so the UNIQUE index of the pyramid user data table is
+        built by appending to it. Tiles already in the pyramid user data table are replaced by staged tiles with the
+        same key.  The staged tiles are read in key order, not in the order they were staged, so the staging table is
+        memory mapped while they are copied instead of going through the page cache one page at a time.
+
+        :param cursor: the cursor to the GeoPackage database's connection
+        :type cursor: Cursor
+
+        :param table_name: Tile Pyramid User Data Table Name
+        :type table_name: str
+
+        :return: the number of tiles moved, and the number of duplicate tiles dropped
+        :rtype: (int, int)
+        """
+        staging_table_name = GeoPackageAbstractTiles.get_staging_table_name(table_name)
+        if not GeoPackageAbstractTiles.is_staging_table(cursor, table_name):
+            raise ValueError("There is no staging table for {table}".format(table=table_name))
+        cursor.execute("""SELECT 1 FROM "{table_name}" LIMIT 1;""".format(table_name=table_name))
+        replace = cursor.fetchone() is not None
+        cursor.execute("""SELECT count(*) FROM "{table_name}";""".format(table_name=staging_table_name))
+        staged = cursor.fetchone()[0]
+        mmap_size = cursor.execute("pragma mmap_size;").fetchone()[0]
+        cursor.execute("pragma mmap_size = {0};".format(STAGING_MMAP_SIZE))
+        cursor.execute("DROP TABLE IF EXISTS temp.staged_tiles;")
+        cursor.execute("""
+                          CREATE TEMP TABLE staged_tiles AS
+                          SELECT max(rowid) AS staged_id FROM "{table_name}"
+                          GROUP BY zoom_level, tile_column, tile_row
+                          ORDER BY zoom_level, tile_column, tile_row;
+                       """.format(table_name=staging_table_name))
+        # the rowid of staged_tiles is the position of the tile
+        cursor.execute("""
+                          INSERT {replace} INTO "{table_name}" (zoom_level, tile_column, tile_row, tile_data)
+                          SELECT tiles.zoom_level, tiles.tile_column, tiles.tile_row, tiles.tile_data
+                          FROM temp.staged_tiles AS positions
+                          JOIN "{staging_table_name}" AS tiles ON tiles.rowid = positions.staged_id
+                          ORDER BY positions.rowid;
+                       """.format(replace="OR REPLACE" if replace else "",
+                                  table_name=table_name,
+                                  staging_table_name=staging_table_name))
+        moved = cursor.rowcount
+        cursor.execute("pragma mmap_size = {0};".format(mmap_size))
+        cursor.execute("DROP TABLE temp.staged_tiles;")
+        cursor.execute("""DROP TABLE "{table_name}";""".format(table_name=staging_table_name))
+        return moved, staged - moved
 
     @staticmethod
     def get_tile_data(cursor,
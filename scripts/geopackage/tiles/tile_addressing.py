@@ -0,0 +1,221 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3
+Description: Translates absolute XYZ or TMS tile addresses to the
+ (zoom_level, tile_column, tile_row) a tile is stored under in a tiles
+ table, whose tile matrices may start anywhere in the world grid.
+
+Version:
+"""
+from math import floor
+
+from scripts.geopackage.srs.ellipsoidal_mercator import EllipsoidalMercator
+from scripts.geopackage.srs.geodetic_nsg import GeodeticNSG
+from scripts.geopackage.srs.mercator import Mercator
+from scripts.geopackage.srs.scaled_world_mercator import ScaledWorldMercator
+from scripts.geopackage.tiles.geopackage_abstract_tiles import GEOPACKAGE_TILE_MATRIX_TABLE_NAME, \
+    GeoPackageAbstractTiles
+from scripts.geopackage.utility.sql_utility import select_query
+
+
+def _mercator_bounds(projection):
+    """Returns the (min_x, min_y, max_x, max_y) of the single tile of zoom level 0 of a Mercator projection."""
+    return tuple(projection.get_coord(0, 0, 0)) + tuple(projection.get_coord(0, 1, 1))
+
+
+# (min_x, min_y, max_x, max_y) of the world grid tiles are numbered from, per srs_id
+WORLD_BOUNDS = {3395: _mercator_bounds(EllipsoidalMercator()),
+                3857: _mercator_bounds(Mercator()),
+                4326: tuple(GeodeticNSG().bounds),
+                9804: _mercator_bounds(ScaledWorldMercator())}
+
+
+def _whole(value):
+    """Rounds a number of tiles that is whole up to floating point error, the same way in Python 2 and 3."""
+    return int(floor(value + 0.5))
+
+
+class TileAddressing(object):
+    """
+    Per zoom level offsets between absolute tile addresses and the tile
+    columns and rows of a tiles table.  A stored address is
+
+        tile_column = x - column_offset
+        tile_row = y - row_offset, or flip - y - row_offset for TMS addresses
+
+    so translating an address is a dictionary lookup and a few additions.
+    The offsets are plain integers, so the addressing can be sent to other
+    processes.
+    """
+
+    def __init__(self, levels, flipped=False):
+        """
+        Constructor.
+
+        :param levels: the (zoom_level, column_offset, row_offset, flip, matrix_width, matrix_height) of every zoom
+                       level of the addresses translated, flip being None unless flipped, matrix_width and
+                       matrix_height None if the stored addresses are not bounded
+        :type levels: dict [int, (int, int, int, int, int, int)]
+
+        :param flipped: whether the y of the addresses translated counts from the bottom of the grid (TMS) rather
+                        than from the top (XYZ)
+        :type flipped: bool
+        """
+        self.levels = levels
+        self.flipped = flipped
+
+    def __len__(self):
+        """Returns the number of zoom levels translated."""
+        return len(self.levels)
+
+    def to_stored(self, zoom, x, y):
+        """
+        Returns the address a tile is stored under.
+
+        :param zoom: the zoom level of the absolute address
+        :type zoom: int
+
+        :param x: the absolute column of the tile
+        :type x: int
+
+        :param y: the absolute row of the tile
+        :type y: int
+
+        :return: the (zoom_level, tile_column, tile_row) of the tile, None if the zoom level has no tile matrix or
+         the tile is outside of it
+        :rtype: (int, int, int)
+        """
+        level = self.levels.get(zoom)
+        if level is None:
+            return None
+        zoom_level, column_offset, row_offset, flip, matrix_width, matrix_height = level
+        tile_column = x - column_offset
+        tile_row = (y if flip is None else flip - y) - row_offset
+        if matrix_width is not None and not (0 <= tile_column < matrix_width and 0 <= tile_row < matrix_height):
+            return None
+        return zoom_level, tile_column, tile_row
+
+    @classmethod
+    def from_grid(cls, levels, tms=False):
+        """
+        Builds an addressing from the place of every tile matrix in the world
+        grid, counted in XYZ rows from the top of the grid.  Every other
+        builder goes through this one, so the offsets and flips are computed
+        in a single place.
+
+        :param levels: the (zoom, zoom_level, first_column, top_row, world_rows, matrix_width, matrix_height) of every
+                       tile matrix: the zoom level of the absolute addresses and the stored one, the column and XYZ row
+                       of its top left tile, the number of rows of the world grid at that zoom level, and its size,
+                       None if the stored addresses are not bounded
+        :type levels: list of (int, int, int, int, int, int, int)
+
+        :param tms: whether the y of the addresses counts from the bottom of the grid rather than from the top
+        :type tms: bool
+
+        :rtype: TileAddressing
+        """
+        # a TMS y is world_rows - 1 - the XYZ y
+        return cls(dict((zoom, (zoom_level, first_column, top_row, world_rows - 1 if tms else None,
+                                matrix_width, matrix_height))
+                        for zoom, zoom_level, first_column, top_row, world_rows, matrix_width, matrix_height in levels),
+                   tms)
+
+    @classmethod
+    def from_levels(cls, tile_info, nsg_profile, invert_y, renumber):
+        """
+        Builds the addressing tiles2gpkg stores source tiles with.  Their
+        columns and rows are relative to the first tile of every zoom level,
+        or absolute with the NSG profile.
+
+        :param tile_info: the ZoomMetadata of every zoom level, see build_lut() and build_lut_nsg()
+        :type tile_info: list of ZoomMetadata
+
+        :param nsg_profile: whether the stored columns and rows are absolute
+        :type nsg_profile: bool
+
+        :param invert_y: the invert_y function of the projection if the source tiles are TMS, None otherwise
+        :type invert_y: function
+
+        :param renumber: whether the source zoom levels are one more than the stored ones
+        :type renumber: bool
+
+        :rtype: TileAddressing
+        """
+        levels = []
+        for level in tile_info:
+            # invert_y(zoom, y) is always world_rows - 1 - y, the grid only has to be known for TMS tiles
+            world_rows = None if invert_y is None else invert_y(level.zoom, 0) + 1
+            if nsg_profile:
+                first_column = top_row = 0
+            else:
+                # the tile grid of ZoomMetadata is transposed, its rows are the columns of the tiles table
+                first_column = level.min_tile_row
+                top_row = level.min_tile_col if invert_y is None else invert_y(level.zoom, level.max_tile_col)
+            levels.append((level.zoom + 1 if renumber else level.zoom, level.zoom, first_column, top_row, world_rows,
+                           None, None))
+        return cls.from_grid(levels, invert_y is not None)
+
+    @classmethod
+    def from_tile_matrix(cls, cursor, table_name, tms=False):
+        """
+        Builds the addressing of a tiles table from its gpkg_tile_matrix_set
+        and gpkg_tile_matrix rows, for absolute addresses of the world grid
+        of its spatial reference system with the same zoom levels as the
+        table.  The bounds of the tile matrix set are those of every tile
+        matrix, so the size of a tile at every zoom level is read off their
+        width rather than off the pixel sizes.
+
+        :param cursor: the cursor to the GeoPackage database's connection, returning sqlite3.Row objects
+        :type cursor: Cursor
+
+        :param table_name: Tile Pyramid User Data Table Name
+        :type table_name: str
+
+        :param tms: whether the y of the addresses counts from the bottom of the grid rather than from the top
+        :type tms: bool
+
+        :rtype: TileAddressing
+        """
+        tile_matrix_set = GeoPackageAbstractTiles.get_tile_matrix_set_entry_by_table_name(cursor, table_name)
+        if tile_matrix_set is None:
+            raise ValueError("Cannot address the tiles of {table} because it has no tile matrix set"
+                             .format(table=table_name))
+        world = WORLD_BOUNDS.get(tile_matrix_set.srs_id)
+        if world is None:
+            raise ValueError("Cannot address tiles of srs_id {srs_id}, the origin of its tile grid is unknown"
+                             .format(srs_id=tile_matrix_set.srs_id))
+        world_min_x, world_min_y, _, world_max_y = world
+        levels = []
+        for row in select_query(cursor=cursor,
+                                table_name=GEOPACKAGE_TILE_MATRIX_TABLE_NAME,
+                                select_columns=['zoom_level', 'matrix_width', 'matrix_height'],
+                                where_columns_dictionary={'table_name': table_name}):
+            # the tiles of every grid are square, and the northings of the Mercator grids are solved numerically
+            tile_span = (tile_matrix_set.max_x - tile_matrix_set.min_x) / row['matrix_width']
+            levels.append((row['zoom_level'],
+                           row['zoom_level'],
+                           _whole((tile_matrix_set.min_x - world_min_x) / tile_span),
+                           _whole((world_max_y - tile_matrix_set.max_y) / tile_span),
+                           _whole((world_max_y - world_min_y) / tile_span),
+                           row['matrix_width'],
+                           row['matrix_height']))
+        return cls.from_grid(levels, tms)
@@ -0,0 +1,288 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3
+Description: Reads tiles out of a GeoPackage for serving them, keeping the
+ most recently read ones in an in-process cache bounded by bytes.
+
+Version:
+"""
+from collections import OrderedDict
+from threading import Lock
+
+from scripts.geopackage.tiles.tile_addressing import TileAddressing
+from scripts.geopackage.utility.sql_utility import get_read_only_connection, table_exists
+
+# Bytes of tile data kept in the cache by default
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# Rough cost of a cache entry besides its tile data, missing tiles are cached with only this cost
+ENTRY_OVERHEAD = 128
+# get_tiles() reads the bounding box of the tiles asked for in one query while it holds at most this many tiles
+# per tile asked for, and looks the tiles up one by one otherwise
+BOUNDING_BOX_RATIO = 2
+
+_MISSING = object()
+
+
+class TileReader(object):
+    """
+    Read only access to the tiles of a GeoPackage.  The statements reading a
+    tiles table are built once per table, tiles are returned as plain bytes,
+    and the tiles read are kept in a least recently used cache holding at
+    most cache_bytes bytes, tiles that are not in the table included.
+    Given a ReadConnectionPool, the reader can be shared by threads, every
+    one reading through its own connection.
+    """
+
+    def __enter__(self):
+        """With-statement caller"""
+        return self
+
+    def __init__(self, file_path, cache_bytes=DEFAULT_CACHE_BYTES, pool=None):
+        """
+        Constructor.
+
+        :param file_path: the path of the GeoPackage
+        :type file_path: str
+
+        :param cache_bytes: the most bytes of tiles cached at once, 0 disables the cache
+        :type cache_bytes: int
+
+        :param pool: optional pool of connections to file_path the tiles are read through, closed with the reader,
+                     by default the reader opens a read only connection of its own
+        :type pool: ReadConnectionPool
+        """
+        self.file_path = file_path
+        self.cache_bytes = cache_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.__pool = pool
+        self.__db_con = get_read_only_connection(file_path) if pool is None else None
+        self.__statements = {}
+        self.__addressing = {}
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def __len__(self):
+        """Returns the number of cached tiles."""
+        return len(self.__entries)
+
+    def __connection(self):
+        """Returns the connection of this reader, or of the calling thread."""
+        return self.__db_con if self.__pool is None else self.__pool.connection()
+
+    def __cursor(self):
+        """Returns a cursor returning raw tuples instead of sqlite3.Row objects."""
+        cursor = self.__connection().cursor()
+        cursor.row_factory = None
+        return cursor
+
+    def __get_statements(self, table_name):
+        """
+        Returns the (single tile, bounding box) SELECT statements of a tiles
+        table, verifying the table exists the first time.
+        """
+        statements = self.__statements.get(table_name)
+        if statements is None:
+            if not table_exists(self.__cursor(), table_name):
+                raise ValueError("Cannot read tiles from {table} because it does not exist".format(table=table_name))
+            statements = ("""SELECT tile_data FROM "{table_name}"
+                             WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?;"""
+                          .format(table_name=table_name),
+                          """SELECT tile_column, tile_row, tile_data FROM "{table_name}"
+                             WHERE zoom_level = ? AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?;"""
+                          .format(table_name=table_name))
+            self.__statements[table_name] = statements
+        return statements
+
+    def __cached(self, key, count_miss=True):
+        """Returns the cached tile data of key, None for a missing tile, or _MISSING if it is not cached."""
+        with self.__lock:
+            value = self.__entries.pop(key, _MISSING)
+            if value is _MISSING:
+                if count_miss:
+                    self.misses += 1
+            else:
+                # re-inserted as the most recently used entry
+                self.__entries[key] = value
+                self.hits += 1
+            return value
+
+    def __store(self, key, value):
+        """Caches the tile data of key, evicting the least recently used tiles beyond cache_bytes."""
+        size = ENTRY_OVERHEAD + (len(value) if value is not None else 0)
+        if size > self.cache_bytes:
+            return
+        with self.__lock:
+            previous = self.__entries.pop(key, _MISSING)
+            if previous is not _MISSING:
+                self.size -= ENTRY_OVERHEAD + (len(previous) if previous is not None else 0)
+            self.__entries[key] = value
+            self.size += size
+            while self.size > self.cache_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.size -= ENTRY_OVERHEAD + (len(evicted) if evicted is not None else 0)
+
+    def get_tile(self, table_name, zoom_level, tile_column, tile_row):
+        """
+        Returns the data of a tile.
+
+        :param table_name: Tile Pyramid User Data Table Name
+        :type table_name: str
+
+        :param zoom_level: the zoom level of the tile
+        :type zoom_level: int
+
+        :param tile_column: the column of the tile, as stored in the table
+        :type tile_column: int
+
+        :param tile_row: the row of the tile, as stored in the table
+        :type tile_row: int
+
+        :return: the tile data, or None if the table has no such tile
+        :rtype: bytes
+        """
+        key = (table_name, zoom_level, tile_column, tile_row)
+        value = self.__cached(key)
+        if value is not _MISSING:
+            return value
+        row = self.__cursor().execute(self.__get_statements(table_name)[0],
+                                      (zoom_level, tile_column, tile_row)).fetchone()
+        value = None if row is None else bytes(row[0])
+        self.__store(key, value)
+        return value
+
+    def addressing(self, table_name, tms=False):
+        """
+        Returns the TileAddressing translating absolute XYZ, or TMS,
+        addresses to the tiles of a table, built from its tile matrix the
+        first time it is asked for.
+
+        :param table_name: Tile Pyramid User Data Table Name
+        :type table_name: str
+
+        :param tms: whether the y of the addresses counts from the bottom of the grid rather than from the top
+        :type tms: bool
+
+        :rtype: TileAddressing
+        """
+        key = (table_name, tms)
+        addressing = self.__addressing.get(key)
+        if addressing is None:
+            addressing = TileAddressing.from_tile_matrix(self.__connection().cursor(), table_name, tms)
+            self.__addressing[key] = addressing
+        return addressing
+
+    def get_tile_xyz(self, table_name, zoom, x, y, tms=False):
+        """
+        Returns the data of the tile at an absolute address of the tile grid
+        of the table, see addressing().
+
+        :return: the tile data, or None if the table has no such tile
+        :rtype: bytes
+        """
+        key = self.addressing(table_name, tms).to_stored(zoom, x, y)
+        if key is None:
+            return None
+        return self.get_tile(table_name, *key)
+
+    def get_cached_tile(self, table_name, zoom_level, tile_column, tile_row):
+        """
+        Returns the data of a tile if it is cached, without reading the GeoPackage.
+
+        :return: a (cached, data) tuple, data being None for a tile the table does not have, or if it is not cached
+        :rtype: (bool, bytes)
+        """
+        value = self.__cached((table_name, zoom_level, tile_column, tile_row), count_miss=False)
+        if value is _MISSING:
+            return False, None
+        return True, value
+
+    def get_tiles(self, table_name, zoom_level, coordinates):
+        """
+        Returns the data of many tiles of a zoom level, such as the tiles of
+        a map viewport.  The tiles that are not cached are read with a
+        single query over their bounding box when they fill most of it.
+
+        :param table_name: Tile Pyramid User Data Table Name
+        :type table_name: str
+
+        :param zoom_level: the zoom level of the tiles
+        :type zoom_level: int
+
+        :param coordinates: the (tile_column, tile_row) of every tile, as stored in the table
+        :type coordinates: list of (int, int)
+
+        :return: a dictionary of the (tile_column, tile_row) of every tile asked for to its data, None for the tiles
+         the table does not have
+        :rtype: dict [(int, int), bytes]
+        """
+        tiles = {}
+        uncached = []
+        for tile_column, tile_row in coordinates:
+            value = self.__cached((table_name, zoom_level, tile_column, tile_row))
+            if value is _MISSING:
+                uncached.append((tile_column, tile_row))
+            else:
+                tiles[(tile_column, tile_row)] = value
+        if not uncached:
+            return tiles
+        single, bounding_box = self.__get_statements(table_name)
+        columns = [tile_column for tile_column, _ in uncached]
+        rows = [tile_row for _, tile_row in uncached]
+        area = (max(columns) - min(columns) + 1) * (max(rows) - min(rows) + 1)
+        if area <= BOUNDING_BOX_RATIO * len(uncached):
+            wanted = set(uncached)
+            found = dict(((tile_column, tile_row), bytes(data)) for tile_column, tile_row, data in
+                         self.__cursor().execute(bounding_box, (zoom_level, min(columns), max(columns),
+                                                                min(rows), max(rows)))
+                         if (tile_column, tile_row) in wanted)
+        else:
+            found = {}
+            cursor = self.__cursor()
+            for tile_column, tile_row in uncached:
+                row = cursor.execute(single, (zoom_level, tile_column, tile_row)).fetchone()
+                if row is not None:
+                    found[(tile_column, tile_row)] = bytes(row[0])
+        for coordinate in uncached:
+            value = found.get(coordinate)
+            self.__store((table_name, zoom_level) + coordinate, value)
+            tiles[coordinate] = value
+        return tiles
+
+    def clear(self):
+        """Empties the cache, e.g. after the tiles of the GeoPackage changed."""
+        with self.__lock:
+            self.__entries.clear()
+            self.__addressing.clear()
+            self.size = 0
+
+    def close(self):
+        """Closes the connection, or the pool of connections, to the GeoPackage."""
+        if self.__pool is not None:
+            self.__pool.close()
+        else:
+            self.__db_con.close()
+
+    def __exit__(self, type, value, traceback):
+        """Resource cleanup on destruction."""
+        self.close()
@@ -0,0 +1,114 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Authors:
+    Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3
+Description: Pool of read only connections to a GeoPackage, one per thread,
+ so the same GeoPackage can be read by many threads at the same time.
+
+Version:
+"""
+from threading import Lock, local
+
+from scripts.geopackage.utility.sql_utility import get_read_only_connection
+from scripts.geopackage.utility.write_profile import READ_SERVING
+
+
+class ReadConnectionPool(object):
+    """
+    Read only connections to a GeoPackage, opened the first time each thread
+    asks for one and kept for its later calls.  Every thread reads through
+    its own connection, so readers never wait on each other, and the pages
+    of the file are shared between them through memory mapping.  The
+    cursors of cursor() can be handed to the GeoPackageCore and
+    GeoPackageTiles getters.
+    """
+
+    def __enter__(self):
+        """With-statement caller"""
+        return self
+
+    def __init__(self, file_path, immutable=False, write_profile=READ_SERVING):
+        """
+        Constructor.
+
+        :param file_path: the path of the GeoPackage
+        :type file_path: str
+
+        :param immutable: True for a published GeoPackage that nothing changes while it is being read, see
+                          get_read_only_connection()
+        :type immutable: bool
+
+        :param write_profile: the WriteProfile, or preset name, every connection is opened with, read-serving by
+                              default, which memory maps the file
+        :type write_profile: WriteProfile or str
+        """
+        self.file_path = file_path
+        self.immutable = immutable
+        self.write_profile = write_profile
+        self.__local = local()
+        self.__connections = []
+        self.__lock = Lock()
+        self.__closed = False
+
+    def __len__(self):
+        """Returns the number of connections opened."""
+        with self.__lock:
+            return len(self.__connections)
+
+    def connection(self):
+        """
+        Returns the connection of the calling thread, opening it on first use.
+
+        :return: a read only connection, only to be used by the calling thread
+        :rtype: Connection
+        """
+        db_con = getattr(self.__local, 'db_con', None)
+        if db_con is None:
+            if self.__closed:
+                raise ValueError("The connection pool of {0} is closed".format(self.file_path))
+            # opened and closed by different threads, but only ever used by one
+            db_con = get_read_only_connection(self.file_path, self.immutable, self.write_profile,
+                                              check_same_thread=False)
+            with self.__lock:
+                self.__connections.append(db_con)
+            self.__local.db_con = db_con
+        return db_con
+
+    def cursor(self):
+        """
+        Returns a new cursor on the connection of the calling thread.
+
+        :rtype: Cursor
+        """
+        return self.connection().cursor()
+
+    def close(self):
+        """Closes every connection of the pool, no thread can use it afterwards."""
+        with self.__lock:
+            self.__closed = True
+            connections, self.__connections = self.__connections, []
+        for db_con in connections:
+            db_con.close()
+
+    def __exit__(self, type, value, traceback):
+        """Resource cleanup on destruction."""
+        self.close()
@@ -30,8 +30,83 @@ Version:
 """
 
 import sqlite3
+from os.path import abspath
 from sqlite3 import Cursor, connect, Connection
 from scripts.geopackage.utility.sql_column_query import SqlColumnQuery
+from scripts.geopackage.utility.write_profile import READ_SERVING, get_write_profile
+
+try:
+    from urllib.request import pathname2url
+except ImportError:
+    from urllib import pathname2url
+
+# First SQLite version with INSERT ... ON CONFLICT DO UPDATE (upsert)
+UPSERT_MINIMUM_SQLITE_VERSION = (3, 24, 0)
+
+# Most statements kept by the query builders below, the cache is emptied when it is full
+STATEMENT_CACHE_SIZE = 512
+
+# SQL built by the query builders, by statement kind, table, column names and which where values are NULL
+_STATEMENTS = {}
+
+
+class StatementCacheConnection(Connection):
+    """
+    Connection remembering the tables the query builders of this module
+    found, so they are only looked up in sqlite_master once per connection,
+    and the tables upserts cannot be used on.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(StatementCacheConnection, self).__init__(*args, **kwargs)
+        self.verified_tables = set()
+        self.no_upsert = set()
+
+
+def _get_statement(key, build):
+    """Returns the cached statement of key, calling build() to make it the first time."""
+    statement = _STATEMENTS.get(key)
+    if statement is None:
+        statement = build()
+        if len(_STATEMENTS) >= STATEMENT_CACHE_SIZE:
+            _STATEMENTS.clear()
+        _STATEMENTS[key] = statement
+    return statement
+
+
+def _where_pattern(where_columns_dictionary):
+    """Returns the column names of a where clause and whether each value is NULL, the part of a cache key it sets."""
+    return tuple((column_name, value is None) for column_name, value in where_columns_dictionary.items())
+
+
+def _verify_table(cursor, table_name, message):
+    """Raises a ValueError with message if the table does not exist, remembering the tables that do."""
+    verified = getattr(cursor.connection, 'verified_tables', None)
+    if verified is not None and table_name in verified:
+        return
+    if not table_exists(cursor=cursor,
+                        table_name=table_name):
+        raise ValueError(message)
+    if verified is not None:
+        verified.add(table_name)
+
+
+def _execute(cursor, table_name, statement, values, message):
+    """
+    Executes a statement on a table checked with _verify_table().  If it
+    fails because the table was dropped since, the ValueError of a missing
+    table is raised instead.
+    """
+    try:
+        cursor.execute(statement, values)
+    except sqlite3.OperationalError:
+        verified = getattr(cursor.connection, 'verified_tables', None)
+        if verified is not None and table_name in verified:
+            verified.discard(table_name)
+            if not table_exists(cursor=cursor,
+                                table_name=table_name):
+                raise ValueError(message)
+        raise
 
 
 def table_exists(cursor, table_name):
@@ -108,18 +183,62 @@ def column_exists(cursor, table_name, column_name):
     return False
 
 
-def get_database_connection(file_path):
+def get_database_connection(file_path, write_profile=None):
     """
     Gets a Connection to an Sqlite Database
 
     :param file_path: path to the sqlite database
     :type file_path: str
 
+    :param write_profile: optional WriteProfile, or the name of one of the WRITE_PROFILES presets, applied to the
+                          connection before it is used
+    :type write_profile: WriteProfile or str
+
     :return: a connection to the database
     :rtype: Connection
     """
-    db_connection = connect(file_path)
+    db_connection = connect(file_path, factory=StatementCacheConnection)
     db_connection.row_factory = sqlite3.Row
+    write_profile = get_write_profile(write_profile)
+    if write_profile is not None:
+        write_profile.apply(db_connection)
+
+    return db_connection
+
+
+def get_read_only_connection(file_path, immutable=False, write_profile=READ_SERVING, check_same_thread=True):
+    """
+    Gets a read only Connection to an Sqlite Database, opened with a mode=ro URI filename.  Python versions without
+    URI filenames open the file normally and make the connection read only with the query_only pragma.
+
+    :param file_path: path to the sqlite database
+    :type file_path: str
+
+    :param immutable: True for a file that no process changes while it is open, such as a published GeoPackage,
+                      SQLite then reads it without any locking or change detection
+    :type immutable: bool
+
+    :param write_profile: optional WriteProfile, or the name of one of the WRITE_PROFILES presets, applied to the
+                          connection before it is used, read-serving by default
+    :type write_profile: WriteProfile or str
+
+    :param check_same_thread: False to let the connection be closed by another thread than the one that opened it
+    :type check_same_thread: bool
+
+    :return: a connection to the database
+    :rtype: Connection
+    """
+    uri = "file:{path}?mode=ro{immutable}".format(path=pathname2url(abspath(file_path)),
+                                                  immutable="&immutable=1" if immutable else "")
+    try:
+        db_connection = connect(uri, uri=True, check_same_thread=check_same_thread, factory=StatementCacheConnection)
+    except TypeError:
+        db_connection = connect(file_path, check_same_thread=check_same_thread, factory=StatementCacheConnection)
+        db_connection.execute("pragma query_only = 1;")
+    db_connection.row_factory = sqlite3.Row
+    write_profile = get_write_profile(write_profile)
+    if write_profile is not None:
+        write_profile.apply(db_connection)
 
     return db_connection
 
@@ -156,26 +275,32 @@ def select_query(cursor,
     """
 
     # check if the table exists before querying for rows
-    if not table_exists(cursor=cursor,
-                        table_name=table_name):
-        raise ValueError("Table must exist to select entries from it")
-
-    # check to make sure all the column names are not None or Empty
-    if any(column_name is None or len(column_name) == 0 for column_name in select_columns):
-        raise ValueError("The column names cannot be None or empty")
-
-    # create the query string
-    query_string = "SELECT {columns} " \
-                   "FROM '{table}' " \
-                   "WHERE {where_clause};".format(columns=', '.join(select_columns),
-                                                  table=table_name,
-                                                  where_clause=__build_where_clause(
-                                                      where_columns_dictionary=where_columns_dictionary))
+    message = "Table must exist to select entries from it"
+    _verify_table(cursor=cursor,
+                  table_name=table_name,
+                  message=message)
+
+    def build():
+        # check to make sure all the column names are not None or Empty
+        if any(column_name is None or len(column_name) == 0 for column_name in select_columns):
+            raise ValueError("The column names cannot be None or empty")
+
+        # create the query string
+        return "SELECT {columns} " \
+               "FROM '{table}' " \
+               "WHERE {where_clause};".format(columns=', '.join(select_columns),
+                                              table=table_name,
+                                              where_clause=__build_where_clause(
+                                                  where_columns_dictionary=where_columns_dictionary))
+
+    query_string = _get_statement(('select', table_name, tuple(select_columns),
+                                   _where_pattern(where_columns_dictionary)),
+                                  build)
 
     # build the parameterized list (?)
     values = [value for __, value in where_columns_dictionary.items() if value is not None]
 
-    cursor.execute(query_string, tuple(values))
+    _execute(cursor, table_name, query_string, tuple(values), message)
 
     # return the results of the select query
     return cursor.fetchall()
@@ -211,29 +336,34 @@ def update_row(cursor,
     """
 
     # check to see if the table exists
-    if not table_exists(cursor=cursor,
-                        table_name=table_name):
-        raise ValueError("Table must exist to update entries")
-
-    # check to make sure all the column names are not none or empty
-    if any(len(column_name) == 0 or column_name is None for column_name, __ in set_columns_dictionary.items()):
-        raise ValueError("The column names cannot be None or empty")
-
-    # build the update query string (which accounts for None/NULL values
-    query_string = "UPDATE '{table}' " \
-                   "SET {columns} " \
-                   "WHERE {where_clause};".format(columns=' = ?, '.join(set_columns_dictionary.keys()) + ' = ? ',
-                                                  table=table_name,
-                                                  where_clause=__build_where_clause(
-                                                      where_columns_dictionary=where_columns_dictionary))
+    message = "Table must exist to update entries"
+    _verify_table(cursor=cursor,
+                  table_name=table_name,
+                  message=message)
+
+    def build():
+        # check to make sure all the column names are not none or empty
+        if any(len(column_name) == 0 or column_name is None for column_name, __ in set_columns_dictionary.items()):
+            raise ValueError("The column names cannot be None or empty")
+
+        # build the update query string (which accounts for None/NULL values
+        return "UPDATE '{table}' " \
+               "SET {columns} " \
+               "WHERE {where_clause};".format(columns=' = ?, '.join(set_columns_dictionary.keys()) + ' = ? ',
+                                              table=table_name,
+                                              where_clause=__build_where_clause(
+                                                  where_columns_dictionary=where_columns_dictionary))
+
+    query_string = _get_statement(('update', table_name, tuple(set_columns_dictionary.keys()),
+                                   _where_pattern(where_columns_dictionary)),
+                                  build)
 
     # the parameterized values in the query (?)
     values = [value for value in set_columns_dictionary.values()] + \
              [value for value in where_columns_dictionary.values() if value is not None]
 
     # execute the query
-    cursor.execute(query_string,
-                   tuple(values))
+    _execute(cursor, table_name, query_string, tuple(values), message)
 
 
 def insert_row(cursor,
@@ -256,20 +386,22 @@ def insert_row(cursor,
     :type sql_columns_list:  list of SqlColumnQuery
     """
     # check to see if the table exists
-    if not table_exists(cursor=cursor,
-                        table_name=table_name):
-        raise ValueError("Table must exist to update entries")
-
-    insert_query = "INSERT INTO '{table_name}' " \
-                   " ({column_names}) " \
-                   "VALUES ({question_marks});".format(table_name=table_name,
-                                                       column_names=', '.join(
-                                                           [column.column_name for column in sql_columns_list]),
-                                                       question_marks=', '.join(['?' for _ in sql_columns_list]))
+    message = "Table must exist to update entries"
+    _verify_table(cursor=cursor,
+                  table_name=table_name,
+                  message=message)
+
+    column_names = tuple(column.column_name for column in sql_columns_list)
+    insert_query = _get_statement(('insert', table_name, column_names),
+                                  lambda: "INSERT INTO '{table_name}' "
+                                          " ({column_names}) "
+                                          "VALUES ({question_marks});".format(table_name=table_name,
+                                                                              column_names=', '.join(column_names),
+                                                                              question_marks=', '.join(
+                                                                                  ['?' for _ in column_names])))
     values = [column.column_value for column in sql_columns_list]
 
-    cursor.execute(insert_query,
-                   tuple(values))
+    _execute(cursor, table_name, insert_query, tuple(values), message)
 
     return cursor.lastrowid
 
@@ -297,6 +429,10 @@ def insert_or_update_row(cursor,
     ensure that all columns that are part of that unique constraint are marked with "include_in_where_clause"
     :type sql_columns_list:  list of SqlColumnQuery
     """
+    if upsert_row(cursor=cursor,
+                  table_name=table_name,
+                  sql_columns_list=sql_columns_list):
+        return
 
     existing_row = select_query(cursor=cursor,
                                 table_name=table_name,
@@ -327,6 +463,74 @@ def insert_or_update_row(cursor,
                                              if column.include_in_where_clause})
 
 
+def upsert_row(cursor,
+               table_name,
+               sql_columns_list):
+    """
+    Inserts a new row, or updates the row it conflicts with, in a single INSERT ... ON CONFLICT DO UPDATE statement.
+    The columns included in the where clause have to be the columns of a PRIMARY KEY or UNIQUE constraint of the
+    table.  Upserts need SQLite 3.24.0 or later, and cannot find a row whose where clause values are NULL, since
+    SQLite does not check the uniqueness of NULL values.
+
+    :param cursor: the cursor to the database's connection
+    :type cursor: Cursor
+
+    :param table_name: the name of the table updating the row from
+    :type table_name: str
+
+    :param sql_columns_list: the list of columns of interest for the sql query, see insert_or_update_row()
+    :type sql_columns_list:  list of SqlColumnQuery
+
+    :return: True if the row was upserted, False if it could not be and insert_or_update_row() has to look it up
+    :rtype: bool
+    """
+    if sqlite3.sqlite_version_info < UPSERT_MINIMUM_SQLITE_VERSION:
+        return False
+
+    where_names = tuple(column.column_name for column in sql_columns_list if column.include_in_where_clause)
+    if len(where_names) == 0 or any(column.column_value is None
+                                    for column in sql_columns_list
+                                    if column.include_in_where_clause):
+        return False
+
+    column_names = tuple(column.column_name for column in sql_columns_list)
+    key = ('upsert', table_name, column_names, where_names)
+    no_upsert = getattr(cursor.connection, 'no_upsert', None)
+    if no_upsert is not None and key in no_upsert:
+        return False
+
+    message = "Table must exist to select entries from it"
+    _verify_table(cursor=cursor,
+                  table_name=table_name,
+                  message=message)
+
+    def build():
+        update_names = [column_name for column_name in column_names if column_name not in where_names]
+        return "INSERT INTO '{table_name}' " \
+               " ({column_names}) " \
+               "VALUES ({question_marks}) " \
+               "ON CONFLICT ({where_names}) {action};".format(table_name=table_name,
+                                                              column_names=', '.join(column_names),
+                                                              question_marks=', '.join(['?' for _ in column_names]),
+                                                              where_names=', '.join(where_names),
+                                                              action="DO UPDATE SET " + ', '.join(
+                                                                  "{0} = excluded.{0}".format(column_name)
+                                                                  for column_name in update_names)
+                                                              if update_names else "DO NOTHING")
+
+    upsert_query = _get_statement(key, build)
+    try:
+        _execute(cursor, table_name, upsert_query, tuple(column.column_value for column in sql_columns_list), message)
+    except sqlite3.OperationalError as error:
+        # the where clause columns are not a PRIMARY KEY or UNIQUE constraint of the table
+        if "ON CONFLICT" not in str(error):
+            raise
+        if no_upsert is not None:
+            no_upsert.add(key)
+        return False
+    return True
+
+
 def __build_where_clause(where_columns_dictionary):
     """
     Builds the where portion of the SQL query to account for None values
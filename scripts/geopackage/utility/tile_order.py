@@ -0,0 +1,112 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Authors:
+    Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3
+Description: Space filling curve keys over (tile_column, tile_row), used to
+ store the tiles of a zoom level so that neighbouring tiles share SQLite
+ pages.
+
+Version:
+"""
+
+# Bits per coordinate, tile columns and rows are non-negative 32 bit integers
+CURVE_BITS = 31
+
+ZORDER = 'zorder'
+HILBERT = 'hilbert'
+
+# SQL function registered on a connection for every tile order
+TILE_ORDER_FUNCTIONS = {ZORDER: 'zorder_key', HILBERT: 'hilbert_key'}
+
+
+def _spread_bits(value):
+    """Moves bit i of a 32 bit value to bit 2 * i."""
+    value &= 0xFFFFFFFF
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    return (value | (value << 1)) & 0x5555555555555555
+
+
+def zorder_key(column, row):
+    """
+    Returns the Z-order (Morton) key of a tile, the bits of column and row
+    interleaved.
+
+    :param column: the tile column
+    :type column: int
+
+    :param row: the tile row
+    :type row: int
+
+    :return: the position of the tile on the Z-order curve
+    :rtype: int
+    """
+    return _spread_bits(column) | (_spread_bits(row) << 1)
+
+
+def hilbert_key(column, row):
+    """
+    Returns the position of a tile on the Hilbert curve filling a square of
+    2 ** CURVE_BITS tiles a side.  Unlike Z-order, consecutive keys are
+    always neighbouring tiles.
+
+    :param column: the tile column
+    :type column: int
+
+    :param row: the tile row
+    :type row: int
+
+    :return: the position of the tile on the Hilbert curve
+    :rtype: int
+    """
+    x, y = column, row
+    used_bits = max(x, y).bit_length()
+    # every unused high level only swaps x and y, apply them all at once
+    if (CURVE_BITS - used_bits) % 2:
+        x, y = y, x
+    key = 0
+    side = 1 << (used_bits - 1) if used_bits else 0
+    while side:
+        rx = 1 if x & side else 0
+        ry = 1 if y & side else 0
+        key += side * side * ((3 * rx) ^ ry)
+        if not ry:
+            if rx:
+                # only the bits below side are looked at from here on
+                x, y = ~x, ~y
+            x, y = y, x
+        side >>= 1
+    return key
+
+
+def register_tile_order_functions(connection):
+    """
+    Registers the zorder_key(tile_column, tile_row) and
+    hilbert_key(tile_column, tile_row) SQL functions on a connection.
+
+    :param connection: the connection to the database
+    :type connection: Connection
+    """
+    connection.create_function(TILE_ORDER_FUNCTIONS[ZORDER], 2, zorder_key)
+    connection.create_function(TILE_ORDER_FUNCTIONS[HILBERT], 2, hilbert_key)
@@ -0,0 +1,183 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Authors:
+    Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3
+Description: SQLite settings applied to a connection when it is opened,
+ with presets for bulk loading, durable writes and serving reads.
+
+Version:
+"""
+
+BULK_LOAD = 'bulk-load'
+SAFE = 'safe'
+READ_SERVING = 'read-serving'
+
+# Page sizes SQLite accepts, any other value is silently ignored
+VALID_PAGE_SIZES = tuple(2 ** power for power in range(9, 17))
+
+
+class WriteProfile(object):
+    """
+    A set of SQLite PRAGMA settings applied by get_database_connection() as
+    soon as a connection is opened.  Settings left as None keep the SQLite
+    default.
+    """
+
+    def __init__(self,
+                 page_size=None,
+                 cache_size=None,
+                 mmap_size=None,
+                 temp_store=None,
+                 locking_mode=None,
+                 journal_mode=None,
+                 synchronous=None):
+        """
+        Constructor.
+
+        :param page_size: the database page size in bytes, only used when the
+                          database is created, so it is set before any table
+        :type page_size: int
+
+        :param cache_size: the page cache size, in pages, or in KiB if negative
+        :type cache_size: int
+
+        :param mmap_size: the number of bytes of the file read through memory mapping
+        :type mmap_size: int
+
+        :param temp_store: where temporary tables and indices are kept, 'FILE' or 'MEMORY'
+        :type temp_store: str
+
+        :param locking_mode: 'NORMAL' or 'EXCLUSIVE', an exclusive connection keeps its
+                             locks until it is closed and no other connection can use the file
+        :type locking_mode: str
+
+        :param journal_mode: the rollback journal mode, e.g. 'OFF', 'DELETE' or 'WAL'
+        :type journal_mode: str
+
+        :param synchronous: 'OFF', 'NORMAL' or 'FULL'
+        :type synchronous: str
+        """
+        if page_size is not None and page_size not in VALID_PAGE_SIZES:
+            raise ValueError("page_size must be a power of two between 512 and 65536, not {0}".format(page_size))
+        self.page_size = page_size
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.temp_store = temp_store
+        self.locking_mode = locking_mode
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+
+    def pragmas(self):
+        """
+        Returns the PRAGMA statements of this profile.  page_size comes first
+        since it has to be set before the first table is created, and before
+        the journal mode in case it is WAL.
+
+        :return: the statements, in the order they have to run
+        :rtype: list of str
+        """
+        settings = [('page_size', self.page_size),
+                    ('cache_size', self.cache_size),
+                    ('mmap_size', self.mmap_size),
+                    ('temp_store', self.temp_store),
+                    ('locking_mode', self.locking_mode),
+                    ('journal_mode', self.journal_mode),
+                    ('synchronous', self.synchronous)]
+        return ["pragma {0} = {1};".format(name, value) for name, value in settings if value is not None]
+
+    def apply(self, connection):
+        """
+        Runs the PRAGMA statements of this profile on a connection.
+
+        :param connection: a connection outside of any transaction, usually a new one
+        :type connection: Connection
+        """
+        cursor = connection.cursor()
+        for statement in self.pragmas():
+            cursor.execute(statement)
+        cursor.close()
+
+    def copy(self, **changes):
+        """
+        Returns a copy of this profile with some settings changed.
+
+        :param changes: the settings to change, see the constructor
+        :return: the new profile
+        :rtype: WriteProfile
+        """
+        settings = dict(page_size=self.page_size,
+                        cache_size=self.cache_size,
+                        mmap_size=self.mmap_size,
+                        temp_store=self.temp_store,
+                        locking_mode=self.locking_mode,
+                        journal_mode=self.journal_mode,
+                        synchronous=self.synchronous)
+        settings.update(changes)
+        return WriteProfile(**settings)
+
+    def journaled(self):
+        """
+        Returns this profile if it keeps a rollback journal on disk and
+        syncs it, otherwise a copy that does.  Used for files that already
+        hold data when they are opened, since an interrupted transaction
+        that cannot be rolled back leaves such a file corrupt.
+
+        :return: the profile
+        :rtype: WriteProfile
+        """
+        if (self.journal_mode or '').upper() in ('OFF', 'MEMORY') or (self.synchronous or '').upper() == 'OFF':
+            return self.copy(journal_mode='DELETE', synchronous='FULL')
+        return self
+
+
+WRITE_PROFILES = {
+    # A file written once by a single connection, e.g. a .gpkg.part file or
+    # the output of a packaging run that is thrown away if it fails
+    BULK_LOAD: WriteProfile(page_size=65536,
+                            cache_size=-65536,
+                            temp_store='MEMORY',
+                            locking_mode='EXCLUSIVE',
+                            journal_mode='OFF',
+                            synchronous='OFF'),
+    # Every committed transaction survives a crash or power loss
+    SAFE: WriteProfile(journal_mode='DELETE',
+                       synchronous='FULL'),
+    # Many reads of a file that is not being written
+    READ_SERVING: WriteProfile(cache_size=-65536,
+                               mmap_size=268435456,
+                               temp_store='MEMORY')
+}
+
+
+def get_write_profile(profile):
+    """
+    Returns a WriteProfile from a preset name, a WriteProfile or None.
+
+    :param profile: None, the name of a preset in WRITE_PROFILES or a WriteProfile
+    :return: the profile, or None
+    :rtype: WriteProfile
+    """
+    if profile is None or isinstance(profile, WriteProfile):
+        return profile
+    if profile not in WRITE_PROFILES:
+        raise ValueError("Unknown write profile {0}, expected one of {1}".format(profile, sorted(WRITE_PROFILES)))
+    return WRITE_PROFILES[profile]
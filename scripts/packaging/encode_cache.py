@@ -0,0 +1,103 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: hashlib
+Description: Byte bounded cache of encoded tiles keyed by a hash of their
+ source file, so identical source tiles (ocean, nodata, solid colours) are
+ only decoded and encoded once per worker process.
+
+Version:
+"""
+
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+
+# Encoded bytes kept per worker process
+DEFAULT_ENCODE_CACHE_BYTES = 64 * 1024 * 1024
+# Rough cost of a cache entry besides its encoded bytes
+ENTRY_OVERHEAD = 128
+
+_MISSING = object()
+
+
+class EncodeCache(object):
+    """
+    Least recently used cache of encoder results keyed by the SHA-1 of the
+    source bytes and the encoder arguments.  The total size of the cached
+    results is kept under max_bytes.  It can be shared by threads, the
+    encoder itself runs outside of the lock.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_ENCODE_CACHE_BYTES):
+        """
+        Constructor.
+
+        Inputs:
+        max_bytes -- the most bytes of encoded tiles held at once
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    @staticmethod
+    def __entry_size(value):
+        return ENTRY_OVERHEAD + (len(value) if value is not None else 0)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def encode(self, data, encoder, *args):
+        """
+        Returns encoder(data, *args), reusing the result of an earlier call
+        with the same source bytes and arguments when it is still cached.
+
+        Inputs:
+        data -- the source file bytes
+        encoder -- the function encoding them, its result may be None
+        args -- any other arguments of encoder, part of the cache key
+        """
+        key = (sha1(data).digest(),) + args
+        with self.__lock:
+            value = self.__entries.pop(key, _MISSING)
+            if value is not _MISSING:
+                # re-inserted as the most recently used entry
+                self.__entries[key] = value
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = encoder(data, *args)
+        size = self.__entry_size(value)
+        if size <= self.max_bytes:
+            with self.__lock:
+                # another thread may have encoded the same tile meanwhile
+                previous = self.__entries.pop(key, _MISSING)
+                if previous is not _MISSING:
+                    self.size -= self.__entry_size(previous)
+                self.__entries[key] = value
+                self.size += size
+                while self.size > self.max_bytes:
+                    _, evicted = self.__entries.popitem(last=False)
+                    self.size -= self.__entry_size(evicted)
+        return value
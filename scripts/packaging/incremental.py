@@ -0,0 +1,184 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3
+Description: Side table recording the source file of every tile packaged by
+ an incremental tiles2gpkg run, with its path, size and modification time,
+ so the next run only encodes the tiles whose source changed and removes
+ the tiles whose source is gone.
+
+Version:
+"""
+
+from multiprocessing.pool import ThreadPool
+from os import stat
+
+from scripts.packaging.tile_discovery import DEFAULT_IO_THREADS
+
+# Not prefixed with gpkg_, that prefix is reserved by the GeoPackage specification
+SOURCES_TABLE_NAME = "tiles2gpkg_sources"
+
+
+def has_table(gpkg, table_name):
+    """Returns whether the geopackage holds a table named table_name."""
+    result = gpkg.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?;", (table_name,))
+    return result.fetchone()[0] > 0
+
+
+def create_sources_table(gpkg):
+    """Creates the sources side table in a geopackage if it does not have one yet."""
+    gpkg.execute("""
+                    CREATE TABLE IF NOT EXISTS {0}
+                    (table_name  TEXT    NOT NULL,
+                     zoom_level  INTEGER NOT NULL,
+                     tile_column INTEGER NOT NULL,
+                     tile_row    INTEGER NOT NULL,
+                     path        TEXT    NOT NULL,
+                     size        INTEGER NOT NULL,
+                     mtime       REAL    NOT NULL,
+                     PRIMARY KEY (table_name, zoom_level, tile_column, tile_row));
+                 """.format(SOURCES_TABLE_NAME))
+
+
+def read_sources(gpkg, table_name):
+    """
+    Reads the sources recorded for a tiles table.
+
+    Inputs:
+    gpkg -- the Geopackage, or None for a geopackage that does not exist yet
+    table_name -- the name of the tiles table
+
+    Returns:
+    A dictionary of (zoom_level, tile_column, tile_row) tile keys, as stored
+    in the tiles table, to (path, size, mtime) tuples.
+    """
+    if gpkg is None or not has_table(gpkg, SOURCES_TABLE_NAME):
+        return {}
+    result = gpkg.execute("""SELECT zoom_level, tile_column, tile_row, path, size, mtime FROM {0}
+                             WHERE table_name = ?;""".format(SOURCES_TABLE_NAME), (table_name,))
+    return dict(((z, x, y), (path, size, mtime)) for z, x, y, path, size, mtime in result.fetchall())
+
+
+def _stat_source(path):
+    """Returns the (size, mtime) of a file."""
+    status = stat(path)
+    return status.st_size, status.st_mtime
+
+
+def stat_sources(paths, io_threads=DEFAULT_IO_THREADS):
+    """
+    Reads the size and modification time of every source file.  The calls
+    are I/O bound, so they are spread over a thread pool like the directory
+    scans of discover_tiles().
+
+    Inputs:
+    paths -- a list of file paths
+    io_threads -- the number of files looked at the same time
+
+    Returns:
+    A list of (size, mtime) tuples in the order of paths.
+    """
+    pool = ThreadPool(max(1, io_threads))
+    try:
+        return pool.map(_stat_source, paths, chunksize=256)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def read_tile_keys(gpkg, table_name):
+    """Returns the set of (zoom_level, tile_column, tile_row) keys of the tiles in a tiles table."""
+    result = gpkg.execute("""SELECT zoom_level, tile_column, tile_row FROM "{0}";""".format(table_name))
+    return set(tuple(row) for row in result.fetchall())
+
+
+def compare_sources(keys, paths, stats, stored, tile_keys):
+    """
+    Compares the source files found by this run with the ones recorded.
+
+    Inputs:
+    keys -- the (zoom_level, tile_column, tile_row) key every source file is
+            stored under in the tiles table
+    paths -- the path of every source file
+    stats -- the (size, mtime) of every source file, see stat_sources()
+    stored -- the recorded sources, see read_sources()
+    tile_keys -- the keys of the tiles in the tiles table, see read_tile_keys()
+
+    Returns:
+    A (positions, vanished) tuple: the positions in keys of the new or
+    changed sources, and the keys of the tiles no source maps to anymore.
+    """
+    positions = []
+    current = set()
+    for position, (key, path, (size, mtime)) in enumerate(zip(keys, paths, stats)):
+        current.add(key)
+        if stored.get(key) != (path, size, mtime):
+            positions.append(position)
+    vanished = sorted(tile_keys - current)
+    return positions, vanished
+
+
+def remove_tiles(gpkg, table_name, keys):
+    """
+    Deletes tiles, and their recorded sources first.  If the run stops in
+    between, the next one sees those sources as new and writes their tiles
+    again, and tiles without a source are found by read_tile_keys().
+
+    Inputs:
+    gpkg -- the Geopackage
+    table_name -- the name of the tiles table
+    keys -- a list of (zoom_level, tile_column, tile_row) tuples
+
+    Returns:
+    The number of tiles deleted.
+    """
+    if has_table(gpkg, SOURCES_TABLE_NAME):
+        gpkg.executemany("""DELETE FROM {0} WHERE table_name = ?
+                            AND zoom_level = ? AND tile_column = ? AND tile_row = ?;""".format(SOURCES_TABLE_NAME),
+                         ((table_name,) + tuple(key) for key in keys))
+    cursor = gpkg.executemany("""DELETE FROM "{0}" WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?;"""
+                              .format(table_name), keys)
+    return cursor.rowcount
+
+
+def record_sources(gpkg, table_name, sources):
+    """
+    Records the sources of the tiles written by this run.
+
+    Inputs:
+    gpkg -- the Geopackage
+    table_name -- the name of the tiles table
+    sources -- (zoom_level, tile_column, tile_row, path, size, mtime) tuples
+    """
+    create_sources_table(gpkg)
+    gpkg.executemany("""INSERT OR REPLACE INTO {0} (table_name, zoom_level, tile_column, tile_row, path, size, mtime)
+                        VALUES (?, ?, ?, ?, ?, ?, ?);""".format(SOURCES_TABLE_NAME),
+                     ((table_name,) + tuple(source) for source in sources))
+
+
+def remove_zoom_levels(gpkg, table_name, zoom_levels):
+    """
+    Deletes the gpkg_tile_matrix rows of a tiles table whose zoom level is
+    not in zoom_levels anymore, after every source of that level is gone.
+    """
+    zoom_levels = sorted(zoom_levels)
+    gpkg.execute("""DELETE FROM gpkg_tile_matrix WHERE table_name = ? AND zoom_level NOT IN ({0});"""
+                 .format(", ".join("?" * len(zoom_levels))), [table_name] + zoom_levels)
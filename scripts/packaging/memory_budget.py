@@ -0,0 +1,171 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: multiprocessing
+Description: Bounds the bytes of encoded tiles held in memory by the
+ packaging engines, so adding workers raises throughput without the
+ machine running out of memory.
+
+Version:
+"""
+
+from ctypes import c_longlong
+from multiprocessing import Condition, Value
+
+
+class ByteBudget(object):
+    """
+    Number of bytes shared by processes.  acquire() blocks until the bytes
+    asked for fit in what is left, and release() gives them back.  A
+    single request larger than the whole budget is let through once
+    nothing else is held, so it can never block forever.
+    """
+
+    def __init__(self, limit):
+        """
+        Constructor.
+
+        Inputs:
+        limit -- the number of bytes that can be held at the same time
+        """
+        self.limit = limit
+        # the 'q' typecode is missing from Python 2
+        self.__held = Value(c_longlong, 0, lock=False)
+        self.__condition = Condition()
+
+    def acquire(self, size):
+        """Waits until size bytes are available and takes them."""
+        with self.__condition:
+            while self.__held.value > 0 and self.__held.value + size > self.limit:
+                self.__condition.wait()
+            self.__held.value += size
+
+    def release(self, size):
+        """Gives back size bytes taken with acquire()."""
+        with self.__condition:
+            self.__held.value -= size
+            self.__condition.notify_all()
+
+    @property
+    def held(self):
+        """The number of bytes currently held."""
+        with self.__condition:
+            return self.__held.value
+
+
+def byte_batches(tiles, commit_size, commit_bytes):
+    """
+    Groups tiles into lists of at most commit_size tiles holding at most
+    commit_bytes bytes of tile data, at least one tile per list.
+
+    Inputs:
+    tiles -- an iterable of (z, x, y, data) tuples
+    commit_size -- the largest number of tiles in a list
+    commit_bytes -- the largest number of bytes in a list
+    """
+    batch, size = [], 0
+    for tile in tiles:
+        if batch and (len(batch) == commit_size or size + len(tile[3]) > commit_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(tile)
+        size += len(tile[3])
+    if batch:
+        yield batch
+
+
+def bounded_insert(insert, commit_bytes=None):
+    """
+    Wraps an insert(tiles, commit_size) function, such as
+    TempDB.insert_image_blobs, so that every transaction also holds at most
+    commit_bytes bytes of tile data.
+
+    Returns:
+    The wrapped function, insert itself when commit_bytes is None.
+    """
+    if commit_bytes is None:
+        return insert
+
+    def insert_bounded(tiles, commit_size):
+        count = 0
+        for batch in byte_batches(tiles, commit_size, commit_bytes):
+            count += insert(batch, len(batch))
+        return count
+    return insert_bounded
+
+
+class ReleasingWriter(object):
+    """
+    Writes tiles whose bytes were taken from a ByteBudget, and gives the
+    bytes of every transaction back once it is committed, so the budget
+    covers the tiles waiting to be written as well as the queued ones.
+    Transactions hold at most commit_size tiles and commit_bytes bytes.
+    """
+
+    def __init__(self, insert, budget, commit_bytes=None):
+        """
+        Constructor.
+
+        Inputs:
+        insert -- an insert(tiles, commit_size) function, such as
+                  Geopackage.insert_tiles, writing a list of at most
+                  commit_size tiles in a single transaction
+        budget -- the ByteBudget the bytes of the tiles were taken from
+        commit_bytes -- the largest number of bytes per transaction, half
+                        of the budget by default, so the workers keep
+                        encoding while a transaction is filled
+        """
+        self.__insert = insert
+        self.__budget = budget
+        self.commit_bytes = budget.limit // 2 if commit_bytes is None else commit_bytes
+        self.__pending = []
+        self.__pending_bytes = 0
+
+    def write(self, tiles, commit_size):
+        """
+        Writes tiles, to be used as the insert function of time_insert().
+
+        Inputs:
+        tiles -- an iterable of (z, x, y, data) tuples
+        commit_size -- the largest number of tiles per transaction
+
+        Returns:
+        The number of tiles written.
+        """
+        count = 0
+        for tile in tiles:
+            self.__pending.append(tile)
+            self.__pending_bytes += len(tile[3])
+            count += 1
+            if len(self.__pending) >= commit_size or self.__pending_bytes >= self.commit_bytes:
+                self.flush()
+        self.flush()
+        return count
+
+    def flush(self):
+        """
+        Writes the tiles held so far and gives their bytes back, e.g. when
+        the workers may all be waiting on the budget.
+        """
+        if self.__pending:
+            self.__insert(self.__pending, len(self.__pending))
+            self.__budget.release(self.__pending_bytes)
+            self.__pending, self.__pending_bytes = [], 0
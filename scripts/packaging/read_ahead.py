@@ -0,0 +1,139 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: multiprocessing
+Description: Reads the source files of the tiles a worker is about to
+ encode ahead of time on a small thread pool, so the file reads of the
+ next tiles overlap with the encoding and writing of the current one.
+ Mostly useful on network file systems, where every read waits on a
+ round trip.
+
+Version:
+"""
+
+from collections import deque
+from io import FileIO
+from multiprocessing.pool import ThreadPool
+from os import fstat
+from os.path import realpath
+
+from scripts.packaging.tile_discovery import DEFAULT_IO_THREADS
+
+# File system types whose reads go over the network, see /proc/mounts
+NETWORK_FILE_SYSTEMS = frozenset(['nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'ncpfs', 'afs', '9p', 'ceph', 'lustre',
+                                  'glusterfs', 'fuse.glusterfs', 'fuse.sshfs', 'fuse.s3fs', 'fuse.gcsfuse'])
+# Files read ahead by each worker when the tiles are on a network file system
+NETWORK_READ_AHEAD = 32
+
+
+def read_file(path):
+    """
+    Returns the bytes of the file at path as a bytearray.  The file is read
+    without buffering straight into a bytearray of its size, so every tile
+    costs a single allocation, and a memoryview or sqlite3.Binary of the
+    result is bound to the insert statement without another copy.
+    """
+    with FileIO(path) as file_handle:
+        data = bytearray(fstat(file_handle.fileno()).st_size)
+        filled = file_handle.readinto(data)
+        if filled < len(data):
+            # a short read, the rest is read into the end of the bytearray
+            view = memoryview(data)
+            while filled < len(data):
+                count = file_handle.readinto(view[filled:])
+                if not count:
+                    break
+                filled += count
+            del view
+            # the file shrank since fstat()
+            del data[filled:]
+    return data
+
+
+def read_ahead(items, read, depth, threads=None):
+    """
+    Generator yielding an (item, read(item)) tuple for every item, in
+    order.  With a depth, the reads of up to depth items after the one
+    yielded are already running on a thread pool.
+
+    Inputs:
+    items -- an iterable of items, such as tile dictionaries
+    read -- the function reading an item, called on the thread pool
+    depth -- the number of items read ahead, 0 or None reads every item
+             when it is yielded
+    threads -- the largest number of reads running at the same time,
+               DEFAULT_IO_THREADS by default
+    """
+    if not depth:
+        for item in items:
+            yield item, read(item)
+        return
+    pool = ThreadPool(min(depth, threads or DEFAULT_IO_THREADS))
+    try:
+        pending = deque()
+        for item in items:
+            pending.append((item, pool.apply_async(read, (item,))))
+            if len(pending) > depth:
+                item, result = pending.popleft()
+                yield item, result.get()
+        while pending:
+            item, result = pending.popleft()
+            yield item, result.get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _unescape_mount(path):
+    """Decodes the octal escapes of the spaces, tabs and backslashes in /proc/mounts."""
+    return path.replace('\\040', ' ').replace('\\011', '\t').replace('\\012', '\n').replace('\\134', '\\')
+
+
+def get_file_system_type(path, mounts_path='/proc/mounts'):
+    """
+    Returns the type of the file system path is on, as listed in
+    mounts_path, or None where it cannot be told, e.g. outside Linux.
+    """
+    try:
+        with open(mounts_path) as mounts:
+            entries = [line.split() for line in mounts]
+    except (IOError, OSError):
+        return None
+    path = realpath(path)
+    best, best_type = '', None
+    for entry in entries:
+        if len(entry) < 3:
+            continue
+        mount_point = _unescape_mount(entry[1]).rstrip('/') + '/'
+        if (path + '/').startswith(mount_point) and len(mount_point) > len(best):
+            best, best_type = mount_point, entry[2]
+    return best_type
+
+
+def get_read_ahead(path, mounts_path='/proc/mounts'):
+    """
+    Returns the default number of files read ahead for tiles in the folder
+    at path: NETWORK_READ_AHEAD on a network file system, 0 otherwise, as
+    local reads of small files rarely wait long enough to gain from it.
+    """
+    if get_file_system_type(path, mounts_path) in NETWORK_FILE_SYSTEMS:
+        return NETWORK_READ_AHEAD
+    return 0
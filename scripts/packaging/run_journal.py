@@ -0,0 +1,216 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3
+Description: Journal of a parts engine run of tiles2gpkg.  It records the
+ chunks the tiles are cut into and the ones whose .gpkg.part file is
+ complete, so a run that was interrupted or failed can be started again
+ and only encodes the chunks that are missing.
+
+Version:
+"""
+
+from glob import glob
+from hashlib import sha1
+from json import dumps
+from os import remove
+from os.path import basename, exists, join
+
+from scripts.geopackage.utility.sql_utility import get_database_connection
+from scripts.geopackage.utility.write_profile import SAFE
+
+# Extension of the journal file, written next to the output geopackage
+JOURNAL_EXTENSION = '.journal'
+
+ENCODE = 'encode'
+MERGE = 'merge'
+
+
+def make_run_id(file_list, settings, stats=()):
+    """
+    Returns the identifier of a run, the same for every run packaging the
+    same tiles from the same source files with the same settings, so a run
+    started again finds the journal and the parts of the one it resumes.
+    A source file that was rewritten in between changes the identifier,
+    and the parts encoded from the old file are not merged.
+
+    Inputs:
+    file_list -- the TileIndex or list of tile dictionaries being packaged
+    settings -- a dictionary of the options the tiles are encoded with,
+                serializable as JSON
+    stats -- the (size, mtime) of the source file of every tile, in the
+             order of file_list, see stat_sources()
+
+    Returns:
+    A 16 character hexadecimal string.
+    """
+    digest = sha1(dumps(settings, sort_keys=True).encode('utf-8'))
+    if hasattr(file_list, 'zooms'):
+        for values in (file_list.zooms, file_list.columns, file_list.rows):
+            digest.update(values.tobytes() if hasattr(values, 'tobytes') else values.tostring())
+    else:
+        for item in file_list:
+            digest.update("{z}/{x}/{y}\n".format(**item).encode('utf-8'))
+    for size, mtime in stats:
+        digest.update("{0} {1!r}\n".format(size, mtime).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class RunJournal(object):
+    """
+    SQLite journal of the chunks of a run.  Every chunk is written to the
+    .gpkg.part file named after the run and the chunk, and is only trusted
+    once commit() recorded it: a part left by a worker that died, or by a
+    run that was killed before recording it, is removed by clean() and the
+    chunk is encoded again.  Parts named after any other run are never
+    merged.
+    """
+
+    def __enter__(self):
+        """With-statement caller."""
+        return self
+
+    def __init__(self, file_path, run_id):
+        """
+        Constructor.  Opens the journal at file_path, or creates it.  If it
+        belongs to another run, that run is forgotten and its parts are left
+        for clean() to remove.
+
+        Inputs:
+        file_path -- the journal file, see journal_path()
+        run_id -- the identifier of this run, see make_run_id()
+        """
+        self.file_path = file_path
+        self.run_id = run_id
+        # every commit has to survive the crash the journal is there for
+        self.__db_con = get_database_connection(file_path, SAFE)
+        with self.__db_con as db_con:
+            db_con.execute("CREATE TABLE IF NOT EXISTS run (key TEXT PRIMARY KEY, value TEXT);")
+            db_con.execute("""CREATE TABLE IF NOT EXISTS chunks
+                              (chunk INTEGER PRIMARY KEY,
+                               start INTEGER NOT NULL,
+                               stop INTEGER NOT NULL,
+                               committed INTEGER NOT NULL DEFAULT 0);""")
+        previous = self.__get('run_id')
+        self.previous_run_id = previous if previous != run_id else None
+        self.resumed = previous == run_id
+        if not self.resumed:
+            # in one transaction, a journal is never left with a run_id and no state
+            with self.__db_con as db_con:
+                db_con.execute("DELETE FROM chunks;")
+                db_con.execute("DELETE FROM run;")
+                db_con.executemany("INSERT INTO run (key, value) VALUES (?, ?);",
+                                   (('run_id', run_id), ('state', ENCODE)))
+
+    @staticmethod
+    def journal_path(output_file):
+        """Returns the path of the journal of a run writing output_file."""
+        return output_file + JOURNAL_EXTENSION
+
+    def __get(self, key):
+        """Returns a value of the run table, or None."""
+        row = self.__db_con.execute("SELECT value FROM run WHERE key = ?;", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def __set(self, key, value):
+        """Writes a value of the run table."""
+        with self.__db_con as db_con:
+            db_con.execute("INSERT OR REPLACE INTO run (key, value) VALUES (?, ?);", (key, value))
+
+    @property
+    def state(self):
+        """
+        ENCODE while chunks are encoded, MERGE once the parts are being
+        merged into the output.  A journal without any state has not merged
+        anything, so the run starts from the beginning.
+        """
+        return self.__get('state') or ENCODE
+
+    @state.setter
+    def state(self, value):
+        self.__set('state', value)
+
+    def plan(self, ranges):
+        """
+        Records the chunks of this run, unless it is resumed, in which case
+        the chunks recorded by the first attempt are kept.
+
+        Inputs:
+        ranges -- the (start, stop) range of every chunk
+
+        Returns:
+        A list of the (chunk, start, stop) tuples that are not committed.
+        """
+        with self.__db_con as db_con:
+            if db_con.execute("SELECT count(*) FROM chunks;").fetchone()[0] == 0:
+                db_con.executemany("INSERT INTO chunks (chunk, start, stop) VALUES (?, ?, ?);",
+                                   ((chunk, start, stop) for chunk, (start, stop) in enumerate(ranges)))
+        return [tuple(row) for row in
+                self.__db_con.execute("SELECT chunk, start, stop FROM chunks WHERE committed = 0 ORDER BY chunk;")]
+
+    def commit(self, chunk):
+        """Records that the part of chunk is complete."""
+        with self.__db_con as db_con:
+            db_con.execute("UPDATE chunks SET committed = 1 WHERE chunk = ?;", (chunk,))
+
+    def committed(self):
+        """Returns the sorted list of the committed chunks."""
+        return [row[0] for row in self.__db_con.execute("SELECT chunk FROM chunks WHERE committed = 1 ORDER BY chunk;")]
+
+    def part_name(self, chunk):
+        """Returns the .gpkg.part file name of a chunk of this run."""
+        return "{0}-{1:06d}.gpkg.part".format(self.run_id, chunk)
+
+    def part_paths(self, folder):
+        """Returns the paths of the committed parts of this run that are still in folder."""
+        paths = (join(folder, self.part_name(chunk)) for chunk in self.committed())
+        return [path for path in paths if exists(path)]
+
+    def clean(self, folder):
+        """
+        Removes the parts of the run this journal was written by before, if
+        it was another one, and the parts of this run that are not
+        committed.
+
+        Returns:
+        The number of files removed.
+        """
+        committed = set(self.part_name(chunk) for chunk in self.committed())
+        stale = [path for path in glob(join(folder, "{0}-*.gpkg.part".format(self.run_id)))
+                 if basename(path) not in committed]
+        if self.previous_run_id is not None:
+            stale.extend(glob(join(folder, "{0}-*.gpkg.part".format(self.previous_run_id))))
+        for path in stale:
+            remove(path)
+        return len(stale)
+
+    def close(self):
+        """Closes the journal, leaving it on disk for the next attempt."""
+        self.__db_con.close()
+
+    def finish(self):
+        """Closes the journal and removes it once the run is complete."""
+        self.close()
+        remove(self.file_path)
+
+    def __exit__(self, type, value, traceback):
+        """Resource cleanup on destruction."""
+        self.__db_con.close()
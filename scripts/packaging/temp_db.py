@@ -30,15 +30,17 @@ Version:
 """
 
 from scripts.geopackage.core.geopackage_core import GeoPackageCore
-from scripts.geopackage.geopackage import DEFAULT_TILES_IDENTIFIER
+from scripts.geopackage.geopackage import DEFAULT_TILES_IDENTIFIER, DEFAULT_COMMIT_SIZE
 from scripts.geopackage.tiles.geopackage_tiles import GeoPackageTiles
 from scripts.geopackage.tiles.tiles_content_entry import TilesContentEntry
-from scripts.geopackage.utility.sql_utility import get_database_connection
+from scripts.geopackage.utility.sql_utility import get_database_connection, table_exists
+from scripts.geopackage.utility.write_profile import BULK_LOAD, WRITE_PROFILES
 
 try:
     from cStringIO import StringIO as ioBuffer
 except ImportError:
     from io import BytesIO as ioBuffer
+from itertools import islice
 from sys import version_info
 from uuid import uuid4
 
@@ -52,6 +54,10 @@ try:
 except ImportError:
     IOPEN = None
 
+# Parts are only written by their TempDB, but merge_parts() opens them with
+# connections of its own, so they are not locked exclusively
+PART_WRITE_PROFILE = WRITE_PROFILES[BULK_LOAD].copy(locking_mode=None)
+
 
 class TempDB(object):
     """
@@ -66,19 +72,25 @@ class TempDB(object):
     def __init__(self,
                  filename,
                  tiles_table_name,
-                 tiles_identifier=DEFAULT_TILES_IDENTIFIER):
+                 tiles_identifier=DEFAULT_TILES_IDENTIFIER,
+                 write_profile=None,
+                 name=None):
         """
         Constructor.
 
         Inputs:
         filename -- the filename this database will be created with
+        write_profile -- the WriteProfile, or preset name, the database is
+                         created with, PART_WRITE_PROFILE by default
+        name -- the file name of the database, a new <uuid>.gpkg.part name
+                by default
         :param tiles_identifier:
         :param tiles_table_name:
         """
-        uid = uuid4()
-        self.name = uid.hex + '.gpkg.part'
+        self.name = name if name is not None else uuid4().hex + '.gpkg.part'
         self.__file_path = join(filename, self.name)
-        self.__db_con = get_database_connection(self.__file_path)
+        self.__db_con = get_database_connection(self.__file_path,
+                                                PART_WRITE_PROFILE if write_profile is None else write_profile)
         self.tiles_table_name = tiles_table_name
 
         with self.__db_con as db_con:
@@ -96,10 +108,6 @@ class TempDB(object):
                                                                                            max_y=0,
                                                                                            srs_id=0))
             db_con.commit()
-            # Enable pragma for fast sqlite creation
-            cursor.execute("pragma synchronous = off;")
-            cursor.execute("pragma journal_mode = off;")
-            cursor.execute("pragma page_size = 80000;")
             cursor.execute("pragma foreign_keys = 1;")
 
     def execute(self, statement, inputs=None):
@@ -132,6 +140,37 @@ class TempDB(object):
                                                   tile_row=y,
                                                   tile_data=data)
 
+    def insert_image_blobs(self, tiles, commit_size=DEFAULT_COMMIT_SIZE):
+        """
+        Inserts many binary image tiles into the sqlite3 database.  The tiles
+        table is verified once, then rows are written with a single prepared
+        statement through executemany, committing every commit_size tiles.
+
+        Inputs:
+        tiles -- an iterable (list or generator) of (z, x, y, data) tuples
+        commit_size -- the number of tiles written per transaction
+
+        Returns:
+        The number of tiles written.
+        """
+        if commit_size < 1:
+            raise ValueError("commit_size must be a positive integer")
+        cursor = self.__db_con.cursor()
+        if not table_exists(cursor, self.tiles_table_name):
+            raise ValueError("Cannot add row to {table} because it does not exist"
+                             .format(table=self.tiles_table_name))
+        statement = GeoPackageTiles.get_insert_or_update_tile_data_statement(table_name=self.tiles_table_name)
+        tiles = iter(tiles)
+        count = 0
+        while True:
+            chunk = list(islice(tiles, commit_size))
+            if not chunk:
+                break
+            with self.__db_con as db_con:
+                db_con.executemany(statement, chunk)
+            count += len(chunk)
+        return count
+
     def __exit__(self, type, value, traceback):
         """Resource cleanup on destruction."""
         self.__db_con.close()
@@ -0,0 +1,229 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3, argparse
+Description: Finds the image tiles of a tile folder.  Supports the z/x/y.ext
+ layout written by TMS and WMTS tilers as well as the z/x_y.ext layout.
+ Every zoom and column directory is scanned on a thread pool, and the
+ result can be kept in a manifest file so later runs only rescan the
+ directories whose modification time changed.
+
+Version:
+"""
+
+from json import dump, load
+from multiprocessing.pool import ThreadPool
+from os import listdir, remove, rename, stat
+from os.path import join, isdir, exists
+
+from scripts.packaging.tile_index import TileIndex
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+IMAGE_TYPES = '.png', '.jpeg', '.jpg'
+
+# Directory listing is I/O bound, so threads are used even without multiple cores
+DEFAULT_IO_THREADS = 8
+
+MANIFEST_VERSION = 1
+
+
+def parse_tile_name(name):
+    """
+    Parses the tile coordinates out of an image tile file name.
+
+    Inputs:
+    name -- the file name, either "y.ext" or "x_y.ext"
+
+    Returns:
+    An (x, y) tuple, x being None for "y.ext" names, or None if the name is
+    not a tile.
+    """
+    if not name.endswith(IMAGE_TYPES):
+        return None
+    stem = name.split('.')[0]
+    try:
+        if '_' in stem:
+            x, y = stem.split('_', 1)
+            return int(x), int(y)
+        return None, int(stem)
+    except ValueError:
+        return None
+
+
+def _to_int(name):
+    """Returns name as an int, or None if it is not a number."""
+    try:
+        return int(name)
+    except ValueError:
+        return None
+
+
+def _list_directory(path):
+    """
+    Lists a directory once.
+
+    Returns:
+    A (sub directory names, file names) tuple.
+    """
+    directories, files = [], []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir():
+                directories.append(entry.name)
+            else:
+                files.append(entry.name)
+    else:
+        for name in listdir(path):
+            if isdir(join(path, name)):
+                directories.append(name)
+            else:
+                files.append(name)
+    return directories, files
+
+
+def _scan_directory(args):
+    """
+    Scans one zoom or column directory, reusing the manifest entry for it
+    when the directory modification time has not changed.
+
+    Inputs:
+    args -- a (path, zoom, column, previous manifest entry or None) tuple,
+            column is None for zoom directories
+
+    Returns:
+    A manifest entry dictionary with the directory mtime, its numeric sub
+    directories and the [x, y, file name] of every tile found in it.
+    """
+    path, zoom, column, previous = args
+    mtime = stat(path).st_mtime
+    if previous is not None and previous['mtime'] == mtime:
+        return previous
+    directories, files = _list_directory(path)
+    tiles = []
+    for name in files:
+        coords = parse_tile_name(name)
+        if coords is None:
+            continue
+        x, y = coords
+        if column is not None and x is None:
+            tiles.append([column, y, name])
+        elif column is None and x is not None:
+            tiles.append([x, y, name])
+    return dict(mtime=mtime,
+                dirs=sorted((name for name in directories if _to_int(name) is not None), key=int),
+                tiles=sorted(tiles))
+
+
+def read_manifest(manifest_path, base_dir):
+    """
+    Reads a discovery manifest.
+
+    Returns:
+    The dictionary of directory entries keyed by relative path, or an empty
+    dictionary if the manifest does not exist or belongs to another folder.
+    """
+    if manifest_path is None or not exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as manifest_file:
+            manifest = load(manifest_file)
+    except ValueError:
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('base_dir') != base_dir:
+        return {}
+    return manifest['directories']
+
+
+def write_manifest(manifest_path, base_dir, directories):
+    """Writes a discovery manifest, replacing any previous one atomically."""
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w') as manifest_file:
+        dump(dict(version=MANIFEST_VERSION, base_dir=base_dir, directories=directories), manifest_file)
+    if exists(manifest_path):
+        # os.rename does not replace existing files on Windows
+        remove(manifest_path)
+    rename(temp_path, manifest_path)
+
+
+def discover_tiles(base_dir, io_threads=DEFAULT_IO_THREADS, manifest_path=None):
+    """
+    Finds all image tiles in a base directory arranged as z/x/y.ext or
+    z/x_y.ext.
+
+    Inputs:
+    base_dir -- the name of the folder containing tiles
+    io_threads -- the number of directories scanned at the same time
+    manifest_path -- optional manifest file, reused if it exists and
+                     rewritten after the scan
+
+    Returns:
+    A TileIndex of every tile, sorted by z, x then y.
+    """
+    previous = read_manifest(manifest_path, base_dir)
+    current = {}
+    zoom_dirs = sorted((_to_int(name), name) for name in _list_directory(base_dir)[0]
+                       if _to_int(name) is not None)
+    pool = ThreadPool(max(1, io_threads))
+    try:
+        zoom_entries = pool.map(_scan_directory,
+                                [(join(base_dir, name), zoom, None, previous.get(name))
+                                 for zoom, name in zoom_dirs])
+        column_keys = []
+        column_args = []
+        for (zoom, zoom_name), zoom_entry in zip(zoom_dirs, zoom_entries):
+            current[zoom_name] = zoom_entry
+            for column_name in zoom_entry['dirs']:
+                key = zoom_name + '/' + column_name
+                column_keys.append(key)
+                column_args.append((join(base_dir, zoom_name, column_name), zoom, _to_int(column_name),
+                                    previous.get(key)))
+        column_entries = pool.map(_scan_directory, column_args)
+    finally:
+        pool.close()
+        pool.join()
+
+    tile_index = TileIndex()
+    columns = iter(zip(column_keys, column_args, column_entries))
+    for (zoom, zoom_name), zoom_entry in zip(zoom_dirs, zoom_entries):
+        zoom_dir = join(base_dir, zoom_name)
+        tiles = [(x, y, zoom_dir, name) for x, y, name in zoom_entry['tiles']]
+        for _ in zoom_entry['dirs']:
+            key, (path, _, _, _), column_entry = next(columns)
+            current[key] = column_entry
+            if tiles:
+                # both layouts in one zoom level, merge them before sorting
+                tiles.extend((x, y, path, name) for x, y, name in column_entry['tiles'])
+            else:
+                for x, y, name in column_entry['tiles']:
+                    tile_index.append(zoom, x, y, path, name)
+        for x, y, directory, name in sorted(tiles):
+            tile_index.append(zoom, x, y, directory, name)
+
+    if manifest_path is not None:
+        write_manifest(manifest_path, base_dir, current)
+    return tile_index
@@ -0,0 +1,290 @@
+#!/usr/bin/python2.7
+"""
+Copyright (C) 2014 Reinventing Geospatial, Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>,
+or write to the Free Software Foundation, Inc., 59 Temple Place -
+Suite 330, Boston, MA 02111-1307, USA.
+
+Author: Steven D. Lander, Reinventing Geospatial Inc (RGi)
+Date: 2018-11-11
+   Requires: sqlite3, argparse
+Description: Compact, array backed list of the tiles found in a tile folder.
+
+Version:
+"""
+
+from array import array
+from os.path import join
+from sys import version_info
+
+if version_info[0] == 3:
+    xrange = range
+else:
+    from itertools import izip as zip
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TileIndex(object):
+    """
+    Column oriented list of tiles.  The z, x and y values are kept in
+    parallel integer arrays and every path is stored as an interned
+    directory prefix plus an interned file name template, so each tile
+    costs five integers instead of a dictionary and a path string.
+
+    Indexing a TileIndex with an integer returns the same
+    dict(z=..., x=..., y=..., path=...) produced by split_all(), and slicing
+    it returns a new TileIndex sharing the interned tables, so it can be
+    used anywhere a list of tile dictionaries was used before.
+    """
+
+    def __init__(self, prefixes=None, templates=None):
+        """
+        Constructor.
+
+        Inputs:
+        prefixes -- optional interned directory list to share
+        templates -- optional interned file name template list to share
+        """
+        self.zooms = array('i')
+        self.columns = array('i')
+        self.rows = array('i')
+        self.prefix_ids = array('i')
+        self.template_ids = array('i')
+        self.__prefixes = prefixes if prefixes is not None else []
+        self.__templates = templates if templates is not None else []
+        self.__prefix_lookup = None
+        self.__template_lookup = None
+
+    @staticmethod
+    def __intern(values, lookup, value):
+        """Returns the position of value in values, adding it if needed."""
+        position = lookup.get(value)
+        if position is None:
+            position = len(values)
+            values.append(value)
+            lookup[value] = position
+        return position
+
+    @staticmethod
+    def __name_template(x, y, name):
+        """Returns a str.format template that rebuilds name from x and y."""
+        for template in ("{y}", "{x}_{y}"):
+            stem = template.format(x=x, y=y)
+            if name.startswith(stem + '.'):
+                return template + name[len(stem):].replace('{', '{{').replace('}', '}}')
+        # e.g. zero padded names, keep them literally
+        return name.replace('{', '{{').replace('}', '}}')
+
+    def append(self, z, x, y, directory, name):
+        """
+        Adds a tile to the index.
+
+        Inputs:
+        z, x, y -- the TMS coordinates of the tile
+        directory -- the directory containing the tile
+        name -- the file name of the tile
+        """
+        if self.__prefix_lookup is None:
+            self.__prefix_lookup = dict((value, position) for position, value in enumerate(self.__prefixes))
+            self.__template_lookup = dict((value, position) for position, value in enumerate(self.__templates))
+        self.zooms.append(z)
+        self.columns.append(x)
+        self.rows.append(y)
+        self.prefix_ids.append(self.__intern(self.__prefixes, self.__prefix_lookup, directory))
+        self.template_ids.append(self.__intern(self.__templates, self.__template_lookup,
+                                               self.__name_template(x, y, name)))
+
+    def path(self, position):
+        """Returns the full file path of the tile at position."""
+        return join(self.__prefixes[self.prefix_ids[position]],
+                    self.__templates[self.template_ids[position]].format(x=self.columns[position],
+                                                                         y=self.rows[position]))
+
+    def take(self, positions):
+        """
+        Returns a new TileIndex of the tiles at positions, in that order,
+        sharing the interned tables.
+
+        Inputs:
+        positions -- an iterable of positions in this index
+        """
+        positions = list(positions)
+        subset = TileIndex(self.__prefixes, self.__templates)
+        subset.zooms = array('i', (self.zooms[position] for position in positions))
+        subset.columns = array('i', (self.columns[position] for position in positions))
+        subset.rows = array('i', (self.rows[position] for position in positions))
+        subset.prefix_ids = array('i', (self.prefix_ids[position] for position in positions))
+        subset.template_ids = array('i', (self.template_ids[position] for position in positions))
+        return subset
+
+    def coordinates(self):
+        """Returns an iterator of the (z, x, y) tuple of every tile."""
+        return zip(self.zooms, self.columns, self.rows)
+
+    def __len__(self):
+        return len(self.zooms)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            subset = TileIndex(self.__prefixes, self.__templates)
+            subset.zooms = self.zooms[item]
+            subset.columns = self.columns[item]
+            subset.rows = self.rows[item]
+            subset.prefix_ids = self.prefix_ids[item]
+            subset.template_ids = self.template_ids[item]
+            return subset
+        if item < 0:
+            item += len(self)
+        return dict(z=self.zooms[item],
+                    x=self.columns[item],
+                    y=self.rows[item],
+                    path=self.path(item))
+
+    def __iter__(self):
+        return (self[position] for position in xrange(len(self)))
+
+    def __getstate__(self):
+        """Only the arrays and interned tables are sent to worker processes."""
+        return (self.zooms, self.columns, self.rows, self.prefix_ids, self.template_ids,
+                self.__prefixes, self.__templates)
+
+    def __setstate__(self, state):
+        (self.zooms, self.columns, self.rows, self.prefix_ids, self.template_ids,
+         self.__prefixes, self.__templates) = state
+        self.__prefix_lookup = None
+        self.__template_lookup = None
+
+
+def tile_coordinates(file_list):
+    """
+    Returns an iterator of (z, x, y) tuples for a TileIndex or a list of
+    tile dictionaries.
+    """
+    if isinstance(file_list, TileIndex):
+        return file_list.coordinates()
+    return ((item['z'], item['x'], item['y']) for item in file_list)
+
+
+def zoom_extents(file_list):
+    """
+    Computes the tile extents of every zoom level in a single pass over a
+    TileIndex or a list of tile dictionaries.  The aggregation is vectorized
+    with NumPy when it is installed and file_list is a TileIndex.
+
+    Returns:
+    A dictionary of zoom level to (min x, max x, min y, max y) tuples.
+    """
+    if numpy is not None and isinstance(file_list, TileIndex) and len(file_list) > 0:
+        return _zoom_extents_numpy(file_list)
+    extents = {}
+    for z, x, y in tile_coordinates(file_list):
+        extent = extents.get(z)
+        if extent is None:
+            extents[z] = [x, x, y, y]
+        else:
+            if x < extent[0]:
+                extent[0] = x
+            elif x > extent[1]:
+                extent[1] = x
+            if y < extent[2]:
+                extent[2] = y
+            elif y > extent[3]:
+                extent[3] = y
+    return dict((z, tuple(extent)) for z, extent in extents.items())
+
+
+def _zoom_extents_numpy(tile_index):
+    """NumPy implementation of zoom_extents() for a non-empty TileIndex."""
+    zooms = numpy.frombuffer(tile_index.zooms, dtype=numpy.intc)
+    columns = numpy.frombuffer(tile_index.columns, dtype=numpy.intc)
+    rows = numpy.frombuffer(tile_index.rows, dtype=numpy.intc)
+    if numpy.any(zooms[1:] < zooms[:-1]):
+        # discover_tiles() output is already sorted by zoom, anything else is sorted here
+        order = numpy.argsort(zooms, kind='mergesort')
+        zooms, columns, rows = zooms[order], columns[order], rows[order]
+    starts = numpy.concatenate(([0], numpy.flatnonzero(zooms[1:] != zooms[:-1]) + 1))
+    min_columns = numpy.minimum.reduceat(columns, starts)
+    max_columns = numpy.maximum.reduceat(columns, starts)
+    min_rows = numpy.minimum.reduceat(rows, starts)
+    max_rows = numpy.maximum.reduceat(rows, starts)
+    return dict((int(zooms[start]), (int(min_columns[level]), int(max_columns[level]),
+                                     int(min_rows[level]), int(max_rows[level])))
+                for level, start in enumerate(starts))
+
+
+def column_starts(tile_index):
+    """
+    Returns the positions where a new (zoom, column) run starts in a
+    TileIndex sorted by zoom then column, or None if it is not sorted.
+    """
+    if numpy is not None:
+        zooms = numpy.frombuffer(tile_index.zooms, dtype=numpy.intc)
+        columns = numpy.frombuffer(tile_index.columns, dtype=numpy.intc)
+        zoom_steps = zooms[1:] - zooms[:-1]
+        column_steps = columns[1:] - columns[:-1]
+        if numpy.any((zoom_steps < 0) | ((zoom_steps == 0) & (column_steps < 0))):
+            return None
+        return [0] + (numpy.flatnonzero((zoom_steps != 0) | (column_steps != 0)) + 1).tolist()
+    starts = [0]
+    previous = (tile_index.zooms[0], tile_index.columns[0])
+    for position, key in enumerate(zip(tile_index.zooms, tile_index.columns)):
+        if key != previous:
+            if key < previous:
+                return None
+            starts.append(position)
+            previous = key
+    return starts
+
+
+def spatial_chunks(file_list, chunk_size):
+    """
+    Splits a tile list into consecutive ranges of at most chunk_size tiles.
+    For a TileIndex sorted by zoom then column, as made by discover_tiles(),
+    ranges end on (zoom, column) boundaries and only a column holding more
+    than chunk_size tiles is split by rows, into ranges of its own.  The
+    tiles of two ranges then never interleave in (zoom, column, row) order,
+    whichever way rows are numbered, so the databases written from them
+    can be merged by appending one after the other.  Other lists are cut
+    every chunk_size tiles.
+
+    Inputs:
+    file_list -- a TileIndex or a list of tiles
+    chunk_size -- the largest number of tiles in a range
+
+    Returns:
+    A list of (start, stop) tuples covering the whole list.
+    """
+    count = len(file_list)
+    starts = column_starts(file_list) if isinstance(file_list, TileIndex) and count > 0 else None
+    if starts is None:
+        return [(start, min(start + chunk_size, count)) for start in xrange(0, count, chunk_size)]
+    chunks = []
+    start = 0
+    for first, stop in zip(starts, starts[1:] + [count]):
+        if stop - first > chunk_size:
+            if first > start:
+                chunks.append((start, first))
+            chunks.extend((row, min(row + chunk_size, stop)) for row in xrange(first, stop, chunk_size))
+            start = stop
+        elif stop - start > chunk_size:
+            chunks.append((start, first))
+            start = first
+    if start < count:
+        chunks.append((start, count))
+    return chunks
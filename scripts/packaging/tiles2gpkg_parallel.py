@@ -33,6 +33,7 @@ Version:
 
 from glob import glob
 
+from scripts.common.telemetry import SharedProgress, Telemetry, new_stats, time_insert
 from scripts.common.zoom_metadata import ZoomMetadata
 from scripts.geopackage.geopackage import Geopackage, PRAGMA_MINIMUM_SQLITE_VERSION
 from scripts.geopackage.nsg_geopackage import NsgGeopackage
@@ -41,25 +42,39 @@ from scripts.geopackage.srs.geodetic import Geodetic
 from scripts.geopackage.srs.geodetic_nsg import GeodeticNSG
 from scripts.geopackage.srs.mercator import Mercator
 from scripts.geopackage.srs.scaled_world_mercator import ScaledWorldMercator
-from scripts.packaging.temp_db import TempDB
+from scripts.geopackage.tiles.tile_addressing import TileAddressing
+from scripts.geopackage.utility.write_profile import BULK_LOAD, WRITE_PROFILES, get_write_profile
+from scripts.packaging.encode_cache import EncodeCache
+from scripts.packaging.run_journal import ENCODE, MERGE, RunJournal, make_run_id
+from scripts.packaging.incremental import compare_sources, read_sources, read_tile_keys, record_sources, \
+    remove_tiles, remove_zoom_levels, stat_sources
+from scripts.packaging.memory_budget import ByteBudget, ReleasingWriter, bounded_insert
+from scripts.packaging.read_ahead import NETWORK_READ_AHEAD, get_read_ahead, read_ahead, read_file
+from scripts.packaging.temp_db import TempDB, DEFAULT_COMMIT_SIZE
+from scripts.packaging.tile_discovery import DEFAULT_IO_THREADS, discover_tiles, parse_tile_name
+from scripts.packaging.tile_index import TileIndex, spatial_chunks, zoom_extents
 
 try:
     from cStringIO import StringIO as ioBuffer
 except ImportError:
     from io import BytesIO as ioBuffer
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
 from time import sleep
-from sys import stdout
 from sys import version_info
 
 if version_info[0] == 3:
     xrange = range
 
 from sqlite3 import sqlite_version
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 from sqlite3 import Binary as sbinary
-from os import walk
-from os.path import split, join, exists
-from multiprocessing import cpu_count, Pool
+from os import remove
+from os.path import abspath, split, join, exists, getsize
+from multiprocessing import cpu_count, Pool, Process, Queue
+from multiprocessing.pool import ThreadPool
 from distutils.version import LooseVersion
 
 try:
@@ -70,9 +85,30 @@ except ImportError:
 # JPEGs @ 75% provide good quality images with low footprint, use as a default
 # PNGs should be used sparingly (mixed mode) due to their high disk usage RGBA
 # Options are mixed, jpeg, and png
-IMAGE_TYPES = '.png', '.jpeg', '.jpg'
-
 
+# Leading bytes identifying the image formats that can be stored without re-encoding
+JPEG_MAGIC = b'\xff\xd8\xff'
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+
+# Per process cache of encoded tiles used by -dedup, see get_encode_cache()
+ENCODE_CACHE = None
+# SharedProgress the parts engine workers count their tiles into, see init_worker()
+WORKER_PROGRESS = None
+
+# Maximum number of encoded tiles waiting on the writer in the stream engine
+DEFAULT_QUEUE_SIZE = 512
+# Number of tiles handed to a stream engine worker at a time
+STREAM_TASK_SIZE = 256
+# Seconds the stream engine writer waits on an empty tile queue before checking that its workers are alive
+STREAM_POLL_INTERVAL = 0.25
+# Largest number of tiles in a parts engine chunk, each chunk is one .gpkg.part file
+DEFAULT_CHUNK_SIZE = 4096
+# Smaller jobs are cut into at least this many chunks per core
+CHUNKS_PER_CORE = 4
+# Number of times a failed chunk is tried before giving up
+DEFAULT_CHUNK_ATTEMPTS = 3
+# Parts engine worker backends, 'auto' picks one from the imagery and read ahead options, see get_backend()
+BACKENDS = 'auto', 'process', 'thread'
 
 
 def write_geopackage_header(file_path):
@@ -103,7 +139,9 @@ def img_to_buf(img, img_type, jpeg_quality=75):
     defaults = {}
     buf = ioBuffer()
     if img_type == 'jpeg':
-        img.convert('RGB')
+        if img.mode not in ('RGB', 'L'):
+            # JPEG has no alpha channel or palette
+            img = img.convert('RGB')
         # Hardcoding a default compression of 75% for JPEGs
         defaults['quality'] = jpeg_quality
     elif img_type == 'source':
@@ -113,63 +151,84 @@ def img_to_buf(img, img_type, jpeg_quality=75):
     return buf
 
 
+def sniff_image_type(data):
+    """
+    Returns 'jpeg' or 'png' if the magic bytes at the start of data identify
+    it as such an image, otherwise None.
+    """
+    if data.startswith(JPEG_MAGIC):
+        return 'jpeg'
+    if data.startswith(PNG_MAGIC):
+        return 'png'
+    return None
+
+
+def classify_alpha(low, high):
+    """
+    Returns 0 if the alpha range low..high is fully opaque, -1 if it is
+    fully transparent and 1 otherwise.
+    """
+    if low == 255:
+        return 0
+    if high == 0:
+        return -1
+    return 1
+
+
 def img_has_transparency(img):
     """
     Returns a 0 if the input image has no transparency, 1 if it has some,
-    and -1 if the image is fully transparent. Tiles *should be a perfect
-    square (e.g, 256x256), so it can be safe to assume the first dimension
-    will match the second.  This will ensure compatibility with different
-    tile sizes other than 256x256.  This code is based on logic implemented
-    in MapProxy to check for images that have transparency.
+    and -1 if the image is fully transparent.  Only the alpha band is
+    looked at, through its extrema, so the check works for tiles of any
+    size and needs no histogram of the colour bands.  This code is based on
+    logic implemented in MapProxy to check for images that have
+    transparency.
 
     Inputs:
     img -- an Image object from the PIL library
     """
-    size = img.size[0]
+    transparency = img.info.get('transparency')
     if img.mode == 'P':
-        # For paletted images
-        if img.info.get('transparency', False):
-            return True
-        # Convert to RGBA to check alpha
-        img = img.convert('RGBA')
-    if img.mode == 'RGBA':
-        # Returns the number of pixels in this image that are transparent
-        # Assuming a tile size of 256, 65536 would be fully transparent
-        transparent_pixels = img.histogram()[-size]
-        if transparent_pixels == 0:
-            # No transparency
+        # For paletted images, look up the alpha of the palette entries in use
+        if transparency is None:
             return 0
-        elif 0 < transparent_pixels < (size * size):
-            # Image has some transparency
-            return 1
+        if isinstance(transparency, int):
+            alphas = [0 if index == transparency else 255 for index in xrange(256)]
         else:
-            # Image is fully transparent, and can be discarded
-            return -1
-            # return img.histogram()[-size]
-    return False
+            alphas = list(bytearray(transparency)) + [255] * (256 - len(transparency))
+        used = [alphas[index] for _, index in img.getcolors(256)]
+        return classify_alpha(min(used), max(used))
+    if transparency is not None and 'A' not in img.getbands():
+        # colour keyed transparency, e.g. a PNG tRNS chunk
+        img = img.convert('RGBA')
+    if 'A' not in img.getbands():
+        return 0
+    if hasattr(img, 'getchannel'):
+        alpha = img.getchannel('A')
+    else:
+        # Pillow < 4.3
+        alpha = img.split()[img.getbands().index('A')]
+    return classify_alpha(*alpha.getextrema())
 
 
-def file_count(base_dir):
+def file_count(base_dir, io_threads=DEFAULT_IO_THREADS, manifest_path=None):
     """
     A function that finds all image tiles in a base directory.  The base
-    directory should be arranged in TMS format, i.e. z/x/y.
+    directory should be arranged in TMS format, i.e. z/x/y, or as z/x_y.
 
     Inputs:
     base_dir -- the name of the TMS folder containing tiles.
+    io_threads -- the number of directories scanned in parallel
+    manifest_path -- optional discovery manifest to reuse and update
 
     Returns:
-    A list of dictionary objects containing the full file path and TMS
-    coordinates of the image tile.
+    A TileIndex of the image tiles.  Indexing it returns dictionary objects
+    containing the full file path and TMS coordinates of the image tile.
     """
     print("Calculating number of tiles, this could take a while...")
-    file_list = []
-    # Avoiding dots (functional references) will increase performance of
-    #  the loop because they will not be reevaluated each iteration.
-    for root, sub_folders, files in walk(base_dir):
-        temp_list = [join(root, f) for f in files if f.endswith(IMAGE_TYPES)]
-        file_list += temp_list
-    print("Found {} total tiles.".format(len(file_list)))
-    return [split_all(item) for item in file_list]
+    tile_index = discover_tiles(base_dir, io_threads, manifest_path)
+    print("Found {} total tiles.".format(len(tile_index)))
+    return tile_index
 
 
 def split_all(path):
@@ -177,37 +236,174 @@ def split_all(path):
     Function that parses TMS coordinates from a full images file path.
 
     Inputs:
-    path -- a full file path to an image tile.
+    path -- a full file path to an image tile, either z/x/y.ext or z/x_y.ext
 
     Returns:
     A dictionary containing the TMS coordinates of the tile and its full
     file path.
     """
-    parts = []
-    full_path = path
-    # Parse out the tms coordinates
-    # for i in xrange(3):
-    #     head, tail = split(path)
-    #     parts.append(tail)
-    #     path = head
-    # file_dict = dict(y=int(parts[0].split('.')[0]),
-    #                  x=int(parts[1]),
-    #                  z=int(parts[2]),
-    #                  path=full_path)
-
     head, tail = split(path)
-    filename = tail.split('.')[0]
-    x, y = filename.split('_', 1)
+    x, y = parse_tile_name(tail)
+    if x is None:
+        head, x = split(head)
     z = split(head)[1]
+    return dict(y=int(y),
+                x=int(x),
+                z=int(z),
+                path=path)
+
+
+def encode_tile_bytes(tile_dict, extra_args, invert_y, data=None):
+    """
+    Function responsible for producing the correctly oriented tile data for a
+    single tile.
+
+    Inputs:
+    tile_dict -- a dictionary with TMS coordinates and file path for a tile
+    extra_args -- a dictionary holding the tile_info (list of ZoomMetadata
+                  objects pre-generated for this tile set), imagery,
+                  jpeg_quality, nsg_profile and renumber options
+    invert_y -- a function that will flip the Y axis of the tile if present
+    data -- the bytes of the tile file if they were already read, see
+            read_tile_file()
+
+    Returns:
+    A (zoom, tile_column, tile_row, data) tuple where data is the plain
+    encoded image bytes, or the bytearray a tile stored as it is was read
+    into, suitable for sending between processes.  Tiles
+    already in the requested format keep their file bytes as they are,
+    only the others are decoded and encoded again.  None is returned for
+    fully transparent tiles in mixed mode, which are not stored.  With
+    extra_args['dedup'] set, tiles whose source bytes were already encoded
+    by this process reuse that result from the EncodeCache.
+    """
+    imagery = extra_args['imagery']
+    jpeg_quality = extra_args['jpeg_quality']
+    zoom, x_row, y_column = tile_key(tile_dict['z'], tile_dict['x'], tile_dict['y'], extra_args, invert_y)
+    if data is None:
+        data = read_tile_file(tile_dict)
+    # TODO add options for "mvt" and "GeoJson"
+    if IOPEN is not None and needs_encoding(sniff_image_type(data), imagery):
+        if extra_args.get('dedup'):
+            data = get_encode_cache().encode(data, encode_image, imagery, jpeg_quality)
+        else:
+            data = encode_image(data, imagery, jpeg_quality)
+        if data is None:
+            return None
+    return zoom, x_row, y_column, data
+
+
+def read_tile_file(tile_dict):
+    """Returns the bytes of the source file of a tile."""
+    return read_file(tile_dict['path'])
+
+
+def tile_key(z, x, y, extra_args, invert_y):
+    """
+    Returns the (zoom_level, tile_column, tile_row) a source tile is stored
+    under in the geopackage.
+
+    Inputs:
+    z, x, y -- the TMS coordinates of the source tile
+    extra_args -- see encode_tile_bytes()
+    invert_y -- a function that will flip the Y axis of the tile if present
+    """
+    key = get_addressing(extra_args, invert_y).to_stored(z, x, y)
+    if key is None:
+        raise ValueError("No tile matrix was built for the zoom level of tile {0}/{1}/{2}".format(z, x, y))
+    return key
+
+
+def get_addressing(extra_args, invert_y):
+    """
+    Returns the TileAddressing of extra_args['tile_info'], built once and
+    kept in extra_args['addressing'].
+
+    Inputs:
+    extra_args -- see encode_tile_bytes()
+    invert_y -- a function that will flip the Y axis of the tile if present
+    """
+    addressing = extra_args.get('addressing')
+    if addressing is None or addressing.flipped != (invert_y is not None):
+        addressing = TileAddressing.from_levels(extra_args['tile_info'], extra_args['nsg_profile'], invert_y,
+                                                extra_args['renumber'])
+        extra_args['addressing'] = addressing
+    return addressing
+
+
+def needs_encoding(source_type, imagery):
+    """
+    Returns whether a tile of source_type (see sniff_image_type()) has to be
+    decoded to be stored as imagery.  JPEGs have no alpha channel, so in
+    mixed mode they are always stored as JPEGs.
+    """
+    if imagery == 'mixed':
+        return source_type != 'jpeg'
+    return source_type is None or imagery not in ('source', source_type)
+
+
+def encode_image(data, imagery, jpeg_quality):
+    """
+    Decodes image file bytes and encodes them for the imagery option.
+
+    Returns:
+    The encoded bytes, data itself for a transparent PNG in mixed mode, or
+    None for a fully transparent tile in mixed mode, which is not stored.
+    """
+    img = IOPEN(ioBuffer(data), 'r')
+    # getvalue() hands over the encoded bytes without the copy read() makes
+    if imagery != 'mixed':
+        return img_to_buf(img, imagery, jpeg_quality).getvalue()
+    transparency = img_has_transparency(img)
+    if transparency < 0:
+        # Fully transparent tiles are left out of the geopackage
+        return None
+    if transparency == 0:
+        return img_to_buf(img, 'jpeg', jpeg_quality).getvalue()
+    if sniff_image_type(data) == 'png':
+        return data
+    return img_to_buf(img, 'png', jpeg_quality).getvalue()
+
+
+def get_encode_cache():
+    """Returns the EncodeCache of this process, creating it on first use."""
+    global ENCODE_CACHE
+    if ENCODE_CACHE is None:
+        ENCODE_CACHE = EncodeCache()
+    return ENCODE_CACHE
+
+
+def encode_tile(tile_dict, extra_args, invert_y, data=None):
+    """
+    Same as encode_tile_bytes(), but with the data wrapped as a sqlite3
+    Binary so the tuple can be inserted directly.
+    """
+    tile = encode_tile_bytes(tile_dict, extra_args, invert_y, data)
+    if tile is None:
+        return None
+    zoom, x_row, y_column, data = tile
+    return zoom, x_row, y_column, sbinary(data)
 
-    print("x=%s, y=%s, z=%s"%(x, y, z))
 
-    file_dict = dict(y=y,
-                     x=x,
-                     z=z,
-                     path=path)
+def encode_tiles(file_list, extra_args, stats):
+    """
+    Generator encoding every tile of file_list with encode_tile(), leaving
+    out the skipped ones.  The files of the next extra_args['read_ahead']
+    tiles are read on up to extra_args['io_threads'] threads while the
+    current one is encoded, see read_ahead().
 
-    return file_dict
+    Inputs:
+    file_list -- the tiles to encode
+    extra_args -- see encode_tile_bytes()
+    stats -- a telemetry new_stats() dictionary counting the skipped tiles
+    """
+    invert_y = get_invert_y(extra_args)
+    for item, data in read_ahead(file_list, read_tile_file, extra_args.get('read_ahead'), extra_args.get('io_threads')):
+        tile = encode_tile(item, extra_args, invert_y, data)
+        if tile is not None:
+            yield tile
+        else:
+            stats['skipped'] += 1
 
 
 def worker_map(temp_db, tile_dict, extra_args, invert_y):
@@ -218,43 +414,34 @@ def worker_map(temp_db, tile_dict, extra_args, invert_y):
     Inputs:
     temp_db -- a temporary sqlite3 database that will hold this worker's tiles
     tile_dict -- a dictionary with TMS coordinates and file path for a tile
-    tile_info -- a list of ZoomMetadata objects pre-generated for this tile set
-    imagery -- the type of image format to send to the sqlite3 database
+    extra_args -- see encode_tile()
     invert_y -- a function that will flip the Y axis of the tile if present
     """
-    tile_info = extra_args['tile_info']
-    imagery = extra_args['imagery']
-    jpeg_quality = extra_args['jpeg_quality']
-    zoom = tile_dict['z']
-    if extra_args['renumber']:
-        zoom -= 1
-    level = next((item for item in tile_info if item.zoom == zoom), None)
-    # fiddle with offsets based on absolute (NSG profile) vs relative row/column numbering
-    x_row = tile_dict['x'] if extra_args['nsg_profile'] else tile_dict['x'] - level.min_tile_row
-    if invert_y is not None:
-        y_column = invert_y(zoom, tile_dict['y'])
-        if not extra_args['nsg_profile']:
-            y_offset = invert_y(zoom, level.max_tile_col)
-            y_column -= y_offset
-    else:
-        y_column = tile_dict['y'] if extra_args['nsg_profile'] else tile_dict['y'] - level.min_tile_col
-    if IOPEN is not None:
-        img = IOPEN(tile_dict['path'], 'r')
-        data = ioBuffer()
-        # TODO add options for "mvt" and "GeoJson"
-        if imagery == 'mixed':
-            if img_has_transparency(img):
-                data = img_to_buf(img, 'png', jpeg_quality).read()
+    tile = encode_tile(tile_dict, extra_args, invert_y)
+    if tile is not None:
+        temp_db.insert_image_blob(*tile)
+
+
+def get_invert_y(extra_args):
+    """
+    Returns the function that flips the Y axis of a tile for the tile grid
+    described by extra_args, or None if the grid does not need flipping.
+    """
+    invert_y = None
+    if extra_args['lower_left']:
+        if extra_args['srs'] == 3857:
+            invert_y = Mercator.invert_y
+        elif extra_args['srs'] == 4326:
+            if extra_args['nsg_profile']:
+                invert_y = GeodeticNSG.invert_y
             else:
-                data = img_to_buf(img, 'jpeg', jpeg_quality).read()
-        else:
-            data = img_to_buf(img, imagery, jpeg_quality).read()
-        temp_db.insert_image_blob(zoom, x_row, y_column, sbinary(data))
-    else:
-        file_handle = open(tile_dict['path'], 'rb')
-        data = buffer(file_handle.read())
-        temp_db.insert_image_blob(zoom, x_row, y_column, data)
-        file_handle.close()
+                invert_y = Geodetic.invert_y
+        elif extra_args['srs'] == 3395:
+            invert_y = EllipsoidalMercator.invert_y
+        elif extra_args['srs'] == 9804:
+            invert_y = ScaledWorldMercator.invert_y
+            #TODO update for retile
+    return invert_y
 
 
 def sqlite_worker(file_list, extra_args):
@@ -269,43 +456,389 @@ def sqlite_worker(file_list, extra_args):
                 .gpkg.part files will be generated here
     metadata -- a ZoomLevelMetadata object containing information about
                 the tiles in the TMS directory
+
+    Returns:
+    A telemetry new_stats() dictionary of the tiles written.
     """
     # TODO create the tempDB by adding the table name and telling which type (tiles/vectortiles)
-    temp_db = TempDB(extra_args['root_dir'], extra_args['table_name'])
-    with TempDB(extra_args['root_dir'],  extra_args['table_name']) as temp_db:
-        invert_y = None
-        if extra_args['lower_left']:
-            if extra_args['srs'] == 3857:
-                invert_y = Mercator.invert_y
-            elif extra_args['srs'] == 4326:
-                if extra_args['nsg_profile']:
-                    invert_y = GeodeticNSG.invert_y
-                else:
-                    invert_y = Geodetic.invert_y
-            elif extra_args['srs'] == 3395:
-                invert_y = EllipsoidalMercator.invert_y
-            elif extra_args['srs'] == 9804:
-                invert_y = ScaledWorldMercator.invert_y
-                #TODO update for retile
-        [worker_map(temp_db, item, extra_args, invert_y) for item in file_list]
+    with TempDB(extra_args['root_dir'], extra_args['table_name']) as temp_db:
+        stats = new_stats()
+        return time_insert(bounded_insert(temp_db.insert_image_blobs, extra_args.get('commit_bytes')),
+                           encode_tiles(file_list, extra_args, stats),
+                           extra_args.get('commit_size', DEFAULT_COMMIT_SIZE), stats)
 
 
-def allocate(cores, pool, file_list, extra_args):
+def stream_worker(task_queue, tile_queue, extra_args, file_list, budget=None):
     """
-    Recursive function that fairly distributes tiles to asynchronous worker
-    processes.  For N processes and C cores, N=C if C is divisible by 2.  If
-    not, then N is the largest factor of 8 that is still less than C.
+    Worker function for the streaming engine.  Takes (start, stop) ranges of
+    file_list off the task queue until it receives None, encodes those tiles,
+    and puts the resulting (z, x, y, bytes) tuples on the bounded tile queue
+    for the writer.  The files are read ahead like in encode_tiles().  A
+    None is always put on the tile queue when the worker stops so the writer
+    knows when every worker is finished.
+
+    Inputs:
+    task_queue -- a Queue of (start, stop) ranges, terminated by None
+    tile_queue -- a bounded Queue that receives the encoded tiles
+    extra_args -- see encode_tile_bytes()
+    file_list -- the TileIndex or list of tile dictionaries being packaged
+    budget -- optional ByteBudget the bytes of every tile are taken from
+              before it is queued, the writer gives them back once the
+              tile is written
     """
-    if cores is 1:
-        print("Spawning worker with {} files".format(len(file_list)))
-        return [pool.apply_async(sqlite_worker, [file_list, extra_args])]
-    else:
-        files = len(file_list)
-        head = allocate(
-            int(cores / 2), pool, file_list[:int(files / 2)], extra_args)
-        tail = allocate(
-            int(cores / 2), pool, file_list[int(files / 2):], extra_args)
-        return head + tail
+    try:
+        invert_y = get_invert_y(extra_args)
+        items = (item for start, stop in iter(task_queue.get, None) for item in file_list[start:stop])
+        for item, data in read_ahead(items, read_tile_file, extra_args.get('read_ahead'),
+                                     extra_args.get('io_threads')):
+            tile = encode_tile_bytes(item, extra_args, invert_y, data)
+            if tile and budget is not None:
+                budget.acquire(len(tile[3]))
+            # an empty tuple stands for a skipped tile, None means the worker is done
+            tile_queue.put(tile or ())
+    finally:
+        tile_queue.put(None)
+
+
+def stream_tiles(gpkg, file_list, extra_args, cores, telemetry=None):
+    """
+    Streaming packaging engine.  Worker processes only encode images, and
+    this process writes every tile they produce straight into the output
+    geopackage, so no .gpkg.part files or merge phase are needed.
+
+    Inputs:
+    gpkg -- the initialized output Geopackage
+    file_list -- the file_list dict made with file_count()
+    extra_args -- see encode_tile_bytes(); queue_size bounds the number of
+                  encoded tiles waiting for the writer, and max_memory the
+                  bytes they hold
+    cores -- the number of encoding processes, 0 encodes in this process
+    telemetry -- optional Telemetry object receiving the progress, the
+                 time spent waiting on the encoders is recorded as encode
+
+    Returns:
+    The number of tiles written.
+    """
+    commit_size = extra_args.get('commit_size', DEFAULT_COMMIT_SIZE)
+    if telemetry is None:
+        telemetry = Telemetry()
+    telemetry.start(len(file_list))
+    if cores < 1:
+        invert_y = get_invert_y(extra_args)
+        stats = time_insert(gpkg.insert_tiles,
+                            telemetry.track(encode_tile(item, extra_args, invert_y) for item in file_list),
+                            commit_size)
+        telemetry.add_time('encode', stats['encode'])
+        telemetry.add_time('insert', stats['insert'])
+        telemetry.finish()
+        return stats['tiles']
+    task_queue = Queue()
+    tile_queue = Queue(extra_args.get('queue_size', DEFAULT_QUEUE_SIZE))
+    max_memory = extra_args.get('max_memory')
+    budget = None if max_memory is None else ByteBudget(max_memory)
+    # the bytes of a tile are given back to the workers once its transaction is committed
+    writer = None if budget is None else ReleasingWriter(gpkg.insert_tiles, budget)
+    workers = [Process(target=stream_worker, args=(task_queue, tile_queue, extra_args, file_list, budget))
+               for _ in xrange(cores)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for start in xrange(0, len(file_list), STREAM_TASK_SIZE):
+        task_queue.put((start, min(start + STREAM_TASK_SIZE, len(file_list))))
+    for _ in workers:
+        task_queue.put(None)
+
+    def drain():
+        finished = 0
+        while finished < len(workers):
+            try:
+                tile = tile_queue.get(timeout=STREAM_POLL_INTERVAL)
+            except Empty:
+                # a worker that was killed never puts its None on the queue
+                if any(worker.exitcode not in (None, 0) for worker in workers):
+                    raise RuntimeError("A streaming worker failed, the output geopackage is incomplete.")
+                if writer is not None:
+                    # the workers may all be waiting on the bytes of the tiles not written yet
+                    writer.flush()
+                continue
+            if tile is None:
+                finished += 1
+            elif not tile:
+                yield None
+            else:
+                zoom, x_row, y_column, data = tile
+                yield zoom, x_row, y_column, sbinary(data)
+
+    try:
+        stats = time_insert(gpkg.insert_tiles if writer is None else writer.write, telemetry.track(drain()),
+                            commit_size)
+    except BaseException:
+        # the other workers may be waiting on a full tile queue
+        for worker in workers:
+            worker.terminate()
+        raise
+    telemetry.add_time('encode', stats['encode'])
+    telemetry.add_time('insert', stats['insert'])
+    telemetry.finish()
+    for worker in workers:
+        worker.join()
+    if any(worker.exitcode != 0 for worker in workers):
+        raise RuntimeError("A streaming worker failed, the output geopackage is incomplete.")
+    return stats['tiles']
+
+
+def init_worker(file_list, progress=None):
+    """
+    Pool initializer that hands the full tile list to a worker process once,
+    so tasks only need to carry index ranges into it, along with the
+    SharedProgress the worker counts its tiles into.
+    """
+    global WORKER_FILE_LIST, WORKER_PROGRESS
+    WORKER_FILE_LIST = file_list
+    WORKER_PROGRESS = progress
+
+
+def sqlite_chunk_worker(start, stop, extra_args, file_list=None, name=None):
+    """
+    Worker function that processes one chunk of tiles into its own TempDB
+    object.  If the chunk fails, its partially written .gpkg.part file is
+    removed so the chunk can be retried without leaving duplicates behind.
+    The tiles are counted into the SharedProgress given to init_worker(), if
+    any, as they are encoded.
+
+    Inputs:
+    start, stop -- the range of the tile list making up this chunk
+    extra_args -- see sqlite_worker()
+    file_list -- the tiles of the chunk, or None to read
+                 WORKER_FILE_LIST[start:stop] given to init_worker()
+    name -- the file name of the .gpkg.part file, see RunJournal.part_name(),
+            a new unique name by default
+
+    Returns:
+    A telemetry new_stats() dictionary of the tiles written.
+    """
+    if file_list is None:
+        file_list = WORKER_FILE_LIST[start:stop]
+    temp_db = TempDB(extra_args['root_dir'], extra_args['table_name'], name=name)
+    try:
+        with temp_db:
+            stats = new_stats()
+            return time_insert(bounded_insert(temp_db.insert_image_blobs, extra_args.get('commit_bytes')),
+                               encode_tiles(file_list, extra_args, stats),
+                               extra_args.get('commit_size', DEFAULT_COMMIT_SIZE), stats, WORKER_PROGRESS)
+    except Exception:
+        remove(join(extra_args['root_dir'], temp_db.name))
+        raise
+
+
+def get_chunk_size(cores, tile_count, chunk_size=None):
+    """
+    Returns the number of tiles handed to a worker at a time.  Unless a
+    chunk size is given, chunks are at most DEFAULT_CHUNK_SIZE tiles, and
+    small jobs are cut so every core gets CHUNKS_PER_CORE chunks to pick
+    from.
+    """
+    if chunk_size is not None:
+        return chunk_size
+    return max(1, min(DEFAULT_CHUNK_SIZE, -(-tile_count // (cores * CHUNKS_PER_CORE))))
+
+
+def get_worker_count(backend, workers=None):
+    """
+    Returns the number of parts engine workers: workers if given, otherwise
+    one per core, and at least DEFAULT_IO_THREADS threads with the thread
+    backend, whose workers mostly wait on file reads.
+    """
+    if workers:
+        return workers
+    if backend == 'thread':
+        return max(cpu_count(), DEFAULT_IO_THREADS)
+    return cpu_count()
+
+
+def get_tasks_per_worker(cores, tile_count, extra_args):
+    """
+    Returns the number of chunks a worker process encodes before it is
+    replaced, None to keep every worker for the whole run, see
+    extra_args['max_tiles_per_worker'].
+    """
+    max_tiles = extra_args.get('max_tiles_per_worker')
+    if not max_tiles:
+        return None
+    return max(1, max_tiles // get_chunk_size(cores, tile_count, extra_args.get('chunk_size')))
+
+
+def get_backend(extra_args):
+    """
+    Returns the backend the parts engine runs its workers on.  'process'
+    encodes on every core, 'thread' runs the workers as threads of this
+    process, so the tiles are not pickled and no process is started, which
+    is faster when the work is reading files, as with -imagery source.
+    Pillow releases the GIL while it decodes and encodes most formats, so
+    threads still share some of the encoding.  'auto', the default, picks
+    threads for -imagery source when the tiles are read ahead, as they are
+    by default on network file systems (see get_read_ahead()), and
+    processes otherwise.
+    """
+    backend = extra_args.get('backend') or 'auto'
+    if backend == 'auto':
+        return 'thread' if extra_args['imagery'] == 'source' and extra_args.get('read_ahead') else 'process'
+    return backend
+
+
+def make_pool(backend, cores, files, extra_args, progress=None):
+    """
+    Returns the pool of workers of the parts engine, see get_backend().
+    Thread workers are never recycled.  The workers count the tiles they
+    encode into progress, an optional SharedProgress.
+    """
+    if backend == 'thread':
+        return ThreadPool(cores, initializer=init_worker, initargs=(files, progress))
+    return Pool(cores, initializer=init_worker, initargs=(files, progress),
+                maxtasksperchild=get_tasks_per_worker(cores, len(files), extra_args))
+
+
+def submit_chunk(pool, file_list, extra_args, start, stop, name=None):
+    """Queues the tiles file_list[start:stop] on the pool, to be written to the part called name."""
+    if isinstance(file_list, TileIndex):
+        # the workers read the range out of the copy given to init_worker()
+        return pool.apply_async(sqlite_chunk_worker, [start, stop, extra_args, None, name])
+    return pool.apply_async(sqlite_chunk_worker, [start, stop, extra_args, file_list[start:stop], name])
+
+
+def plan_chunks(file_list, chunk_size, journal=None):
+    """
+    Returns the (chunk, start, stop) tuples of the chunks to encode: every
+    chunk of spatial_chunks(), or with a journal the chunks it has not
+    committed yet.  A resumed run keeps the chunks of its first attempt.
+    """
+    ranges = spatial_chunks(file_list, chunk_size)
+    if journal is None:
+        return [(chunk, start, stop) for chunk, (start, stop) in enumerate(ranges)]
+    return journal.plan(ranges)
+
+
+def part_name(journal, chunk):
+    """Returns the name of the part of chunk, None for a unique name when there is no journal."""
+    return None if journal is None else journal.part_name(chunk)
+
+
+def allocate(cores, pool, file_list, extra_args, journal=None):
+    """
+    Splits the tiles into small chunks and queues all of them on the pool.
+    Idle workers take the next chunk off the pool's shared task queue as
+    soon as they finish one, so a worker that lands on expensive tiles does
+    not hold the others up.  extra_args['chunk_size'] overrides the size
+    picked by get_chunk_size().  Chunks of a TileIndex follow its zoom and
+    column boundaries (see spatial_chunks()), so the .gpkg.part files they
+    produce hold disjoint tile ranges that combine_worker_dbs() appends
+    without INSERT OR REPLACE.  With a journal, only the chunks it has not
+    committed are queued, see plan_chunks().
+
+    Returns:
+    A list of [start, stop, attempts, AsyncResult, chunk] entries, one per
+    chunk.
+    """
+    chunk_size = get_chunk_size(cores, len(file_list), extra_args.get('chunk_size'))
+    return [[start, stop, 1, submit_chunk(pool, file_list, extra_args, start, stop, part_name(journal, chunk)), chunk]
+            for chunk, start, stop in plan_chunks(file_list, chunk_size, journal)]
+
+
+def write_worker_dbs(files, extra_args, threading, telemetry=None, journal=None):
+    """
+    Parts packaging engine.  Encodes every tile into .gpkg.part files in
+    extra_args['root_dir'], one per chunk, to be merged afterwards with
+    combine_worker_dbs().  A failed chunk is queued again until it has
+    been tried extra_args['chunk_attempts'] times.  With a journal, every
+    chunk is committed to it as soon as its part is complete, and the
+    chunks it already committed are skipped.
+
+    Inputs:
+    files -- the file_list dict made with file_count()
+    extra_args -- see sqlite_worker()
+    threading -- False to process every tile in this process (debugging)
+    telemetry -- optional Telemetry object receiving the progress, updated
+                 every few tiles the workers encode, and the encode and
+                 insert times summed over the workers
+    journal -- optional RunJournal of this run
+
+    extra_args['backend'] runs the workers as processes or threads, see
+    get_backend().  extra_args['workers'] sets the number of workers, see
+    get_worker_count().  extra_args['max_memory'] bounds the bytes of encoded tiles the
+    workers hold together, each one commits its part before its share is
+    exceeded.  extra_args['max_tiles_per_worker'] replaces a worker process
+    by a new one once it encoded about that many tiles, giving back what
+    its images and caches held.
+    """
+    if telemetry is None:
+        telemetry = Telemetry()
+    max_memory = extra_args.get('max_memory')
+    if not threading:
+        if max_memory is not None:
+            extra_args = dict(extra_args, commit_bytes=max_memory)
+        # Debugging call to bypass multiprocessing (-T)
+        if journal is None:
+            telemetry.start(len(files))
+            telemetry.merge(sqlite_worker(files, extra_args))
+            telemetry.finish()
+            return
+        chunks = plan_chunks(files, get_chunk_size(1, len(files), extra_args.get('chunk_size')), journal)
+        telemetry.start(sum(stop - start for _, start, stop in chunks))
+        for chunk, start, stop in chunks:
+            telemetry.merge(sqlite_chunk_worker(start, stop, extra_args, files[start:stop], journal.part_name(chunk)))
+            journal.commit(chunk)
+            telemetry.report()
+        telemetry.finish()
+        return
+    # Enable tiling on multiple CPU cores
+    backend = get_backend(extra_args)
+    cores = get_worker_count(backend, extra_args.get('workers'))
+    if max_memory is not None:
+        extra_args = dict(extra_args, commit_bytes=max(1, max_memory // cores))
+    max_attempts = extra_args.get('chunk_attempts', DEFAULT_CHUNK_ATTEMPTS)
+    progress = SharedProgress()
+    pool = make_pool(backend, cores, files, extra_args, progress)
+    try:
+        pending = allocate(cores, pool, files, extra_args, journal)
+        telemetry.start(sum(entry[1] - entry[0] for entry in pending))
+        while pending:
+            waiting = []
+            for entry in pending:
+                start, stop, attempts, result, chunk = entry
+                if not result.ready():
+                    waiting.append(entry)
+                elif result.successful():
+                    telemetry.merge(result.get())
+                    if journal is not None:
+                        journal.commit(chunk)
+                elif attempts < max_attempts:
+                    print("\nRetrying tiles {0} to {1}".format(start, stop))
+                    waiting.append([start, stop, attempts + 1,
+                                    submit_chunk(pool, files, extra_args, start, stop, part_name(journal, chunk)),
+                                    chunk])
+                else:
+                    # re-raises the exception of the last attempt
+                    result.get()
+            pending = waiting
+            # the tiles of the chunks still being encoded
+            telemetry.update_pending(progress.done)
+            telemetry.report()
+            if pending:
+                sleep(.25)
+        telemetry.finish()
+        pool.close()
+        pool.join()
+    except KeyboardInterrupt:
+        print(" Interrupted!")
+        if journal is not None:
+            print("Run again with the same options to resume.")
+        pool.terminate()
+        exit(1)
+    except Exception:
+        if journal is not None:
+            print("\nRun again with the same options to resume.")
+        pool.terminate()
+        raise
 
 
 def build_lut(file_list, lower_left, srs):
@@ -330,13 +863,12 @@ def build_lut(file_list, lower_left, srs):
         projection = ScaledWorldMercator()
     else:
         projection = EllipsoidalMercator()
-    # Create a list of zoom levels from the base directory
-    zoom_levels = list(set([int(item['z']) for item in file_list]))
-    print(zoom_levels)
-    zoom_levels.sort()
+    # Find the tile extents of every zoom level in one pass over the tiles
+    extents = zoom_extents(file_list)
     matrix = []
+    levels = {}
     # For every zoom in the list...
-    for zoom in zoom_levels:
+    for zoom in sorted(extents):
         # create a new ZoomMetadata object...
         level = ZoomMetadata()
         level.zoom = zoom
@@ -345,10 +877,9 @@ def build_lut(file_list, lower_left, srs):
         # in tiles "shifting" because of the way they are renumbered when
         # placed into a geopackage.
         # To fix, is there a zoom level preceding this one...
-        if zoom - 1 in [item for item in zoom_levels if item == (zoom - 1)]:
-            # there is, now retrieve it....
-            (prev,) = ([item for item in matrix if item.zoom == (zoom - 1)])
-            # and fix the grid alignment values
+        prev = levels.get(zoom - 1)
+        if prev is not None:
+            # there is, so fix the grid alignment values
             level.min_tile_row = 2 * prev.min_tile_row
             level.min_tile_col = 2 * prev.min_tile_col
             level.max_tile_row = 2 * prev.max_tile_row + 1
@@ -357,28 +888,15 @@ def build_lut(file_list, lower_left, srs):
             level.matrix_width = prev.matrix_width * 2
             level.matrix_height = prev.matrix_height * 2
         else:
-            # Get all possible x and y values...
-            x_vals = [int(item['x'])
-                      for item in file_list if int(item['z']) == zoom]
-            y_vals = [int(item['y'])
-                      for item in file_list if int(item['z']) == zoom]
-            # then get the min/max values for each.
-            level.min_tile_row, level.max_tile_row = min(x_vals), max(x_vals)
-            level.min_tile_col, level.max_tile_col = min(y_vals), max(y_vals)
+            # Get the min/max x and y values of this top level
+            level.min_tile_row, level.max_tile_row, level.min_tile_col, level.max_tile_col = extents[zoom]
             # Fill in the matrix width and height for this top level
-            x_width_max = max([item[
-                                   'x'] for item in file_list if item['z'] == level.zoom])
-            x_width_min = min([item[
-                                   'x'] for item in file_list if item['z'] == level.zoom])
-            level.matrix_width = (x_width_max - x_width_min) + 1
-            y_height_max = max([item[
-                                    'y'] for item in file_list if item['z'] == level.zoom])
-            y_height_min = min([item[
-                                    'y'] for item in file_list if item['z'] == level.zoom])
-            level.matrix_height = (y_height_max - y_height_min) + 1
+            level.matrix_width = (level.max_tile_row - level.min_tile_row) + 1
+            level.matrix_height = (level.max_tile_col - level.min_tile_col) + 1
         level.min_x, level.min_y, level.max_x, level.max_y = calculate_top_left(level, projection, lower_left)
         # Finally, add this ZoomMetadata object to the list
         matrix.append(level)
+        levels[zoom] = level
     return matrix
 
 
@@ -429,9 +947,9 @@ def build_lut_nsg(file_list, lower_left, srs, renumber):
         exit(1)
     # Currently, NSG profile support is only provided for epsg:4326.
     projection = GeodeticNSG()
-    # Create a list of zoom levels from the base directory
-    zoom_levels = list(set([int(item['z']) for item in file_list]))
-    zoom_levels.sort()
+    # Find the tile extents of every zoom level in one pass over the tiles
+    extents = zoom_extents(file_list)
+    zoom_levels = sorted(extents)
     # If renumbering tiles we cannot have the old zoom level 0, so we remove it completely.
     if renumber:
         zoom_levels = [z for z in zoom_levels if z != 0]
@@ -449,21 +967,8 @@ def build_lut_nsg(file_list, lower_left, srs, renumber):
         # to update tile matrix calculations and still keep the min and max tile lists for use in the
         # contents table bounding box. we use the actual zoom rather than the (possibly) renumbered zoom
         # to  make sure we grab the correct tile locations
-        # Get all possible x and y values...
-        x_vals = [int(item['x'])
-                  for item in file_list if int(item['z']) == zoom]
-        y_vals = [int(item['y'])
-                  for item in file_list if int(item['z']) == zoom]
-        # Fill in the matrix width and height for this top level
-        x_width_max = max(x_vals)
-        x_width_min = min(x_vals)
-        level.matrix_width = (x_width_max - x_width_min) + 1
-        y_height_max = max(y_vals)
-        y_height_min = min(y_vals)
-        level.matrix_height = (y_height_max - y_height_min) + 1
         # then get the min/max available tiles for each. - for use in metadata
-        level.min_tile_row, level.max_tile_row = min(x_vals), max(x_vals)
-        level.min_tile_col, level.max_tile_col = min(y_vals), max(y_vals)
+        level.min_tile_row, level.max_tile_row, level.min_tile_col, level.max_tile_col = extents[zoom]
         # Fill in the matrix width and height for this top level
         # Because of tiling differences, we need to set the min and max based on the tiling format (TMS vs WMTS)
         level.min_x, level.min_y, level.max_x, level.max_y = calculate_top_left(level, projection, lower_left)
@@ -476,39 +981,157 @@ def build_lut_nsg(file_list, lower_left, srs, renumber):
     return matrix
 
 
-def combine_worker_dbs(out_geopackage):
+def combine_worker_dbs(out_geopackage, tile_order=None, journal=None):
     """
     Searches for .gpkg.part files in the base directory and merges them
     into one Geopackage file
 
     Inputs:
     out_geopackage -- the final output geopackage file
+    tile_order -- optional space filling curve ('zorder' or 'hilbert') to
+                  store the tiles along, see Geopackage.order_tiles()
+    journal -- optional RunJournal, only the parts it committed are merged
+               instead of every .gpkg.part file in the base directory
     """
     base_dir = split(out_geopackage.file_path)[0]
     if base_dir == "":
         base_dir = "."
-    glob_path = join(base_dir + '/*.gpkg.part')
-    file_list = glob(glob_path)
+    if journal is not None:
+        file_list = journal.part_paths(base_dir)
+    else:
+        glob_path = join(base_dir + '/*.gpkg.part')
+        file_list = glob(glob_path)
     print("Merging temporary databases...")
-    # [out_geopackage.assimilate(f) for f in file_list]
-    itr = len(file_list)
-    status = ["|", "/", "-", "\\"]
-    counter = 0
-    for tdb in file_list:
-        comp = len(file_list) - itr
-        itr -= 1
-        out_geopackage.assimilate(tdb)
-        if tdb == file_list[-1]:
-            stdout.write("\r[X] Progress: [" + "==" * comp + "  " * itr + "]")
-        else:
-            stdout.write("\r[" + status[counter] + "] Progress: [" + "==" *
-                         comp + "  " * itr + "]")
-        stdout.flush()
-        if counter != len(status) - 1:
-            counter += 1
-        else:
-            counter = 0
-    print(" All geopackages merged!")
+    progress = Telemetry(len(file_list), unit="parts")
+    sizes = dict((tdb, getsize(tdb)) for tdb in file_list)
+
+    def merged(tdb):
+        progress.add(1, sizes[tdb])
+        progress.report()
+
+    out_geopackage.merge_parts(file_list, merged, tile_order)
+    progress.finish("All geopackages merged!")
+
+
+def get_max_memory(megabytes):
+    """Returns the -max_memory option in bytes, None if it is not set."""
+    return None if megabytes is None else int(megabytes * 2 ** 20)
+
+
+def run_settings(arg_list, extra_args):
+    """
+    Returns the options of a run that change the tiles written, see
+    make_run_id().
+    """
+    return dict(source_folder=abspath(arg_list.source_folder),
+                output_file=abspath(arg_list.output_file),
+                table_name=arg_list.table_name,
+                srs=arg_list.srs,
+                lower_left=extra_args['lower_left'],
+                imagery=arg_list.imagery,
+                jpeg_quality=arg_list.q,
+                nsg_profile=bool(arg_list.nsg_profile),
+                renumber=bool(arg_list.renumber))
+
+
+def get_output_profile(write_profile, existing):
+    """
+    Returns the WriteProfile the output geopackage is opened with.  A file
+    created by the run is written with write_profile, an existing one with
+    a journaled variant of it, so an interrupted run cannot corrupt the
+    tiles it held before, see WriteProfile.journaled().
+
+    Inputs:
+    write_profile -- the -write_profile option
+    existing -- whether the output file already holds tiles of an earlier run
+    """
+    profile = get_write_profile(write_profile)
+    return profile.journaled() if existing and profile is not None else profile
+
+
+def positive_int(value):
+    """argparse type of the options that are a count of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise ArgumentTypeError("{0} is not a positive integer".format(value))
+    return number
+
+
+def positive_float(value):
+    """argparse type of the options that are a size larger than 0."""
+    number = float(value)
+    if not number > 0:
+        raise ArgumentTypeError("{0} is not a positive number".format(value))
+    return number
+
+
+def source_stats(files, sources=None, io_threads=DEFAULT_IO_THREADS):
+    """
+    Returns the (size, mtime) of the source file of every tile of a run,
+    see make_run_id().
+
+    Inputs:
+    files -- the TileIndex of the tiles packaged
+    sources -- the sources returned by select_changed_tiles() for an
+               incremental run, which already hold them
+    io_threads -- the number of source files looked at the same time
+    """
+    if sources is not None:
+        return [source[-2:] for source in sources]
+    return stat_sources([files.path(position) for position in xrange(len(files))], io_threads)
+
+
+def update_output_metadata(gpkg, tile_info, sources=None):
+    """
+    Writes the tile matrix and bounds of the output geopackage.  After an
+    incremental run the sources of the tiles written are recorded as well,
+    and the tile matrix of the zoom levels without any tile left is removed.
+
+    Inputs:
+    gpkg -- the output Geopackage
+    tile_info -- the ZoomMetadata list of the whole tile set
+    sources -- the sources returned by select_changed_tiles(), None for
+               a run that is not incremental
+    """
+    gpkg.update_metadata(tile_info)
+    if sources is not None:
+        record_sources(gpkg, gpkg.tiles_table_name, sources)
+        remove_zoom_levels(gpkg, gpkg.tiles_table_name, [level.zoom for level in tile_info])
+
+
+def select_changed_tiles(gpkg, files, extra_args, io_threads=DEFAULT_IO_THREADS):
+    """
+    Compares the source tiles of an incremental run with the sources
+    recorded in the output geopackage by the previous one, so only the new
+    and changed tiles have to be encoded.
+
+    Inputs:
+    gpkg -- the output Geopackage, or None if it does not exist yet
+    files -- the TileIndex made with file_count()
+    extra_args -- see encode_tile_bytes()
+    io_threads -- the number of source files looked at the same time
+
+    Returns:
+    A (files, sources, stale, removed) tuple: the TileIndex of the tiles
+    to encode, the (zoom_level, tile_column, tile_row, path, size, mtime)
+    of their sources, to record with record_sources() once they are
+    written, the keys of the tiles to delete with remove_tiles() before
+    the new ones are written, and how many of those have no source anymore.
+    """
+    table_name = extra_args['table_name']
+    invert_y = get_invert_y(extra_args)
+    keys = [tile_key(z, x, y, extra_args, invert_y) for z, x, y in files.coordinates()]
+    paths = [files.path(position) for position in xrange(len(files))]
+    stats = stat_sources(paths, io_threads)
+    if gpkg is None:
+        stored, tile_keys = {}, set()
+    else:
+        stored, tile_keys = read_sources(gpkg, table_name), read_tile_keys(gpkg, table_name)
+    positions, vanished = compare_sources(keys, paths, stats, stored, tile_keys)
+    # a changed tile may be skipped this time, e.g. if it became fully transparent
+    stale = [keys[position] for position in positions if keys[position] in tile_keys] + vanished
+    sources = [keys[position] + (paths[position],) + stats[position] for position in positions]
+    return files.take(positions), sources, stale, len(vanished)
 
 
 def main(arg_list):
@@ -522,8 +1145,11 @@ def main(arg_list):
     """
     # TODO add argument for vector-tile format under imagery options
     # TODO add optional argument for "tiles" table name
+    telemetry = Telemetry()
     # Build the file dictionary
-    files = file_count(arg_list.source_folder)
+    io_threads = getattr(arg_list, 'io_threads', DEFAULT_IO_THREADS)
+    with telemetry.phase('discovery'):
+        files = file_count(arg_list.source_folder, io_threads, getattr(arg_list, 'manifest', None))
     if len(files) == 0:
         # If there are no files, exit the script
         print(" Ensure the correct source tile directory was specified.")
@@ -533,109 +1159,144 @@ def main(arg_list):
     # Get the output file destination directory
     root_dir, _ = split(arg_list.output_file)
     # Build the tile matrix info object
-    if arg_list.nsg_profile:
-        tile_info = build_lut_nsg(files, lower_left, arg_list.srs, arg_list.renumber)
-    else:
-        tile_info = build_lut(files, lower_left, arg_list.srs)
-
-    # Initialize the output file
-    if arg_list.threading:
-        # Enable tiling on multiple CPU cores
-        cores = cpu_count()
-        pool = Pool(cores)
-        # Build allocate dictionary
-        extra_args = dict(root_dir=root_dir,
-                          tile_info=tile_info,
-                          lower_left=lower_left,
-                          srs=arg_list.srs,
-                          imagery=arg_list.imagery,
-                          jpeg_quality=arg_list.q,
-                          nsg_profile=arg_list.nsg_profile,
-                          renumber=arg_list.renumber,
-                          table_name=arg_list.table_name)
-        results = allocate(cores, pool, files, extra_args)
-        status = ["|", "/", "-", "\\"]
-        counter = 0
-        try:
-            while True:
-                rem = sum([1 for item in results if not item.ready()])
-                if rem == 0:
-                    stdout.write("\r[X] Progress: [" + "==" * (cores - rem) +
-                                 "  " * rem + "]")
-                    stdout.flush()
-                    print(" All Done!")
-                    break
-                else:
-                    stdout.write("\r[" + status[counter] + "] Progress: [" +
-                                 "==" * (cores - rem) + "  " * rem + "]")
-                    stdout.flush()
-                    if counter != len(status) - 1:
-                        counter += 1
-                    else:
-                        counter = 0
-                sleep(.25)
-            pool.close()
-            pool.join()
-        except KeyboardInterrupt:
-            print(" Interrupted!")
-            pool.terminate()
-            exit(1)
-    else:
-        # Debugging call to bypass multiprocessing (-T)
-        extra_args = dict(root_dir=root_dir,
-                          tile_info=tile_info,
-                          lower_left=lower_left,
-                          srs=arg_list.srs,
-                          imagery=arg_list.imagery,
-                          jpeg_quality=arg_list.q,
-                          nsg_profile=arg_list.nsg_profile,
-                          renumber=arg_list.renumber,
-                          table_name=arg_list.table_name)
-        sqlite_worker(files, extra_args)
-    # Combine the individual temp databases into the output file
+    with telemetry.phase('lut'):
+        if arg_list.nsg_profile:
+            tile_info = build_lut_nsg(files, lower_left, arg_list.srs, arg_list.renumber)
+        else:
+            tile_info = build_lut(files, lower_left, arg_list.srs)
+
+    extra_args = dict(root_dir=root_dir,
+                      tile_info=tile_info,
+                      lower_left=lower_left,
+                      srs=arg_list.srs,
+                      imagery=arg_list.imagery,
+                      jpeg_quality=arg_list.q,
+                      nsg_profile=arg_list.nsg_profile,
+                      renumber=arg_list.renumber,
+                      table_name=arg_list.table_name,
+                      commit_size=getattr(arg_list, 'commit_size', DEFAULT_COMMIT_SIZE),
+                      chunk_size=getattr(arg_list, 'chunk_size', None),
+                      dedup=getattr(arg_list, 'dedup', False),
+                      workers=getattr(arg_list, 'workers', None),
+                      max_memory=get_max_memory(getattr(arg_list, 'max_memory', None)),
+                      max_tiles_per_worker=getattr(arg_list, 'max_tiles_per_worker', None),
+                      backend=getattr(arg_list, 'backend', 'auto'),
+                      read_ahead=getattr(arg_list, 'read_ahead', None),
+                      io_threads=io_threads)
+    if extra_args['read_ahead'] is None:
+        extra_args['read_ahead'] = get_read_ahead(arg_list.source_folder)
+    # built once here, so every worker is sent the offsets of every zoom level instead of finding them per tile
+    get_addressing(extra_args, get_invert_y(extra_args))
     # TODO GeoPackage and NSGGeoPackage need to be re-written to add Tiles or Vector tiles specifically
-    if not arg_list.nsg_profile:
-        with Geopackage(arg_list.output_file, arg_list.srs, arg_list.table_name) as gpkg:
-            gpkg.initialize()
-            combine_worker_dbs(gpkg)
+    gpkg_class = NsgGeopackage if arg_list.nsg_profile else Geopackage
+    engine = getattr(arg_list, 'engine', 'parts')
+    tile_order = getattr(arg_list, 'tile_order', None)
+    write_profile = getattr(arg_list, 'write_profile', BULK_LOAD)
+    deferred_index = getattr(arg_list, 'deferred_index', False)
+    incremental = getattr(arg_list, 'incremental', False)
+    workers = (extra_args['workers'] or cpu_count()) if arg_list.threading else 0
+    telemetry.info.update(engine=engine, imagery=arg_list.imagery, workers=workers,
+                          max_memory=extra_args['max_memory'], read_ahead=extra_args['read_ahead'],
+                          commit_size=extra_args['commit_size'], dedup=extra_args['dedup'], tile_order=tile_order,
+                          write_profile=write_profile, deferred_index=deferred_index, incremental=incremental)
+    if engine == 'parts' and arg_list.threading:
+        backend = get_backend(extra_args)
+        telemetry.info.update(backend=backend, workers=get_worker_count(backend, extra_args['workers']))
+    # an incremental run updates the output file if there is one
+    existing = incremental and exists(arg_list.output_file)
+    sources, stale = None, []
+    if incremental:
+        with telemetry.phase('compare'):
+            if existing:
+                with gpkg_class(arg_list.output_file, arg_list.srs, arg_list.table_name,
+                                get_output_profile(write_profile, existing)) as gpkg:
+                    files, sources, stale, removed = select_changed_tiles(gpkg, files, extra_args, io_threads)
+            else:
+                files, sources, stale, removed = select_changed_tiles(None, files, extra_args, io_threads)
+        print("{0} new or changed tiles, {1} tiles removed.".format(len(files), removed))
+        telemetry.info.update(changed=len(files), removed=removed)
+    if engine == 'stream':
+        # Encode on every core and write straight into the output file
+        with gpkg_class(arg_list.output_file, arg_list.srs, arg_list.table_name,
+                        get_output_profile(write_profile, existing)) as gpkg:
+            if not existing:
+                gpkg.initialize()
+            remove_tiles(gpkg, arg_list.table_name, stale)
+            if deferred_index:
+                # the workers finish their tiles in any order, index them once they are all written
+                gpkg.begin_bulk_load()
+            try:
+                stream_tiles(gpkg, files, extra_args, workers, telemetry)
+            except KeyboardInterrupt:
+                print(" Interrupted!")
+                exit(1)
+            if deferred_index:
+                with telemetry.phase('index'):
+                    gpkg.finish_bulk_load()
+            if tile_order is not None:
+                with telemetry.phase('order'):
+                    gpkg.order_tiles(tile_order)
             # Using the data in the output file, create the metadata for it
-            gpkg.update_metadata(tile_info)
-
+            update_output_metadata(gpkg, tile_info, sources)
     else:
-        with NsgGeopackage(arg_list.output_file, arg_list.srs, arg_list.table_name) as gpkg:
-            gpkg.initialize()
-            combine_worker_dbs(gpkg)
+        # The journal lets a run that was interrupted or failed be started again with the same options
+        journal = RunJournal(RunJournal.journal_path(arg_list.output_file),
+                             make_run_id(files, run_settings(arg_list, extra_args),
+                                         source_stats(files, sources, io_threads)))
+        if journal.clean(root_dir or '.'):
+            print("Removed the unfinished parts of the previous run.")
+        if journal.resumed:
+            print("Resuming the previous run, {0} chunks are done.".format(len(journal.committed())))
+        if journal.state == ENCODE and not existing and exists(arg_list.output_file):
+            # left by a run that was stopped before merging, or that packaged other tiles
+            remove(arg_list.output_file)
+        # the output file of a run stopped while merging already holds some of the parts
+        existing = existing or (journal.state == MERGE and exists(arg_list.output_file))
+        if journal.state == ENCODE:
+            write_worker_dbs(files, extra_args, arg_list.threading, telemetry, journal)
+        # Combine the individual temp databases into the output file
+        with gpkg_class(arg_list.output_file, arg_list.srs, arg_list.table_name,
+                        get_output_profile(write_profile, existing)) as gpkg:
+            if not existing:
+                gpkg.initialize()
+            if journal.state == ENCODE:
+                # only once, the tiles of the parts merged before a restart are not stale
+                remove_tiles(gpkg, arg_list.table_name, stale)
+                journal.state = MERGE
+            with telemetry.phase('merge'):
+                combine_worker_dbs(gpkg, tile_order, journal)
             # Using the data in the output file, create the metadata for it
-            gpkg.update_metadata(tile_info)
+            update_output_metadata(gpkg, tile_info, sources)
+        journal.finish()
 
     # we do a late write of the applicaiton id if its needed, to allow time for the database  connections to clear out
     if LooseVersion(sqlite_version) < LooseVersion(PRAGMA_MINIMUM_SQLITE_VERSION):
         write_geopackage_header(arg_list.output_file)
 
+    if getattr(arg_list, 'telemetry', None) is not None:
+        telemetry.write_summary(arg_list.telemetry)
     print("Complete")
 
 
-if __name__ == '__main__':
-    print("""
-        tiles2gpkg_parallel.py  Copyright (C) 2014  Reinventing Geospatial, Inc
-        This program comes with ABSOLUTELY NO WARRANTY.
-        This is free software, and you are welcome to redistribute it
-        under certain conditions.
-    """)
-    PARSER = ArgumentParser(description="Convert TMS folder into geopackage")
-    PARSER.add_argument("source_folder",
+def get_parser():
+    """
+    Returns the ArgumentParser of the command line options of tiles2gpkg,
+    whose parsed arguments are what main() takes.
+    """
+    parser = ArgumentParser(description="Convert TMS folder into geopackage")
+    parser.add_argument("source_folder",
                         metavar="source",
                         help="Source folder of TMS files.")
-    PARSER.add_argument("output_file",
+    parser.add_argument("output_file",
                         metavar="dest",
                         help="Destination file path.")
-    PARSER.add_argument("-tileorigin",
+    parser.add_argument("-tileorigin",
                         metavar="tile_origin",
                         help="Tile point of origin location. Valid options " +
                              "are ll, ul, nw, or sw.",
                         choices=["ll", "ul", "sw", "nw"],
                         default="ll")
-    PARSER.add_argument("-srs",
+    parser.add_argument("-srs",
                         metavar="srs",
                         help="Spatial reference " + "system. Valid options are"
                              + "3857, 4326, 3395, and 9804.",
@@ -644,41 +1305,152 @@ if __name__ == '__main__':
                         default=3857)
 
     # TODO: to support vector tiles, expand the choices to include "MVT" and "GeoJSON"
-    PARSER.add_argument("-imagery",
+    parser.add_argument("-imagery",
                         metavar="imagery",
                         help="Imagery type. Valid options are mixed, " +
                              "jpeg, png, or source.",
                         choices=["mixed", "jpeg", "png", "source"],
                         default="source")
 
-    PARSER.add_argument("-table_name",
+    parser.add_argument("-table_name",
                         metavar="table_name",
                         help="The name of the tiles table.",
                         default="tiles")
 
-    PARSER.add_argument("-q",
+    parser.add_argument("-q",
                         metavar="quality",
                         type=int,
                         default=75,
-                        help="Quality for jpeg images, 0-100. Default is 75",
+                        help="Quality for jpeg images, 0-100. Default is 75. Tiles that already are jpeg images " +
+                             "are stored as they are.",
                         choices=list(range(100)))
-    PARSER.add_argument("-a",
+    parser.add_argument("-commit_size",
+                        metavar="commit_size",
+                        type=positive_int,
+                        default=DEFAULT_COMMIT_SIZE,
+                        help="Number of tiles each worker writes per database transaction. Default is " +
+                             str(DEFAULT_COMMIT_SIZE))
+    parser.add_argument("-chunk_size",
+                        metavar="chunk_size",
+                        type=positive_int,
+                        default=None,
+                        help="Number of tiles the parts engine hands to a worker at a time. Default is picked from " +
+                             "the tile and core counts, at most " + str(DEFAULT_CHUNK_SIZE))
+    parser.add_argument("-workers",
+                        metavar="workers",
+                        type=positive_int,
+                        default=None,
+                        help="Number of worker processes encoding tiles. Default is one per CPU core.")
+    parser.add_argument("-max_memory",
+                        metavar="max_memory",
+                        type=positive_float,
+                        default=None,
+                        help="Megabytes of encoded tiles the workers may hold in memory at the same time, on top " +
+                             "of the images they are encoding. Workers commit or wait for the writer before " +
+                             "going over it. Default is no limit.")
+    parser.add_argument("-io_threads",
+                        metavar="io_threads",
+                        type=positive_int,
+                        default=DEFAULT_IO_THREADS,
+                        help="Number of directories scanned, of source files looked at by -incremental, and of " +
+                             "tile files each worker reads ahead (see -read_ahead), at the same time. Default is " +
+                             str(DEFAULT_IO_THREADS))
+    parser.add_argument("-max_tiles_per_worker",
+                        metavar="max_tiles_per_worker",
+                        type=positive_int,
+                        default=None,
+                        help="Replace a parts engine worker process by a new one after it encoded about this many " +
+                             "tiles, releasing the memory it held. Default is to keep every worker for the whole run.")
+    parser.add_argument("-backend",
+                        metavar="backend",
+                        help="What the parts engine workers run as. 'process' encodes on every core, 'thread' " +
+                             "avoids starting processes and copying tiles between them, which is faster when the " +
+                             "tiles are stored as they are. Valid options are " + ", ".join(BACKENDS) + ". " +
+                             "Default is auto: thread with -imagery source when tiles are read ahead, process " +
+                             "otherwise.",
+                        choices=BACKENDS,
+                        default="auto")
+    parser.add_argument("-read_ahead",
+                        metavar="read_ahead",
+                        type=int,
+                        default=None,
+                        help="Number of tile files each worker reads ahead of the one it is encoding. Default is " +
+                             "0 on local disks and " + str(NETWORK_READ_AHEAD) + " on network file systems such as " +
+                             "NFS.")
+    parser.add_argument("-engine",
+                        metavar="engine",
+                        help="Packaging engine. 'parts' has each worker write a .gpkg.part file that is merged " +
+                             "afterwards, 'stream' sends encoded tiles from the workers straight into the output " +
+                             "file. Valid options are parts or stream.",
+                        choices=["parts", "stream"],
+                        default="parts")
+    parser.add_argument("-manifest",
+                        metavar="manifest",
+                        help="Tile discovery manifest file. It is created if it does not exist, otherwise only the " +
+                             "directories that changed since it was written are scanned again.",
+                        default=None)
+    parser.add_argument("-telemetry",
+                        metavar="telemetry",
+                        help="Write a JSON summary of the run (tile counts, throughput and the time spent in each " +
+                             "phase) to this file.",
+                        default=None)
+    parser.add_argument("-dedup",
+                        dest="dedup",
+                        action="store_true",
+                        default=False,
+                        help="Encode identical source tiles, such as ocean or nodata tiles, only once per worker. " +
+                             "Every tile is still stored with its own data.")
+    parser.add_argument("-tile_order",
+                        metavar="tile_order",
+                        help="Store the tiles of every zoom level along a space filling curve over their column " +
+                             "and row, so map viewers read fewer database pages when panning. Valid options are " +
+                             "zorder or hilbert. Default is the order the tiles are packaged in.",
+                        choices=["zorder", "hilbert"],
+                        default=None)
+    parser.add_argument("-write_profile",
+                        metavar="write_profile",
+                        help="SQLite settings the output file is written with. 'bulk-load' is the fastest but the " +
+                             "file is lost if the run is interrupted, 'safe' commits every transaction durably. " +
+                             "An existing file, updated by -incremental or by a resumed run, is always written " +
+                             "with a rollback journal. " +
+                             "Valid options are " + ", ".join(sorted(WRITE_PROFILES)) + ". Default is " + BULK_LOAD,
+                        choices=sorted(WRITE_PROFILES),
+                        default=BULK_LOAD)
+    parser.add_argument("-deferred_index",
+                        dest="deferred_index",
+                        action="store_true",
+                        default=False,
+                        help="With the stream engine, write the tiles into a staging table without any index and " +
+                             "build the tiles table and its index in one sorted pass once every tile is encoded. " +
+                             "Faster once the index outgrows the SQLite cache, e.g. millions of small tiles, " +
+                             "slower for small tile sets. Cannot be used with the parts engine, which always " +
+                             "writes in tile order.")
+    parser.add_argument("-incremental",
+                        dest="incremental",
+                        action="store_true",
+                        default=False,
+                        help="Update the destination geopackage if it exists: only the tiles whose source file is " +
+                             "new or changed, by path, size and modification time, are encoded, and the tiles " +
+                             "whose source is gone are removed. The sources are recorded in the " +
+                             "tiles2gpkg_sources table. The existing file is written with a rollback journal, so " +
+                             "it is left intact if the run is interrupted.")
+    parser.add_argument("-a",
                         dest="append",
                         action="store_true",
                         default=False,
                         help="Append tile set to existing geopackage")
-    PARSER.add_argument("-T",
+    parser.add_argument("-T",
                         dest="threading",
                         action="store_false",
                         default=True,
                         help="Disable multiprocessing.")
-    PARSER.add_argument("-renumber",
+    parser.add_argument("-renumber",
                         dest="renumber",
                         action="store_true",
                         default=False,
                         help="Enable re-numbering tiles/zoom levels from standard Geodetic to NSG geodetic. Only valid"
                              "if the NSG Profile is enabled.")
-    group = PARSER.add_mutually_exclusive_group(required=False)
+    group = parser.add_mutually_exclusive_group(required=False)
     group.add_argument("-nsg",
                        dest="nsg_profile",
                        help="Enforce NSG Profile Requirements on output GeoPackage. Currently Requires data to"
@@ -690,12 +1462,25 @@ if __name__ == '__main__':
                        dest="nsg_profile",
                        help="Follow OGC GeoPackage specification without NSG Profile additions",
                        action='store_false')
-    PARSER.set_defaults(nsg_profile=False)
+    parser.set_defaults(nsg_profile=False)
+    return parser
+
 
+if __name__ == '__main__':
+    print("""
+        tiles2gpkg_parallel.py  Copyright (C) 2014  Reinventing Geospatial, Inc
+        This program comes with ABSOLUTELY NO WARRANTY.
+        This is free software, and you are welcome to redistribute it
+        under certain conditions.
+    """)
+    PARSER = get_parser()
     ARG_LIST = PARSER.parse_args()
-    if not exists(ARG_LIST.source_folder) or exists(ARG_LIST.output_file):
+    # the destination of a parts engine run that was interrupted is resumed
+    RESUMABLE = ARG_LIST.engine == 'parts' and exists(RunJournal.journal_path(ARG_LIST.output_file))
+    if not exists(ARG_LIST.source_folder) or \
+            (exists(ARG_LIST.output_file) and not (ARG_LIST.incremental or RESUMABLE)):
         PARSER.print_usage()
-        print("Ensure that TMS directory exists and out file does not.")
+        print("Ensure that TMS directory exists and out file does not, or use -incremental to update it.")
         exit(1)
     if ARG_LIST.q is not None and ARG_LIST.imagery == 'png':
         PARSER.print_usage()
@@ -705,6 +1490,10 @@ if __name__ == '__main__':
         PARSER.print_usage()
         print("-nsg requires that -srs be set to 4326")
         exit(1)
+    if ARG_LIST.deferred_index and ARG_LIST.engine != 'stream':
+        PARSER.print_usage()
+        print("-deferred_index requires that -engine be set to stream")
+        exit(1)
     if not ARG_LIST.nsg_profile and ARG_LIST.renumber:
         PARSER.print_usage()
         print("-renumber requires that the -nsg flag also be active")
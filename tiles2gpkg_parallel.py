@@ -254,7 +254,7 @@ def worker_map(temp_db, tile_dict, extra_args, invert_y):
     else:
         print("NONE IOPEN temp_db.insert_image_blob(zoom=%s, x_row=%s, y_column=%s"%(zoom, x_row, y_column))
         file_handle = open(tile_dict['path'], 'rb')
-        data = buffer(file_handle.read())
+        data = sbinary(file_handle.read())
         temp_db.insert_image_blob(zoom, x_row, y_column, data)
         file_handle.close()
 